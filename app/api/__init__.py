@@ -4,5 +4,7 @@ from app.api.order import router as order
 from app.api.public import router as public
 from app.api.admin import router as admin
 from app.api.balance import router as balance
+from app.api.health import router as health
+from app.api.metrics import router as metrics
 
-__all__ = ["auth", "instrument", "order", "public", "admin", "balance"]
+__all__ = ["auth", "instrument", "order", "public", "admin", "balance", "health", "metrics"]
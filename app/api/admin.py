@@ -1,42 +1,36 @@
-from fastapi import APIRouter, Header, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends
 from typing import Optional
 from app.models.user import User
-from app.models.balance import Balance
-from app.schemas.balance import BalanceDepositRequest, BalanceWithdrawRequest
-from app.services.auth import get_user_by_token
+from app.schemas.balance import (
+    BalanceDepositRequest,
+    BalanceWithdrawRequest,
+    BalanceBulkRequest,
+    BalanceBulkResponse,
+    BalanceBulkFailure
+)
+from app.core.config import settings
+from app.services.auth import AuthUser, get_admin_user, auth_cache
 from uuid import UUID
+from tortoise.exceptions import IntegrityError
 from app.models.instrument import Instrument
 from app.schemas.instrument import InstrumentCreate
+from app.services.sharding import matcher
+from app.services.marketdata import hub
+from app.services.orderbook_cache import orderbook_cache
+from app.services.instruments import instruments
+from app.services import balance as balance_service
+from app.services.balance import InsufficientFunds
+from app.services.ledger import ledger
+from app.services.settlement import settled
+from app.services.candles import candles
 
 router = APIRouter(prefix="/admin",tags=["admin"])
 
-async def verify_admin(authorization: Optional[str] = Header(None)):
-    if not authorization:
-        raise HTTPException(status_code=401, detail="Authorization header is missing")
-    
-    # Remove 'TOKEN ' prefix if present
-    token = authorization.replace('TOKEN ', '') if authorization.startswith('TOKEN ') else authorization
-    
-    user = await User.get_by_token(token)
-    if not user or not user.is_admin:
-        raise HTTPException(status_code=403, detail="Access denied")
-    return user
-
 @router.delete("/user/{user_id}")
 async def delete_user(
     user_id: str,
-    authorization: str = Header(..., alias="Authorization"),
+    admin_user: AuthUser = Depends(get_admin_user),
 ):
-    # Проверяем токен и получаем пользователя
-    admin_user = await get_user_by_token(authorization)
-
-    # Проверяем, что пользователь - администратор
-    if admin_user.role != "ADMIN":
-        raise HTTPException(
-            status_code=403,
-            detail="Only admin users can perform this action"
-        )
-    
     # Удаляем целевого пользователя
     deleted_count = await User.filter(id=user_id).delete()
     
@@ -45,28 +39,26 @@ async def delete_user(
             status_code=404,
             detail="User not found"
         )
+    auth_cache.invalidate_user(user_id)
+    ledger.drop_user(user_id)
     
     return {"success": True}
 
 @router.post("/instrument")
 async def create_instrument(
     instrument: InstrumentCreate,
-    authorization: str = Header(..., alias="Authorization")
+    admin_user: AuthUser = Depends(get_admin_user)
 ):
-    admin_user = await get_user_by_token(authorization)
-    print(admin_user.role)
-    if admin_user.role != "ADMIN":
-        raise HTTPException(status_code=403, detail="Admin access required")
     # Проверяем, что тикер уникален
-    exists = await Instrument.get_or_none(ticker=instrument.ticker)
-    if exists:  
+    if instruments.get(instrument.ticker):
         raise HTTPException(status_code=400, detail="Instrument with this ticker already exists")
-    await Instrument.create(name=instrument.name, ticker=instrument.ticker)
+    created = await Instrument.create(name=instrument.name, ticker=instrument.ticker)
+    instruments.add(created)
     return {"success": True}
 @router.post("/balance/deposit")
 async def deposit_balance(
     deposit_data: BalanceDepositRequest,
-    authorization: str = Header(None, alias="Authorization"),
+    admin_user: AuthUser = Depends(get_admin_user),
 ):
     """
     Пополнение баланса пользователя (только для администраторов)
@@ -76,54 +68,30 @@ async def deposit_balance(
     - ticker: Тикер инструмента (например, "MEMCOIN")
     - amount: Сумма пополнения (целое число > 0)
     """
-    # Проверяем авторизацию и права администратора
-    admin_user = await get_user_by_token(authorization)
-    if admin_user.role != "ADMIN":
-        raise HTTPException(
-            status_code=403,
-            detail="Only admin users can perform this action"
-        )
-
-    # Проверяем существование пользователя
-    user = await User.get_or_none(id=deposit_data.user_id)
-    if not user:
-        raise HTTPException(
-            status_code=404,
-            detail="User not found"
-        )
-
     # Проверяем существование инструмента
-    instrument = await Instrument.get_or_none(ticker=deposit_data.ticker)
+    instrument = instruments.get(deposit_data.ticker)
     if not instrument:
         raise HTTPException(
             status_code=404,
             detail="Instrument not found"
         )
 
-    # Проверяем сумму (должна быть положительной)
-    if deposit_data.amount <= 0:
+    # Один атомарный upsert: amount = amount + x (None - пользователя нет)
+    new_amount = await balance_service.credit(deposit_data.user_id, instrument.id, deposit_data.amount)
+    if new_amount is None:
         raise HTTPException(
-            status_code=422,
-            detail="Amount must be positive"
+            status_code=404,
+            detail="User not found"
         )
-
-    # Обновляем баланс (или создаем новую запись)
-    balance, created = await Balance.get_or_create(
-        user=user,
-        instrument=instrument,
-        defaults={"amount": deposit_data.amount}
-    )
-    
-    if not created:
-        balance.amount += deposit_data.amount
-        await balance.save()
+    ledger.credit(deposit_data.user_id, instrument.ticker, deposit_data.amount)
 
     return {"success": True}
 
-@router.post("/balance/withdraw")
+# С журналом - после записи сделок в базу: её проверка видит их
+@router.post("/balance/withdraw", dependencies=[Depends(settled)])
 async def withdraw_balance(
     withdraw_data: BalanceWithdrawRequest,
-    authorization: str = Header(None, alias="Authorization"),
+    admin_user: AuthUser = Depends(get_admin_user),
 ):
     """
     Списание средств с баланса пользователя (только для администраторов)
@@ -133,91 +101,129 @@ async def withdraw_balance(
     - ticker: Тикер инструмента (например, "MEMCOIN")
     - amount: Сумма списания (целое число > 0)
     """
-    # Проверяем авторизацию и права администратора
-    admin_user = await get_user_by_token(authorization)
-    if admin_user.role != "ADMIN":
-        raise HTTPException(
-            status_code=403,
-            detail="Only admin users can perform this action"
-        )
-
-    # Проверяем существование пользователя
-    user = await User.get_or_none(id=withdraw_data.user_id)
-    if not user:
-        raise HTTPException(
-            status_code=404,
-            detail="User not found"
-        )
-
     # Проверяем существование инструмента
-    instrument = await Instrument.get_or_none(ticker=withdraw_data.ticker)
+    instrument = instruments.get(withdraw_data.ticker)
     if not instrument:
         raise HTTPException(
             status_code=404,
             detail="Instrument not found"
         )
 
-    # Проверяем сумму (должна быть положительной)
-    if withdraw_data.amount <= 0:
+    # Проверка по доступному (без резерва под ордера) остатку в памяти, затем
+    # условное списание в базе: amount >= x
+    try:
+        await ledger.withdraw(withdraw_data.user_id, instrument.ticker, withdraw_data.amount)
+    except InsufficientFunds as e:
+        if not e.current_balance and not await User.exists(id=withdraw_data.user_id):
+            raise HTTPException(
+                status_code=404,
+                detail="User not found"
+            )
         raise HTTPException(
             status_code=422,
-            detail="Amount must be positive"
+            detail={
+                "error": "Insufficient funds",
+                "current_balance": e.current_balance,
+                "required": e.required
+            }
         )
 
-    # Проверка существования баланса пользователя
-    balance = await Balance.get_or_none(
-        user=user,
-        instrument=instrument
-    )
-    
-    # Если баланса нет или средств недостаточно
-    if not balance or balance.amount < withdraw_data.amount:
-        current_balance = balance.amount if balance else 0
+    return {"success": True}
+
+@router.post("/balance/bulk", response_model=BalanceBulkResponse, dependencies=[Depends(settled)])
+async def bulk_balance(
+    bulk_data: BalanceBulkRequest,
+    admin_user: AuthUser = Depends(get_admin_user),
+):
+    """
+    Массовое пополнение или списание балансов (только для администраторов)
+
+    Пользователи проверяются одним запросом, инструменты берутся из реестра,
+    списания - по доступным остаткам в памяти и затем по заблокированным
+    (SELECT ... FOR UPDATE) строкам в базе, все изменения пишутся одним
+    multi-row upsert в одной транзакции.
+    Ошибки возвращаются по строкам; при atomic=true любая ошибка отменяет
+    весь пакет (422).
+    """
+    user_ids = {row.user_id for row in bulk_data.rows}
+    existing = {str(user_id) for user_id in await User.filter(id__in=user_ids).values_list("id", flat=True)}
+
+    sign = 1 if bulk_data.operation == "deposit" else -1
+    failures = []
+    accepted = []  # (index в запросе, строка для apply_bulk)
+    for index, row in enumerate(bulk_data.rows):
+        instrument = instruments.get(row.ticker)
+        if str(row.user_id) not in existing:
+            failures.append(BalanceBulkFailure(index=index, error="User not found"))
+        elif not instrument:
+            failures.append(BalanceBulkFailure(index=index, error="Instrument not found"))
+        else:
+            accepted.append((index, (row.user_id, instrument.ticker, sign * row.amount)))
+
+    if failures and bulk_data.atomic:
         raise HTTPException(
             status_code=422,
-            detail={
-                "error": "Insufficient funds",
-                "current_balance": current_balance,
-                "required": withdraw_data.amount
-            }
+            detail=[failure.model_dump() for failure in failures]
         )
 
-    # Списание средств
-    balance.amount -= withdraw_data.amount
-    await balance.save()
+    rejected = await ledger.apply_bulk([row for _, row in accepted], atomic=bulk_data.atomic)
+    failures.extend(BalanceBulkFailure(index=accepted[i][0], error=error) for i, error in rejected)
+    failures.sort(key=lambda failure: failure.index)
 
-    return {"success": True}
+    if failures and bulk_data.atomic:
+        raise HTTPException(
+            status_code=422,
+            detail=[failure.model_dump() for failure in failures]
+        )
+
+    return BalanceBulkResponse(
+        success=not failures,
+        applied=len(bulk_data.rows) - len(failures),
+        failed=failures
+    )
 
-@router.delete("/instrument/{ticker}", response_model=dict)
+@router.delete("/instrument/{ticker}", response_model=dict, dependencies=[Depends(settled)])
 async def delete_instrument(
     ticker: str,
-    authorization: str = Header(..., alias="Authorization")
+    admin_user: AuthUser = Depends(get_admin_user)
 ):
     """
     Удаление инструмента по тикеру (только для администраторов)
     
     Параметры:
     - ticker: Тикер инструмента (например "BTC")
-    - authorization: Токен авторизации в заголовке
     
     Возвращает:
     - {"success": true} при успешном удалении
+    - 409, если по инструменту уже были сделки: история сделок не удаляется
+    - 409 для инструмента котировки (QUOTE_TICKER): без него приложение не работает
     """
-    # Проверяем права администратора
-    admin_user = await get_user_by_token(authorization)
-    if admin_user.role != "ADMIN":
+    if ticker == settings.QUOTE_TICKER:
+        raise HTTPException(status_code=409, detail="The quote instrument cannot be deleted")
+    # Ищем и удаляем инструмент; сделки журнала к этому моменту уже в базе (settled)
+    try:
+        deleted_count = await Instrument.filter(ticker=ticker).delete()
+    except IntegrityError:
         raise HTTPException(
-            status_code=403,
-            detail="Admin access required"
+            status_code=409,
+            detail="Instrument has trades and cannot be deleted"
         )
     
-    # Ищем и удаляем инструмент
-    deleted_count = await Instrument.filter(ticker=ticker).delete()
-    
     if not deleted_count:
         raise HTTPException(
             status_code=404,
             detail="Instrument not found"
         )
+    instruments.remove(ticker)
+    await matcher.drop(ticker)
+    await ledger.drop_ticker(ticker)
+    candles.drop_ticker(ticker)
+    hub.close(ticker)
+    orderbook_cache.invalidate(ticker)
     
-    return {"success": True}
\ No newline at end of file
+    return {"success": True}
+
+@router.get("/auth-cache")
+async def auth_cache_stats(admin_user: AuthUser = Depends(get_admin_user)):
+    """Счётчики попаданий/промахов кэша API ключей"""
+    return auth_cache.stats()
\ No newline at end of file
@@ -1,13 +1,10 @@
-from fastapi import APIRouter, Header, HTTPException
-from app.services.auth import get_user_by_token
-from app.models.balance import Balance
+from fastapi import APIRouter, Depends
+from app.services.auth import AuthUser, get_current_user
+from app.services.ledger import ledger
 
 router = APIRouter(tags=["balance"])
 
 @router.get("/balance")
-async def get_balances(
-    authorization: str = Header(..., alias="Authorization")
-):
-    user = await get_user_by_token(authorization)
-    balances = await Balance.filter(user=user).prefetch_related("instrument")
-    return {bal.instrument.ticker: bal.amount for bal in balances}
\ No newline at end of file
+async def get_balances(user: AuthUser = Depends(get_current_user)):
+    """Available (not reserved by open orders) amount per ticker, from the ledger"""
+    return await ledger.available(str(user.id))
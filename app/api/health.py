@@ -0,0 +1,33 @@
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+from app.core.config import settings
+from app.services.journal import journal
+from app.services.readiness import startup
+from app.services.sharding import matcher
+
+router = APIRouter(tags=["health"])
+
+@router.get("/health")
+async def health():
+    """Liveness: the process is up and serving; 503 once a matching shard has
+    been unreachable for MATCHING_UNHEALTHY_AFTER_S"""
+    down_for = matcher.down_for()
+    if down_for > settings.MATCHING_UNHEALTHY_AFTER_S:
+        return JSONResponse(status_code=503, content={"status": "matching unreachable", "down_s": round(down_for, 1)})
+    return {"status": "ok"}
+
+@router.get("/ready")
+async def ready():
+    """Readiness: 200 once the in-memory state is warm, 503 before that, while
+    shutting down, while a matching shard is unreachable and once a journal
+    write has failed (orders are refused from then on).
+
+    The body carries the startup timings of each phase.
+    """
+    down_for = matcher.down_for()
+    report = startup.report()
+    report["matching_down_s"] = round(down_for, 1)
+    if journal.error is not None:
+        report["journal_error"] = repr(journal.error)
+    ready = startup.ready and not down_for and journal.error is None
+    return JSONResponse(status_code=200 if ready else 503, content=report)
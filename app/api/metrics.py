@@ -0,0 +1,10 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from app.services import metrics as metrics_service
+
+router = APIRouter(tags=["metrics"])
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus text exposition of request, DB and event-loop metrics"""
+    return PlainTextResponse(metrics_service.render(), media_type="text/plain; version=0.0.4")
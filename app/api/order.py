@@ -1,84 +1,317 @@
-from fastapi import APIRouter, HTTPException, Header, Depends, Security
+from fastapi import APIRouter, HTTPException, Depends, Body, Query
+from fastapi.responses import StreamingResponse
 from typing import Optional, List
-from uuid import UUID
+from collections import defaultdict
+from uuid import UUID, uuid4
 from datetime import datetime
-from fastapi.security import APIKeyHeader
 
-from app.models.order import Order
-from app.models.instrument import Instrument
-from app.models.user import User
+from tortoise.expressions import Q
+from tortoise.transactions import in_transaction
+
+from app.models.order import Order, NEW, CANCELLED
+from app.services.auth import AuthUser, get_current_user
+from app.services.matching import BookOrder, GTC, engine, mark_cancelled, open_orders, order_status
+from app.services.sharding import matcher
+from app.services.journal import journal
+from app.services.ledger import ledger
+from app.services.settlement import settled, place_orders, cancel_order, cancel_user_orders
+from app.services.instruments import instruments
+from app.services.pagination import encode_cursor, decode_cursor
+from app.services.serialization import dumps, json_response
 from app.schemas.order import (
     OrderCreateRequest,
     OrderCreateResponse,
     OrderDetailResponse,
     OrderListResponse,
     OrderDeleteResponse,
-    OrderBodyResponse
+    OrderCancelAllResponse,
+    OrderBodyResponse,
+    OrderBatchItemResponse
 )
 
 router = APIRouter(prefix="/order", tags=["order"])
 
-api_key_header = APIKeyHeader(name="Authorization", auto_error=False)
+MAX_BATCH_SIZE = 1000
+STREAM_BATCH_SIZE = 500
 
-async def get_current_user(authorization: str = Security(api_key_header)):
-    if not authorization:
-        raise HTTPException(status_code=401, detail="Authorization header is missing")
-    
-    # Remove 'TOKEN ' prefix if present
-    token = authorization.replace('TOKEN ', '') if authorization.startswith('TOKEN ') else authorization
-    
-    user = await User.get_by_token(token)
-    if not user:
-        raise HTTPException(status_code=401, detail="Invalid API key")
-    return user
+def order_detail(order: Order) -> OrderDetailResponse:
+    """Build the public representation of an order"""
+    return OrderDetailResponse(
+        id=str(order.id),
+        status=order.status,
+        user_id=order.user_id,
+        timestamp=order.created_at,
+        body=OrderBodyResponse(
+            direction=order.direction,
+            ticker=order.ticker,
+            qty=order.qty,
+            price=order.price
+        ),
+        filled=order.filled
+    )
+
+def order_row(order: Order) -> dict:
+    """Same JSON as order_detail, as a plain dict for serialization.dumps"""
+    return {
+        "id": str(order.id),
+        "status": order.status,
+        "user_id": order.user_id,
+        "timestamp": order.created_at,
+        "body": {
+            "direction": order.direction,
+            "ticker": order.ticker,
+            "qty": order.qty,
+            "price": order.price,
+        },
+        "filled": order.filled,
+    }
+
+async def _not_placed(orders: List[BookOrder], resting: List[Order], error: Exception) -> HTTPException:
+    """Matching failed (e.g. the shard is gone): the orders are not on the book,
+    so their rows are closed and their reservations released"""
+    if resting:
+        await Order.filter(id__in=[order.id for order in resting], status=NEW).update(status=CANCELLED)
+    for order in orders:
+        ledger.release(order.id)
+    if isinstance(error, ConnectionError):
+        return HTTPException(status_code=503, detail="Matching engine is unavailable, retry later")
+    return HTTPException(status_code=500, detail="Order matching failed")
 
 @router.post("", response_model=OrderCreateResponse)
 async def create_order(
     order: OrderCreateRequest,
-    user: User = Depends(get_current_user)
+    user: AuthUser = Depends(get_current_user)
 ):
     """Create a new order"""
     # Check if instrument exists
-    instrument = await Instrument.get_by_ticker(order.ticker)
+    instrument = instruments.get(order.ticker)
     if not instrument:
         raise HTTPException(status_code=404, detail=f"Instrument {order.ticker} not found")
+
+    # С журналом ордер в базу пишется в фоне, ответ - после fsync журнала
+    if journal.active:
+        order_id, = await place_orders(user.id, [order])
+        if order_id is None:
+            raise HTTPException(status_code=400, detail="Insufficient funds")
+        return OrderCreateResponse(order_id=order_id)
     
-    # Create order with explicit UUID conversion
-    order_obj = await Order.create(
+    order_obj = Order(
+        id=uuid4(),
         user_id=user.id,  # user.id is already UUID
-        status="NEW",
-        body=order.model_dump(),
+        status=NEW,
+        ticker=order.ticker,
+        direction=order.direction,
+        qty=order.qty,
+        price=order.price,
         filled=0
     )
-    
+    book_order = BookOrder(
+        id=str(order_obj.id),
+        user_id=str(user.id),
+        direction=order.direction,
+        qty=order.qty,
+        price=order.price,
+        time_in_force=order.time_in_force
+    )
+    if order.price is None and not engine.has_liquidity(order.ticker, order.direction):
+        # Рыночному ордеру не с чем исполниться: отменяется сразу, без резерва и матчинга
+        order_obj.status = CANCELLED
+        await order_obj.save()
+        return OrderCreateResponse(order_id=str(order_obj.id))
+    # Проверка и резерв средств в памяти, до любой записи в базу
+    if not await ledger.reserve(order.ticker, book_order):
+        raise HTTPException(status_code=400, detail="Insufficient funds")
+
+    if order.time_in_force == GTC:
+        # Остаток встанет в стакан - ордер должен быть в базе раньше
+        await order_obj.save()
+        try:
+            fills = await matcher.submit(order.ticker, book_order)
+        except Exception as error:
+            raise await _not_placed([book_order], [order_obj], error) from error
+        if fills:
+            await ledger.persist_fills([(instrument, book_order, fills)])
+    else:
+        # IOC/FOK/рыночный в стакане не остаётся: сначала матчинг в памяти,
+        # потом ордер с итоговым статусом и его сделки одной транзакцией
+        try:
+            fills = await matcher.submit(order.ticker, book_order)
+        except Exception as error:
+            raise await _not_placed([book_order], [], error) from error
+        order_obj.filled = book_order.filled
+        order_obj.status = order_status(book_order.filled, order.qty, order.time_in_force)
+        await ledger.persist_fills([(instrument, book_order, fills)], [order_obj])
+    ledger.matched(book_order)
+
     return OrderCreateResponse(order_id=str(order_obj.id))
 
-@router.get("", response_model=List[OrderDetailResponse])
-async def get_orders(user: User = Depends(get_current_user)):
-    """Get all orders for the authenticated user"""
-    # Get all orders for user
-    orders = await Order.filter(user_id=str(user.id))
-    
-    # Format orders for response
-    order_list = []
+@router.post("/batch", response_model=List[OrderBatchItemResponse])
+async def create_orders_batch(
+    orders: List[OrderCreateRequest] = Body(..., min_length=1, max_length=MAX_BATCH_SIZE),
+    user: AuthUser = Depends(get_current_user)
+):
+    """Create several orders at once.
+
+    GTC orders are inserted with one statement in one transaction and then
+    everything is matched in request order; IOC, FOK and market orders are
+    written after matching together with all trades of the batch. Orders
+    for unknown instruments or without funds to reserve are reported per
+    item and do not affect the rest of the batch.
+    """
+    results = []
+    placed = []  # (order, instrument, элемент ответа)
     for order in orders:
-        order_list.append(
-            OrderDetailResponse(
-                id=str(order.id),
-                status=order.status,
-                user_id=order.user_id,
-                timestamp=order.created_at,
-                body=OrderBodyResponse(**order.body),
-                filled=order.filled
-            )
+        instrument = instruments.get(order.ticker)
+        item = OrderBatchItemResponse()
+        if not instrument:
+            item.success, item.error = False, f"Instrument {order.ticker} not found"
+        else:
+            placed.append((order, instrument, item))
+        results.append(item)
+
+    if journal.active:
+        order_ids = await place_orders(user.id, [order for order, _, _ in placed])
+        for (_, _, item), order_id in zip(placed, order_ids):
+            if order_id is None:
+                item.success, item.error = False, "Insufficient funds"
+            else:
+                item.order_id = order_id
+        return results
+
+    # Средства резервируются под все ордера пакета до матчинга
+    matches = []
+    items = []
+    unmatched = []  # рыночные без встречных заявок: пишутся сразу отменёнными
+    for order, instrument, item in placed:
+        order_obj = Order(
+            id=uuid4(),
+            user_id=user.id,
+            status=NEW,
+            ticker=order.ticker,
+            direction=order.direction,
+            qty=order.qty,
+            price=order.price,
+            filled=0
         )
-    
-    return order_list
+        book_order = BookOrder(
+            id=str(order_obj.id),
+            user_id=str(user.id),
+            direction=order.direction,
+            qty=order.qty,
+            price=order.price,
+            time_in_force=order.time_in_force
+        )
+        if order.price is None and not engine.has_liquidity(order.ticker, order.direction):
+            order_obj.status = CANCELLED
+            unmatched.append(order_obj)
+            item.order_id = str(order_obj.id)
+            continue
+        if not await ledger.reserve(order.ticker, book_order):
+            item.success, item.error = False, "Insufficient funds"
+            continue
+        item.order_id = str(order_obj.id)
+        matches.append((instrument, order_obj, book_order))
+        items.append(item)
+
+    resting = [order_obj for _, order_obj, book_order in matches if book_order.time_in_force == GTC]
+    if resting:
+        async with in_transaction("default"):
+            await Order.bulk_create(resting)
 
-@router.get("/{order_id}", response_model=OrderDetailResponse)
+    fills = await matcher.submit_many([(instrument.ticker, book_order) for instrument, _, book_order in matches])
+    failed = {index for index, order_fills in enumerate(fills) if isinstance(order_fills, Exception)}
+    if failed:
+        # Шард недоступен: эти ордера не в стакане, остальные пакета - как обычно
+        error = await _not_placed(
+            [matches[index][2] for index in failed],
+            [matches[index][1] for index in failed if matches[index][2].time_in_force == GTC],
+            fills[min(failed)]
+        )
+        for index in failed:
+            items[index].success, items[index].error, items[index].order_id = False, error.detail, None
+        matches = [match for index, match in enumerate(matches) if index not in failed]
+        fills = [order_fills for index, order_fills in enumerate(fills) if index not in failed]
+
+    # IOC/FOK/рыночные пишутся вместе со сделками, уже с итоговым статусом
+    immediate = unmatched
+    for _, order_obj, book_order in matches:
+        if book_order.time_in_force != GTC:
+            order_obj.filled = book_order.filled
+            order_obj.status = order_status(book_order.filled, book_order.qty, book_order.time_in_force)
+            immediate.append(order_obj)
+    await ledger.persist_fills([
+        (instrument, book_order, order_fills)
+        for (instrument, _, book_order), order_fills in zip(matches, fills)
+    ], immediate)
+    for _, _, book_order in matches:
+        ledger.matched(book_order)
+
+    return results
+
+def _after_cursor(query, cursor: str):
+    """Keyset condition: rows strictly older than the cursor position"""
+    created_at, order_id = decode_cursor(cursor)
+    try:
+        order_id = UUID(order_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return query.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=order_id))
+
+async def _stream_orders(query):
+    """Encode every matching order as one JSON array, STREAM_BATCH_SIZE rows at a time"""
+    yield b"["
+    first = True
+    last = None
+    while True:
+        page = query if last is None else query.filter(
+            Q(created_at__lt=last.created_at) | Q(created_at=last.created_at, id__lt=last.id)
+        )
+        orders = await page.limit(STREAM_BATCH_SIZE)
+        for order in orders:
+            chunk = dumps(order_row(order))
+            yield chunk if first else b"," + chunk
+            first = False
+        if len(orders) < STREAM_BATCH_SIZE:
+            break
+        last = orders[-1]
+    yield b"]"
+
+@router.get("", response_model=List[OrderDetailResponse], dependencies=[Depends(settled)])
+async def get_orders(
+    user: AuthUser = Depends(get_current_user),
+    status: Optional[str] = Query(default=None, examples=["NEW", "FILLED"]),
+    ticker: Optional[str] = Query(default=None),
+    limit: Optional[int] = Query(default=None, ge=1, le=1000),
+    cursor: Optional[str] = Query(default=None, description="X-Next-Cursor предыдущей страницы")
+):
+    """Get orders of the authenticated user, newest first.
+
+    With `limit` a single page is returned and X-Next-Cursor points to the
+    next one. Without it the whole history is streamed in keyset-paginated
+    batches, so memory use does not depend on how many orders there are.
+    """
+    query = Order.filter(user_id=user.id)
+    if status:
+        query = query.filter(status=status)
+    if ticker:
+        query = query.filter(ticker=ticker)
+    if cursor:
+        query = _after_cursor(query, cursor)
+    query = query.order_by("-created_at", "-id")
+
+    if limit is None:
+        return StreamingResponse(_stream_orders(query), media_type="application/json")
+
+    orders = await query.limit(limit)
+    headers = {}
+    if len(orders) == limit:
+        headers["X-Next-Cursor"] = encode_cursor(orders[-1].created_at, orders[-1].id)
+    return json_response([order_row(order) for order in orders], headers=headers)
+
+@router.get("/{order_id}", response_model=OrderDetailResponse, dependencies=[Depends(settled)])
 async def get_order(
     order_id: UUID,
-    user: User = Depends(get_current_user)
+    user: AuthUser = Depends(get_current_user)
 ):
     """Get information about a specific order"""
     # Get order
@@ -86,47 +319,73 @@ async def get_order(
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
     
-    # Debug information
-    print(f"Order user_id: {order.user_id}, type: {type(order.user_id)}")
-    print(f"User id: {user.id}, type: {type(user.id)}")
-    
     # Check if order belongs to user
     if str(order.user_id) != str(user.id):
         raise HTTPException(status_code=403, detail="Access denied")
     
-    return OrderDetailResponse(
-        id=str(order.id),
-        status=order.status,
-        user_id=order.user_id,
-        timestamp=order.created_at,
-        body=OrderBodyResponse(**order.body),
-        filled=order.filled
-    )
+    return order_detail(order)
+
+async def _cancel_error(order_id: UUID, user: AuthUser) -> HTTPException:
+    """Why an order could not be cancelled; only after the cancel itself missed"""
+    await settled()
+    order = await Order.get_or_none(id=order_id)
+    if not order:
+        return HTTPException(status_code=404, detail="Order not found")
+    if str(order.user_id) != str(user.id):
+        return HTTPException(status_code=403, detail="Access denied")
+    return HTTPException(status_code=400, detail="Order cannot be deleted")
+
+@router.delete("", response_model=OrderCancelAllResponse)
+async def cancel_orders(
+    user: AuthUser = Depends(get_current_user),
+    ticker: Optional[str] = Query(default=None, description="только ордера этого инструмента")
+):
+    """Cancel every open order of the authenticated user (of one instrument).
+
+    Each book takes the orders off in a single change and one UPDATE marks
+    those it had CANCELLED, so the cost does not grow with the number of
+    orders. The books go first: an order saved but not submitted yet is
+    not in a book, stays open and rests as usual.
+    """
+    if journal.active:
+        return OrderCancelAllResponse(cancelled=await cancel_user_orders(user.id, ticker))
+
+    by_ticker = defaultdict(dict)
+    for order_id, order_ticker, direction, qty, price in await open_orders(user.id, ticker=ticker):
+        by_ticker[order_ticker][order_id] = (direction, qty, price)
+    cancelled = []
+    for order_ticker, orders in by_ticker.items():
+        for order_id, filled in await matcher.cancel_many(order_ticker, list(orders)):
+            direction, qty, price = orders[order_id]
+            ledger.cancelled(order_id, user.id, order_ticker, direction, price, qty - filled)
+            cancelled.append((order_id, filled))
+
+    # filled - из стакана, сделки могут ещё писаться
+    await mark_cancelled(cancelled)
+    return OrderCancelAllResponse(cancelled=len(cancelled))
 
 @router.delete("/{order_id}", response_model=OrderDeleteResponse)
 async def delete_order(
     order_id: UUID,
-    user: User = Depends(get_current_user)
+    user: AuthUser = Depends(get_current_user)
 ):
-    """Delete an order"""
-    # Get order
-    order = await Order.get_or_none(id=order_id)
-    if not order:
-        raise HTTPException(status_code=404, detail="Order not found")
-    
-    # Debug information
-    print(f"Order user_id: {order.user_id}, type: {type(order.user_id)}")
-    print(f"User id: {user.id}, type: {type(user.id)}")
-    
-    # Check if order belongs to user
-    if str(order.user_id) != str(user.id):
-        raise HTTPException(status_code=403, detail="Access denied")
-    
-    # Check if order can be deleted (only NEW orders can be deleted)
-    if order.status != "NEW":
+    """Cancel an open order: its remainder leaves the book, the order stays with status CANCELLED"""
+    if journal.active:
+        # Статус в базе поменяет settler
+        if not await cancel_order(user.id, str(order_id)):
+            raise await _cancel_error(order_id, user)
+        return OrderDeleteResponse()
+
+    found = await open_orders(user.id, order_id=order_id)
+    if not found:
+        raise await _cancel_error(order_id, user)
+    _, ticker, direction, qty, price = found[0]
+    # Сначала стакан: статус меняем только у ордера, который там был
+    filled = await matcher.cancel(ticker, str(order_id))
+    if filled is None:
+        # Исполнен в памяти целиком (FILLED допишет persist_fills) или ещё не выставлен
         raise HTTPException(status_code=400, detail="Order cannot be deleted")
+    ledger.cancelled(str(order_id), user.id, ticker, direction, price, qty - filled)
+    await mark_cancelled([(str(order_id), filled)])
     
-    # Delete order
-    await order.delete()
-    
-    return OrderDeleteResponse()
\ No newline at end of file
+    return OrderDeleteResponse()
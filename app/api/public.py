@@ -1,14 +1,23 @@
-from fastapi import APIRouter, HTTPException, Query
+from fastapi import APIRouter, HTTPException, Depends, Header, Query, Response, WebSocket, WebSocketDisconnect
+from app.core.database import read_only
 from app.models.user import User
-from app.models.instrument import Instrument
-from app.models.order import Order
+from app.models.trade import Trade
 from app.schemas.user import UserCreate, UserResponse
 # from app.schemas.instrument import InstrumentListResponse
-from app.schemas.orderbook import OrderbookResponse, PriceLevel
+from app.schemas.orderbook import OrderbookResponse
 from app.schemas.transaction import TransactionResponse
-from typing import List
+from app.schemas.candle import CandleResponse
+from app.services.candles import candles
+from app.services.instruments import instruments
+from app.services.pagination import encode_cursor, decode_cursor
+from app.services.marketdata import hub, LAGGED
+from app.services.orderbook_cache import orderbook_cache
+from app.services.serialization import json_response
+from typing import List, Literal, Optional
+from datetime import datetime, timezone
 import uuid
-from tortoise.expressions import RawSQL
+import asyncio
+from tortoise.expressions import Q, RawSQL
 
 router = APIRouter(prefix="/public", tags=["public"])
 
@@ -31,100 +40,153 @@ async def register_user(user_data: UserCreate):
         api_key=user.api_key
     )
 
-@router.get("/instrument")
+@router.get("/instrument", dependencies=[Depends(read_only)])
 async def instrument():
-    instruments = await Instrument.all().values("name", "ticker")
-    return instruments
+    return instruments.listing()
 
-@router.get("/orderbook/{ticker}", response_model=OrderbookResponse)
+@router.get("/orderbook/{ticker}", response_model=OrderbookResponse, dependencies=[Depends(read_only)])
 async def get_orderbook(
     ticker: str,
-    limit: int = Query(default=10, ge=1, le=100)
+    limit: int = Query(default=10, ge=1, le=100),
+    if_none_match: Optional[str] = Header(default=None)
 ):
-    """Get current orderbook for a specific instrument"""
+    """Get current orderbook for a specific instrument.
+
+    The response carries an ETag that changes with the book; send it back
+    in If-None-Match to get 304 Not Modified while the book is unchanged.
+    """
     # Check if instrument exists
-    instrument = await Instrument.get_or_none(ticker=ticker)
+    instrument = instruments.get(ticker)
     if not instrument:
         raise HTTPException(status_code=404, detail=f"Instrument {ticker} not found")
     
-    # Get active orders
-
-    orders = await Order.filter(
-        status="NEW",
-        body__contains={"ticker": ticker}  # Фильтрация по ticker в JSON
-    ).all()
-
-    # Сортировка по убыванию цены
-    active_orders = sorted(
-        orders,
-        key=lambda x: x.body.get("price", 0),
-        reverse=True
-    )
-    
-    # Separate buy and sell orders
-    bid_levels = {}  # price -> total_qty for buy orders
-    ask_levels = {}  # price -> total_qty for sell orders
-    
-    for order in active_orders:
-        price = order.body["price"]
-        qty = order.body["qty"]
-        direction = order.body["direction"]
-        
-        if direction == "BUY":
-            bid_levels[price] = bid_levels.get(price, 0) + qty
-        else:  # SELL
-            ask_levels[price] = ask_levels.get(price, 0) + qty
-    
-    # Convert to list of PriceLevel objects and sort
-    bid_levels_list = [
-        PriceLevel(price=price, qty=qty)
-        for price, qty in sorted(bid_levels.items(), reverse=True)[:limit]
-    ]
-    
-    ask_levels_list = [
-        PriceLevel(price=price, qty=qty)
-        for price, qty in sorted(ask_levels.items())[:limit]
-    ]
-    
-    return OrderbookResponse(
-        bid_levels=bid_levels_list,
-        ask_levels=ask_levels_list
-    )
+    # Готовые байты ответа, пересобираются только при изменении книги
+    body, etag = orderbook_cache.get(ticker, limit)
+    if orderbook_cache.not_modified(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+
+    return Response(content=body, media_type="application/json", headers={"ETag": etag})
 
-@router.get("/transactions/{ticker}", response_model=List[TransactionResponse])
+@router.get("/transactions/{ticker}", response_model=List[TransactionResponse], dependencies=[Depends(read_only)])
 async def get_transactions(
     ticker: str,
-    limit: int = Query(default=10, ge=1, le=100)
+    limit: int = Query(default=10, ge=1, le=100),
+    cursor: Optional[str] = Query(default=None, description="X-Next-Cursor предыдущей страницы")
 ):
-    """Get transaction history for a specific instrument"""
+    """Get transaction history for a specific instrument, newest first"""
     # Check if instrument exists
-    instrument = await Instrument.get_or_none(ticker=ticker)
+    instrument = instruments.get(ticker)
     if not instrument:
         raise HTTPException(status_code=404, detail=f"Instrument {ticker} not found")
     
-    # Получаем все ордера с статусом FILLED и нужным тикером
-    orders = await Order.filter(
-        status="FILLED",
-        body__contains={"ticker": ticker}  # Фильтрация по ticker в JSON
-    ).all()
-
-    # Сортируем по дате создания (новые сначала) и применяем лимит
-    filled_orders = sorted(
-        orders,
-        key=lambda x: x.created_at,
-        reverse=True
-    )[:limit]  # Применяем лимит после сортировки
-    
-    # Convert to transaction list
-    transactions = []
-    for order in filled_orders:
-        transactions.append(
-            TransactionResponse(
-                ticker=order.body["ticker"],
-                amount=order.body["qty"],
-                price=order.body["price"],
-                timestamp=order.created_at
-            )
+    query = Trade.filter(instrument_id=instrument.id)
+    if cursor:
+        executed_at, trade_id = decode_cursor(cursor)
+        if not trade_id.isdigit():
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        query = query.filter(
+            Q(executed_at__lt=executed_at) | Q(executed_at=executed_at, id__lt=int(trade_id))
         )
+    trades = await query.order_by("-executed_at", "-id").limit(limit)
+
+    # Курсор на следующую (более старую) страницу
+    headers = {}
+    if len(trades) == limit:
+        headers["X-Next-Cursor"] = encode_cursor(trades[-1].executed_at, trades[-1].id)
     
-    return transactions 
\ No newline at end of file
+    # Поля и порядок как в TransactionResponse
+    return json_response(
+        [
+            {
+                "ticker": trade.ticker,
+                "amount": trade.qty,
+                "price": trade.price,
+                "timestamp": trade.executed_at,
+            }
+            for trade in trades
+        ],
+        headers=headers
+    )
+
+def _epoch(value: Optional[datetime]) -> Optional[float]:
+    if value is None:
+        return None
+    # Без часового пояса - UTC
+    return (value if value.tzinfo else value.replace(tzinfo=timezone.utc)).timestamp()
+
+@router.get("/candles/{ticker}", response_model=List[CandleResponse], dependencies=[Depends(read_only)])
+async def get_candles(
+    ticker: str,
+    interval: Literal["1m", "5m", "1h", "1d"] = Query(default="1m"),
+    start: Optional[datetime] = Query(default=None, description="не раньше, по началу свечи"),
+    end: Optional[datetime] = Query(default=None, description="раньше этого, по началу свечи"),
+    limit: int = Query(default=100, ge=1, le=1000)
+):
+    """Get OHLCV candles for a specific instrument, oldest first.
+
+    Returns up to `limit` latest candles starting in [start, end). Periods
+    are aligned to UTC; a period without trades has no candle.
+    """
+    instrument = instruments.get(ticker)
+    if not instrument:
+        raise HTTPException(status_code=404, detail=f"Instrument {ticker} not found")
+
+    rows = await candles.history(instrument, interval, _epoch(start), _epoch(end), limit)
+    # Поля и порядок как в CandleResponse
+    return json_response([
+        {
+            "timestamp": datetime.fromtimestamp(candle_start, timezone.utc),
+            "open": candle[0],
+            "high": candle[1],
+            "low": candle[2],
+            "close": candle[3],
+            "volume": candle[4],
+        }
+        for candle_start, candle in rows
+    ])
+
+@router.websocket("/ws/{ticker}")
+async def stream_market_data(
+    websocket: WebSocket,
+    ticker: str,
+    depth: int = Query(default=100, ge=1, le=1000)
+):
+    """Stream a book snapshot, then sequence-numbered L2 deltas and trades.
+
+    The first message is {"type": "snapshot", "seq": n, "bids", "asks"}
+    with `depth` levels per side. Every following {"type": "update"} has
+    seq n+1, n+2, ... and carries the new qty of each touched level (0 =
+    level removed, possibly outside the snapshot depth) plus the trades of
+    that book change. A client that falls too far behind is closed with
+    code 1013 and should reconnect for a fresh snapshot.
+    """
+    if not instruments.get(ticker):
+        await websocket.close(code=1008, reason=f"Instrument {ticker} not found")
+        return
+
+    await websocket.accept()
+    subscriber = hub.subscribe(ticker, depth)
+
+    async def forward():
+        while True:
+            message = await subscriber.queue.get()
+            if message is LAGGED:
+                await websocket.close(code=1013, reason="Subscriber too slow, resubscribe")
+                return
+            await websocket.send_text(message)
+
+    async def wait_disconnect():
+        # Клиенту нечего присылать; читаем только чтобы заметить закрытие
+        try:
+            while True:
+                await websocket.receive_text()
+        except WebSocketDisconnect:
+            pass
+
+    tasks = [asyncio.create_task(forward()), asyncio.create_task(wait_disconnect())]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
+        hub.unsubscribe(subscriber)
\ No newline at end of file
@@ -1,7 +1,91 @@
 from pydantic import BaseModel
+from os import getenv
 
 class Settings(BaseModel):
     PROJECT_NAME: str = "CoolMarket API"
     API_V1_STR: str = "/api/v1"
 
+    # production: схема только через app/scripts/migrate.py; generate_schemas при старте -
+    # удобство для разработки и тестов, в production не включается
+    ENVIRONMENT: str = getenv("ENVIRONMENT", "development")
+    GENERATE_SCHEMAS: bool = ENVIRONMENT != "production" and getenv("GENERATE_SCHEMAS", "1") == "1"
+
+    # База данных. DB_URL целиком заменяет DB_USER/DB_PASSWORD/DB_HOST/DB_PORT/DB_NAME,
+    # DB_READ_URL - реплика для эндпоинтов только на чтение
+    DB_URL: str = getenv("DB_URL", "")
+    DB_READ_URL: str = getenv("DB_READ_URL", "")
+    DB_POOL_MIN: int = int(getenv("DB_POOL_MIN", 1))
+    DB_POOL_MAX: int = int(getenv("DB_POOL_MAX", 10))
+    DB_READ_POOL_MAX: int = int(getenv("DB_READ_POOL_MAX", 10))
+    DB_STATEMENT_CACHE_SIZE: int = int(getenv("DB_STATEMENT_CACHE_SIZE", 100))
+    DB_CONNECT_TIMEOUT: float = float(getenv("DB_CONNECT_TIMEOUT", 10))
+    DB_COMMAND_TIMEOUT: float = float(getenv("DB_COMMAND_TIMEOUT", 30))  # 0 - без ограничения
+    DB_POOL_MAX_IDLE: float = float(getenv("DB_POOL_MAX_IDLE", 300))
+
+    # Кэш API ключей
+    AUTH_CACHE_SIZE: int = int(getenv("AUTH_CACHE_SIZE", 10000))
+    AUTH_CACHE_TTL: float = float(getenv("AUTH_CACHE_TTL", 60))
+    AUTH_CACHE_WARMUP: int = int(getenv("AUTH_CACHE_WARMUP", 1000))  # ключей при старте
+
+    # Логирование запросов
+    LOG_FILE: str = getenv("LOG_FILE", "app.log")
+    LOG_LEVEL: str = getenv("LOG_LEVEL", "INFO")
+    LOG_SAMPLE_RATE: float = float(getenv("LOG_SAMPLE_RATE", 1.0))
+    LOG_BODY_MAX_BYTES: int = int(getenv("LOG_BODY_MAX_BYTES", 0))  # 0 - тело не пишем
+    LOG_REDACT_HEADERS: str = getenv("LOG_REDACT_HEADERS", "authorization,cookie,set-cookie")
+
+    # Лимиты запросов: роль.класс=запросов_в_секунду/всплеск, 0 - без лимита.
+    # Классы: order, read, market_data, auth, admin; ANON - запросы без ключа (по IP)
+    RATE_LIMIT_ENABLED: bool = getenv("RATE_LIMIT_ENABLED", "1") == "1"
+    RATE_LIMITS: str = getenv(
+        "RATE_LIMITS",
+        "USER.order=50/100,USER.read=50/100,USER.market_data=100/200,USER.auth=5/20,USER.admin=5/10,"
+        "ANON.market_data=50/100,ANON.auth=2/10,"
+        "ADMIN.order=500/1000,ADMIN.read=500/1000,ADMIN.market_data=1000/2000"
+    )
+    # Запросов в работе одновременно, дальше 503; 0 - без ограничения
+    MAX_CONCURRENT_REQUESTS: int = int(getenv("MAX_CONCURRENT_REQUESTS", 200))
+
+    # Матчинг в отдельных процессах: число шардов (0 - в процессе API), каталог
+    # их Unix сокетов и запускать ли шарды из API (0 - запущены отдельно через
+    # python -m app.services.sharding, например для нескольких uvicorn workers)
+    MATCHING_SHARDS: int = int(getenv("MATCHING_SHARDS", 0))
+    MATCHING_SOCKET_DIR: str = getenv("MATCHING_SOCKET_DIR", "/tmp/coolmarket-matching")
+    MATCHING_SPAWN: bool = getenv("MATCHING_SPAWN", "1") == "1"
+    # Недоступный шард переподключается сам; если дольше этого, /health
+    # отвечает 503, чтобы оркестратор перезапустил процесс
+    MATCHING_UNHEALTHY_AFTER_S: float = float(getenv("MATCHING_UNHEALTHY_AFTER_S", 30))
+
+    # Журнал ордеров, отмен и сделок: пусто - выключен, ордера пишутся в базу
+    # синхронно. С журналом запрос ждёт только fsync батча (не дольше окна
+    # группового коммита), а в базу события пишутся пачками в фоне.
+    # Только с матчингом в процессе API (MATCHING_SHARDS=0)
+    JOURNAL_DIR: str = getenv("JOURNAL_DIR", "")
+    JOURNAL_COMMIT_WINDOW_MS: float = float(getenv("JOURNAL_COMMIT_WINDOW_MS", 2))
+    JOURNAL_BATCH_MAX: int = int(getenv("JOURNAL_BATCH_MAX", 1000))
+    JOURNAL_SEGMENT_MB: int = int(getenv("JOURNAL_SEGMENT_MB", 64))
+    JOURNAL_SETTLE_INTERVAL_MS: float = float(getenv("JOURNAL_SETTLE_INTERVAL_MS", 50))
+
+    # Балансы: инструмент, в котором платят за покупки (qty * price), и как
+    # часто изменения от сделок сбрасываются в базу (без журнала)
+    QUOTE_TICKER: str = getenv("QUOTE_TICKER", "RUB")
+    LEDGER_FLUSH_INTERVAL_MS: float = float(getenv("LEDGER_FLUSH_INTERVAL_MS", 100))
+    # Несколько API процессов (uvicorn workers с общими шардами): проверка и
+    # резерв средств - условным UPDATE в базе, а не в памяти одного процесса
+    LEDGER_SHARED: bool = getenv(
+        "LEDGER_SHARED", "1" if int(getenv("MATCHING_SHARDS", 0)) and getenv("MATCHING_SPAWN", "1") == "0" else "0"
+    ) == "1"
+
+    # Свечи OHLCV: сколько последних свечей на тикер и период держать в памяти
+    # и как часто изменённые сбрасываются в базу
+    CANDLES_MEMORY: int = int(getenv("CANDLES_MEMORY", 1000))
+    CANDLES_FLUSH_INTERVAL_MS: float = float(getenv("CANDLES_FLUSH_INTERVAL_MS", 1000))
+
+    # Как часто перечитывать инструменты: созданные и удалённые через другой
+    # API процесс; 0 - не перечитывать (один процесс)
+    INSTRUMENTS_REFRESH_MS: float = float(getenv("INSTRUMENTS_REFRESH_MS", 1000))
+
+    # WebSocket рассылка: сколько сообщений может ждать медленный клиент
+    MARKETDATA_BUFFER_SIZE: int = int(getenv("MARKETDATA_BUFFER_SIZE", 1000))
+
 settings = Settings() 
\ No newline at end of file
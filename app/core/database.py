@@ -1,4 +1,9 @@
-from tortoise import Tortoise
+from contextvars import ContextVar
+from typing import Optional
+
+from tortoise import Tortoise, connections
+from tortoise.backends.base.config_generator import expand_db_url
+from tortoise.exceptions import ConfigurationError
 from app.core.config import settings
 from dotenv import load_dotenv
 from os import getenv
@@ -10,19 +15,107 @@ DB_HOST = getenv("DB_HOST")
 DB_PORT = getenv("DB_PORT")
 DB_NAME = getenv("DB_NAME")
 
-TORTOISE_ORM = {
-    "connections": {
-        "default": f"postgres://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
-    },
-    "apps": {
-        "models": {
-            "models": ["app.models.user", "app.models.order", "app.models.instrument", "app.models.balance"],
-            "default_connection": "default",
+MODELS = ["app.models.user", "app.models.order", "app.models.instrument", "app.models.balance", "app.models.trade", "app.models.journal", "app.models.candle"]
+
+# Запросы на чтение в этом контексте идут в соединение "read"
+_read_only: ContextVar[bool] = ContextVar("db_read_only", default=False)
+
+
+def _connection(url: str, maxsize: int):
+    """Connection config with pool settings applied (asyncpg only)"""
+    try:
+        config = expand_db_url(url)
+    except ConfigurationError:
+        # Окружение не настроено - ошибка всплывёт в init_db, не при импорте
+        return url
+    if config["engine"] != "tortoise.backends.asyncpg":
+        return url
+    config["credentials"].update({
+        "minsize": settings.DB_POOL_MIN,
+        "maxsize": maxsize,
+        # 0 - без кэша подготовленных запросов, нужно за pgbouncer в transaction mode
+        "statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE,
+        "timeout": settings.DB_CONNECT_TIMEOUT,
+        "command_timeout": settings.DB_COMMAND_TIMEOUT or None,
+        "max_inactive_connection_lifetime": settings.DB_POOL_MAX_IDLE,
+    })
+    return config
+
+
+def build_config(url: Optional[str] = None, read_url: Optional[str] = None) -> dict:
+    """Tortoise config: "default" for writes, optional "read" pool for read-only endpoints.
+
+    The read connection points at DB_READ_URL (a replica) or, without it,
+    at the primary with its own pool, so heavy reads do not take
+    connections from order entry. SQLite has no read pool.
+    """
+    url = url or settings.DB_URL or f"postgres://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+    read_url = read_url or settings.DB_READ_URL
+    config = {
+        "connections": {
+            "default": _connection(url, settings.DB_POOL_MAX)
         },
-    },
-}
+        "apps": {
+            "models": {
+                "models": MODELS,
+                "default_connection": "default",
+            },
+        },
+    }
+    if read_url or not url.startswith("sqlite"):
+        config["connections"]["read"] = _connection(read_url or url, settings.DB_READ_POOL_MAX)
+        config["routers"] = ["app.core.database.ReadRouter"]
+    return config
+
+
+TORTOISE_ORM = build_config()
+
+
+def configure(url: Optional[str] = None, read_url: Optional[str] = None):
+    """Point TORTOISE_ORM at another database before init_db (scripts, benchmarks)"""
+    TORTOISE_ORM.clear()
+    TORTOISE_ORM.update(build_config(url, read_url))
+
 
-async def init_db():
-    """Initialize database connection"""
+class ReadRouter:
+    """Sends reads of read_only requests to the "read" connection.
+
+    Writes and reads inside in_transaction() always use "default".
+    """
+
+    def db_for_read(self, model):
+        return "read" if _read_only.get() else "default"
+
+    def db_for_write(self, model):
+        return "default"
+
+
+async def read_only():
+    """Dependency for public market data endpoints: route their queries to the read pool.
+
+    Reads scoped to a user stay on the primary: a replica lagging behind
+    would hide the orders the user has just placed. Each request runs in
+    its own task, so the flag does not leak into others.
+    """
+    _read_only.set(True)
+
+
+async def init_db(generate_schemas: bool = True):
+    """Initialize database connection.
+
+    The schema is managed by app/scripts/migrate.py; generate_schemas is
+    a development shortcut and never runs in production.
+    """
     await Tortoise.init(config=TORTOISE_ORM)
-    await Tortoise.generate_schemas()
\ No newline at end of file
+    if generate_schemas:
+        await Tortoise.generate_schemas()
+
+
+async def open_pools():
+    """Open every configured pool now instead of on the first request"""
+    for name in TORTOISE_ORM["connections"]:
+        await connections.get(name).execute_query("SELECT 1")
+
+
+async def close_db():
+    await Tortoise.close_connections()
@@ -0,0 +1,36 @@
+-- Исходная схема, от которой считаются остальные миграции: пустая база
+-- получает её здесь, а база, созданная раньше generate_schemas, уже её
+-- имеет (IF NOT EXISTS). Ордер хранится в JSON body - колонки из него
+-- выносит 0001; reserved у балансов добавляет 0007.
+CREATE TABLE IF NOT EXISTS users (
+    id UUID NOT NULL PRIMARY KEY,
+    name VARCHAR(255) NOT NULL,
+    api_key VARCHAR(255) NOT NULL UNIQUE,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    role VARCHAR(20) NOT NULL DEFAULT 'USER'
+);
+
+CREATE TABLE IF NOT EXISTS instruments (
+    id UUID NOT NULL PRIMARY KEY,
+    ticker VARCHAR(10) NOT NULL UNIQUE,
+    name VARCHAR(255) NOT NULL,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS orders (
+    id UUID NOT NULL PRIMARY KEY,
+    user_id UUID NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'NEW',
+    body JSONB NOT NULL,
+    filled INT NOT NULL DEFAULT 0,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS balances (
+    id SERIAL NOT NULL PRIMARY KEY,
+    amount BIGINT NOT NULL DEFAULT 0,
+    instrument_id UUID NOT NULL REFERENCES instruments (id) ON DELETE CASCADE,
+    user_id UUID NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+    CONSTRAINT uid_balances_user_id_624f8c UNIQUE (user_id, instrument_id)
+);
+CREATE INDEX IF NOT EXISTS idx_balances_user_id_624f8c ON balances (user_id, instrument_id);
@@ -0,0 +1,31 @@
+-- Типизированные колонки ордера вместо JSON body и индексы под горячие запросы.
+-- body остаётся (nullable) для отката, новые ордера его не заполняют.
+DO $$
+BEGIN
+    IF EXISTS (
+        SELECT 1 FROM information_schema.columns
+        WHERE table_name = 'orders' AND column_name = 'body'
+    ) THEN
+        ALTER TABLE orders
+            ADD COLUMN IF NOT EXISTS ticker VARCHAR(10),
+            ADD COLUMN IF NOT EXISTS direction VARCHAR(4),
+            ADD COLUMN IF NOT EXISTS qty INT,
+            ADD COLUMN IF NOT EXISTS price DOUBLE PRECISION;
+
+        UPDATE orders SET
+            ticker = body->>'ticker',
+            direction = body->>'direction',
+            qty = (body->>'qty')::INT,
+            price = (body->>'price')::DOUBLE PRECISION
+        WHERE ticker IS NULL;
+
+        ALTER TABLE orders
+            ALTER COLUMN ticker SET NOT NULL,
+            ALTER COLUMN direction SET NOT NULL,
+            ALTER COLUMN qty SET NOT NULL,
+            ALTER COLUMN body DROP NOT NULL;
+    END IF;
+END $$;
+
+CREATE INDEX IF NOT EXISTS idx_orders_ticker_status_price ON orders (ticker, status, price);
+CREATE INDEX IF NOT EXISTS idx_orders_user_created ON orders (user_id, created_at);
@@ -0,0 +1,17 @@
+-- Append-only таблица сделок. Индекс совпадает с порядком выдачи
+-- GET /public/transactions/{ticker}: новые сначала, id как tie-breaker.
+CREATE TABLE IF NOT EXISTS trades (
+    id BIGSERIAL PRIMARY KEY,
+    instrument_id UUID NOT NULL REFERENCES instruments (id) ON DELETE CASCADE,
+    ticker VARCHAR(10) NOT NULL,
+    price DOUBLE PRECISION NOT NULL,
+    qty INT NOT NULL,
+    buy_order_id UUID NOT NULL,
+    sell_order_id UUID NOT NULL,
+    buyer_id UUID NOT NULL,
+    seller_id UUID NOT NULL,
+    executed_at TIMESTAMPTZ NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_trades_instrument_executed
+    ON trades (instrument_id, executed_at DESC, id DESC);
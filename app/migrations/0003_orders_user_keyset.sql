@@ -0,0 +1,6 @@
+-- GET /order листает историю пользователя по (created_at, id) от новых
+-- к старым; индекс покрывает и сортировку, и условие курсора.
+CREATE INDEX IF NOT EXISTS idx_orders_user_created_id
+    ON orders (user_id, created_at DESC, id DESC);
+
+DROP INDEX IF EXISTS idx_orders_user_created;
@@ -0,0 +1,7 @@
+-- Докуда события журнала (JOURNAL_DIR) уже записаны в базу. Обновляется в
+-- той же транзакции, что и сами ордера и сделки, поэтому при старте
+-- переигрываются ровно события после него.
+CREATE TABLE IF NOT EXISTS journal_checkpoint (
+    id INT PRIMARY KEY,
+    seq BIGINT NOT NULL DEFAULT 0
+);
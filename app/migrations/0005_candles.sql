@@ -0,0 +1,30 @@
+-- Свечи OHLCV по периодам 1m, 5m, 1h, 1d. Уникальный индекс обслуживает и
+-- upsert при сбросе из памяти, и выборку GET /public/candles/{ticker}.
+CREATE TABLE IF NOT EXISTS candles (
+    id BIGSERIAL PRIMARY KEY,
+    instrument_id UUID NOT NULL REFERENCES instruments (id) ON DELETE CASCADE,
+    period VARCHAR(3) NOT NULL,
+    start BIGINT NOT NULL,
+    open DOUBLE PRECISION NOT NULL,
+    high DOUBLE PRECISION NOT NULL,
+    low DOUBLE PRECISION NOT NULL,
+    close DOUBLE PRECISION NOT NULL,
+    volume BIGINT NOT NULL,
+    UNIQUE (instrument_id, period, start)
+);
+
+-- История: свечи из уже записанных сделок
+INSERT INTO candles (instrument_id, period, start, open, high, low, close, volume)
+SELECT
+    t.instrument_id,
+    p.period,
+    floor(extract(epoch FROM t.executed_at) / p.seconds)::bigint * p.seconds,
+    (array_agg(t.price ORDER BY t.executed_at, t.id))[1],
+    max(t.price),
+    min(t.price),
+    (array_agg(t.price ORDER BY t.executed_at DESC, t.id DESC))[1],
+    sum(t.qty)
+FROM trades t
+CROSS JOIN (VALUES ('1m', 60), ('5m', 300), ('1h', 3600), ('1d', 86400)) AS p (period, seconds)
+GROUP BY t.instrument_id, p.period, 3
+ON CONFLICT DO NOTHING;
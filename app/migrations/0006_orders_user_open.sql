@@ -0,0 +1,5 @@
+-- Отмена ордеров (DELETE /order) - один UPDATE по открытым ордерам
+-- пользователя. Частичный индекс держит только открытые, поэтому не растёт
+-- с историей отменённых и исполненных.
+CREATE INDEX IF NOT EXISTS idx_orders_user_open
+    ON orders (user_id, ticker) WHERE status IN ('NEW', 'PARTIALLY_FILLED');
@@ -0,0 +1,18 @@
+-- Резерв под открытые ордера (LEDGER_SHARED): средства проверяются и
+-- резервируются условным UPDATE amount - reserved >= x, общим для всех
+-- API процессов. Заполняется по открытым ордерам: BUY держит
+-- ceil(остаток * цена) в QUOTE_TICKER (его ставит migrate.py), SELL - остаток
+-- инструмента.
+ALTER TABLE balances ADD COLUMN IF NOT EXISTS reserved BIGINT NOT NULL DEFAULT 0;
+
+UPDATE balances SET reserved = r.amount
+FROM (
+    SELECT o.user_id, i.id AS instrument_id, SUM(
+        CASE WHEN o.direction = 'BUY' THEN CEIL((o.qty - o.filled) * o.price) ELSE o.qty - o.filled END
+    )::bigint AS amount
+    FROM orders o
+    JOIN instruments i ON i.ticker = CASE WHEN o.direction = 'BUY' THEN current_setting('app.quote_ticker') ELSE o.ticker END
+    WHERE o.status IN ('NEW', 'PARTIALLY_FILLED') AND o.price IS NOT NULL
+    GROUP BY o.user_id, i.id
+) r
+WHERE balances.user_id = r.user_id AND balances.instrument_id = r.instrument_id;
@@ -0,0 +1,5 @@
+-- Сделки - неизменяемая история: инструмент, по которому они были, не
+-- удаляется вместе с ними (DELETE /admin/instrument отвечает 409).
+ALTER TABLE trades DROP CONSTRAINT IF EXISTS trades_instrument_id_fkey;
+ALTER TABLE trades ADD CONSTRAINT trades_instrument_id_fkey
+    FOREIGN KEY (instrument_id) REFERENCES instruments (id) ON DELETE RESTRICT;
@@ -0,0 +1,5 @@
+-- Инструмент котировки (QUOTE_TICKER, его ставит migrate.py): в нём BUY
+-- резервирует и платит за сделки. Без него приложение не стартует.
+INSERT INTO instruments (id, ticker, name, created_at)
+SELECT gen_random_uuid(), current_setting('app.quote_ticker'), current_setting('app.quote_ticker'), now()
+WHERE NOT EXISTS (SELECT 1 FROM instruments WHERE ticker = current_setting('app.quote_ticker'));
@@ -5,6 +5,8 @@ class Balance(Model):
     user = fields.ForeignKeyField("models.User", related_name="balances")
     instrument = fields.ForeignKeyField("models.Instrument", related_name="balances")
     amount = fields.BigIntField(default=0)  # Используем BigInt для избежания переполнения
+    # Резерв под открытые ордера; ведётся в базе только с LEDGER_SHARED
+    reserved = fields.BigIntField(default=0)
 
     class Meta:
         table = "balances"
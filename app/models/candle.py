@@ -0,0 +1,17 @@
+from tortoise import fields, models
+
+class Candle(models.Model):
+    """OHLCV свеча инструмента за период, start - начало в секундах unix (UTC)"""
+    id = fields.BigIntField(pk=True)
+    instrument = fields.ForeignKeyField("models.Instrument", related_name="candles")
+    period = fields.CharField(max_length=3)  # 1m, 5m, 1h, 1d
+    start = fields.BigIntField()
+    open = fields.FloatField()
+    high = fields.FloatField()
+    low = fields.FloatField()
+    close = fields.FloatField()
+    volume = fields.BigIntField()
+
+    class Meta:
+        table = "candles"
+        unique_together = (("instrument", "period", "start"),)
@@ -0,0 +1,9 @@
+from tortoise import fields, models
+
+class JournalCheckpoint(models.Model):
+    """Seq последнего события журнала, уже записанного в базу (одна строка, id=1)"""
+    id = fields.IntField(pk=True)
+    seq = fields.BigIntField(default=0)
+
+    class Meta:
+        table = "journal_checkpoint"
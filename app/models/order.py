@@ -2,13 +2,28 @@ from tortoise import fields, models
 from datetime import datetime
 import uuid
 
+# Статусы ордера
+NEW = "NEW"
+PARTIALLY_FILLED = "PARTIALLY_FILLED"
+FILLED = "FILLED"
+CANCELLED = "CANCELLED"  # остаток снят: отменён пользователем или IOC, FOK, рыночный
+
+OPEN_STATUSES = (NEW, PARTIALLY_FILLED)
+
 class Order(models.Model):
     id = fields.UUIDField(pk=True, default=uuid.uuid4)
     user_id = fields.UUIDField()
     status = fields.CharField(max_length=20, default="NEW")
-    body = fields.JSONField()
+    ticker = fields.CharField(max_length=10)
+    direction = fields.CharField(max_length=4)  # BUY/SELL
+    qty = fields.IntField()
+    price = fields.FloatField(null=True)  # None для рыночных ордеров
     filled = fields.IntField(default=0)
     created_at = fields.DatetimeField(auto_now_add=True)
 
     class Meta:
-        table = "orders"
\ No newline at end of file
+        table = "orders"
+        indexes = (
+            ("ticker", "status", "price"),  # стакан
+            ("user_id", "created_at", "id"),  # история пользователя, keyset по (created_at, id)
+        )
\ No newline at end of file
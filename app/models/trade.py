@@ -0,0 +1,22 @@
+from tortoise import fields, models
+from tortoise.indexes import Index
+
+class Trade(models.Model):
+    """Сделка, записывается в момент матчинга (append-only)"""
+    id = fields.BigIntField(pk=True)
+    # История сделок не удаляется вместе с инструментом
+    instrument = fields.ForeignKeyField("models.Instrument", related_name="trades", on_delete=fields.RESTRICT)
+    ticker = fields.CharField(max_length=10)
+    price = fields.FloatField()
+    qty = fields.IntField()
+    buy_order_id = fields.UUIDField()
+    sell_order_id = fields.UUIDField()
+    buyer_id = fields.UUIDField()
+    seller_id = fields.UUIDField()
+    executed_at = fields.DatetimeField()
+
+    class Meta:
+        table = "trades"
+        # Тот же индекс, что в 0002_trades.sql; там executed_at и id DESC, но
+        # все колонки в одну сторону - postgres читает этот с конца так же
+        indexes = (Index(fields=("instrument_id", "executed_at", "id"), name="idx_trades_instrument_executed"),)
@@ -1,4 +1,5 @@
 from pydantic import BaseModel, Field, field_validator, UUID4, PositiveInt
+from typing import List, Literal
 from uuid import UUID
 
 class BalanceDepositRequest(BaseModel):
@@ -33,3 +34,25 @@ class BalanceWithdrawRequest(BaseModel):
         if v < 1:
             raise ValueError("Количество должно быть большу нуля")
         return v
+
+class BalanceBulkRow(BaseModel):
+    user_id: UUID4
+    ticker: str
+    amount: PositiveInt
+
+class BalanceBulkRequest(BaseModel):
+    operation: Literal["deposit", "withdraw"]
+    rows: List[BalanceBulkRow] = Field(..., min_length=1, max_length=10000)
+    atomic: bool = Field(
+        False,
+        description="Если true, при любой ошибке не применяется ни одна строка"
+    )
+
+class BalanceBulkFailure(BaseModel):
+    index: int
+    error: str
+
+class BalanceBulkResponse(BaseModel):
+    success: bool
+    applied: int
+    failed: List[BalanceBulkFailure]
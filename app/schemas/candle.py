@@ -0,0 +1,10 @@
+from pydantic import BaseModel
+from datetime import datetime
+
+class CandleResponse(BaseModel):
+    timestamp: datetime  # начало периода
+    open: float
+    high: float
+    low: float
+    close: float
+    volume: int
@@ -1,4 +1,4 @@
-from pydantic import BaseModel, Field, field_validator, RootModel
+from pydantic import BaseModel, Field, field_validator, model_validator, RootModel
 from typing import Optional, List
 from datetime import datetime
 from uuid import UUID
@@ -28,6 +28,12 @@ class OrderCreateRequest(BaseModel):
         description="Price of the order (optional for market orders)",
         examples=[50000, 3000]
     )
+    time_in_force: str = Field(
+        "GTC",
+        description="GTC - the remainder rests in the book, IOC - the remainder is cancelled, "
+                    "FOK - fill completely or cancel. Market orders are never GTC",
+        examples=["GTC", "IOC", "FOK"]
+    )
 
     @field_validator('direction')
     def validate_direction(cls, v):
@@ -35,6 +41,26 @@ class OrderCreateRequest(BaseModel):
             raise ValueError("Direction must be either 'BUY' or 'SELL'")
         return v
 
+    @field_validator('price')
+    def validate_price(cls, v):
+        # Балансы целые: с целой ценой любая сделка стоит ровно qty * price, без округления в чью-то пользу
+        if v is not None and v != int(v):
+            raise ValueError("Price must be a whole number of quote currency units")
+        return v
+
+    @field_validator('time_in_force')
+    def validate_time_in_force(cls, v):
+        if v not in ["GTC", "IOC", "FOK"]:
+            raise ValueError("Time in force must be one of 'GTC', 'IOC', 'FOK'")
+        return v
+
+    @model_validator(mode='after')
+    def market_is_immediate(self):
+        # Рыночному ордеру негде стоять: остаток снимается
+        if self.price is None and self.time_in_force == "GTC":
+            self.time_in_force = "IOC"
+        return self
+
 # Response schemas
 class OrderBodyResponse(BaseModel):
     """Схема для тела ордера в ответе"""
@@ -61,6 +87,17 @@ class OrderCreateResponse(BaseModel):
     success: bool = True
     order_id: str
 
+class OrderBatchItemResponse(BaseModel):
+    """Результат одного ордера из пакета"""
+    success: bool = True
+    order_id: Optional[str] = None
+    error: Optional[str] = None
+
 class OrderDeleteResponse(BaseModel):
     """Схема для ответа при удалении ордера"""
-    success: bool = True 
\ No newline at end of file
+    success: bool = True
+
+class OrderCancelAllResponse(BaseModel):
+    """Схема для ответа при отмене всех ордеров"""
+    success: bool = True
+    cancelled: int = 0
@@ -0,0 +1,88 @@
+"""Минимальный in-process ASGI клиент для бенчмарков.
+
+Вызывает приложение напрямую, без сокетов и без httpx, поэтому
+измеряется стоимость самого приложения, а не сетевого стека.
+"""
+import asyncio
+import json
+from typing import Optional
+
+
+class ASGIClient:
+    def __init__(self, app):
+        self.app = app
+        self._lifespan_messages = None
+
+    async def request(self, method: str, path: str, json_body=None,
+                      headers: Optional[dict] = None, query: str = ""):
+        body = b"" if json_body is None else json.dumps(json_body).encode()
+        raw_headers = [(b"host", b"testserver")]
+        if json_body is not None:
+            raw_headers.append((b"content-type", b"application/json"))
+            raw_headers.append((b"content-length", str(len(body)).encode()))
+        for name, value in (headers or {}).items():
+            raw_headers.append((name.lower().encode(), value.encode()))
+
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": method,
+            "scheme": "http",
+            "path": path,
+            "raw_path": path.encode(),
+            "query_string": query.encode(),
+            "root_path": "",
+            "headers": raw_headers,
+            "client": ("127.0.0.1", 50000),
+            "server": ("testserver", 80),
+        }
+        sent = False
+
+        async def receive():
+            nonlocal sent
+            if not sent:
+                sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return {"type": "http.disconnect"}
+
+        response = {"status": None, "headers": {}, "body": bytearray()}
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                response["headers"] = {k.decode(): v.decode() for k, v in message.get("headers", [])}
+            elif message["type"] == "http.response.body":
+                response["body"].extend(message.get("body", b""))
+
+        # Как у сервера: каждый запрос в своей задаче со своим контекстом
+        await asyncio.create_task(self.app(scope, receive, send))
+        return response["status"], response["headers"], bytes(response["body"])
+
+    async def startup(self):
+        await self._lifespan("startup")
+
+    async def shutdown(self):
+        await self._lifespan("shutdown")
+
+    async def _lifespan(self, event: str):
+        if self._lifespan_messages is None:
+            self._lifespan_messages = asyncio.Queue()
+            self._lifespan_done = asyncio.Queue()
+
+            async def receive():
+                return await self._lifespan_messages.get()
+
+            async def send(message):
+                await self._lifespan_done.put(message)
+
+            self._lifespan_task = asyncio.create_task(
+                self.app({"type": "lifespan", "asgi": {"version": "3.0"}, "state": {}}, receive, send)
+            )
+
+        await self._lifespan_messages.put({"type": f"lifespan.{event}"})
+        message = await self._lifespan_done.get()
+        if message["type"].endswith("failed"):
+            raise RuntimeError(message.get("message", f"lifespan {event} failed"))
+        if event == "shutdown":
+            await self._lifespan_task
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""Журнал с групповым коммитом: событий в секунду при разных окнах.
+
+--producers конкурентных "запросов" в одном event loop, каждый в цикле
+добавляет событие ордера и ждёт commit(), как POST /order с журналом.
+Для каждого окна группового коммита печатаются события в секунду,
+средний размер батча (событий на fsync) и p50/p99 ожидания коммита.
+Первая строка - без группового коммита: write + fdatasync на каждое
+событие по очереди, как отдельная синхронная запись в базу на событие.
+
+Результат зависит от стоимости fsync на диске под --dir.
+
+    python app/scripts/bench_journal.py --windows 0,1,2,5,10 --producers 200
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent.parent))
+
+from app.services.journal import Journal, OrderEvent, encode
+
+
+def percentile(samples: list, p: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+
+def make_event() -> OrderEvent:
+    return OrderEvent(str(uuid.uuid4()), str(uuid.uuid4()), "BENCH", "BUY", 10, 100.5, time.time())
+
+
+def unbatched(directory: str, events: int) -> tuple:
+    """write + fdatasync per event"""
+    fd = os.open(os.path.join(directory, "unbatched.wal"), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+    sync = getattr(os, "fdatasync", os.fsync)
+    latencies = []
+    started = time.perf_counter()
+    try:
+        for _ in range(events):
+            t0 = time.perf_counter()
+            os.write(fd, encode(make_event()))
+            sync(fd)
+            latencies.append(time.perf_counter() - t0)
+    finally:
+        os.close(fd)
+    return events / (time.perf_counter() - started), 1.0, latencies
+
+
+async def grouped(directory: str, window: float, producers: int, duration: float, max_batch: int) -> tuple:
+    journal = Journal()
+    journal.open(directory, 1, window, max_batch, 64 * 1024 * 1024)
+    latencies = []
+    deadline = time.perf_counter() + duration
+
+    async def producer():
+        while time.perf_counter() < deadline:
+            t0 = time.perf_counter()
+            journal.append(make_event())
+            await journal.commit()
+            latencies.append(time.perf_counter() - t0)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(producer() for _ in range(producers)))
+    elapsed = time.perf_counter() - started
+    await journal.close()
+    return journal.events / elapsed, journal.events / max(journal.batches, 1), latencies
+
+
+def report(name: str, rate: float, batch: float, latencies: list):
+    print(f"{name:<14} {rate:>12,.0f} {batch:>10.1f} "
+          f"{percentile(latencies, 0.5) * 1000:>9.2f} {percentile(latencies, 0.99) * 1000:>9.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--windows", default="0,1,2,5,10", help="окна группового коммита, мс")
+    parser.add_argument("--producers", type=int, default=200, help="конкурентных запросов")
+    parser.add_argument("--duration", type=float, default=3.0, help="секунд на окно")
+    parser.add_argument("--batch-max", type=int, default=1000)
+    parser.add_argument("--unbatched-events", type=int, default=2000)
+    parser.add_argument("--dir", default=None, help="каталог на проверяемом диске (по умолчанию временный в текущем)")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix="bench-journal-", dir=args.dir or os.getcwd())
+    try:
+        print(f"{'window':<14} {'events/s':>12} {'per fsync':>10} {'p50, ms':>9} {'p99, ms':>9}")
+        report("no grouping", *unbatched(directory, args.unbatched_events))
+        for value in args.windows.split(","):
+            window_dir = tempfile.mkdtemp(dir=directory)
+            result = asyncio.run(grouped(window_dir, float(value) / 1000, args.producers, args.duration, args.batch_max))
+            report(f"{value} ms", *result)
+    finally:
+        shutil.rmtree(directory)
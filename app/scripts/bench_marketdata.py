@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""Нагрузочный тест рассылки рыночных данных.
+
+Тысячи локальных подписчиков на один тикер, часть из них не читает
+(медленные клиенты). Публикатор - matching engine. Меряется задержка
+от публикации обновления до его получения подписчиком и время, которое
+публикатор тратит на рассылку одного обновления.
+
+    python app/scripts/bench_marketdata.py --subscribers 5000 --updates 500
+"""
+import argparse
+import asyncio
+import random
+import sys
+import time
+import uuid
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent.parent))
+
+from app.services.marketdata import MarketDataHub, LAGGED
+from app.services.matching import engine, BookOrder, BUY, SELL
+
+TICKER = "BENCH"
+
+
+def percentile(samples: list, p: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+
+async def run(subscribers: int, slow: float, updates: int, buffer_size: int, seed: int):
+    rnd = random.Random(seed)
+    hub = MarketDataHub(buffer_size)
+    engine.listeners = [hub.publish]
+
+    publish_times = []
+    latencies = []
+
+    async def consume(subscriber):
+        await subscriber.queue.get()  # snapshot
+        index = 0
+        while True:
+            message = await subscriber.queue.get()
+            if message is LAGGED:
+                return
+            latencies.append(time.perf_counter() - publish_times[index])
+            index += 1
+            if index == updates:
+                return
+
+    consumers = []
+    for _ in range(subscribers):
+        subscriber = hub.subscribe(TICKER, 10)
+        if rnd.random() >= slow:
+            consumers.append(asyncio.create_task(consume(subscriber)))
+        # Медленные клиенты никогда не читают свою очередь
+
+    publish_cost = []
+    for _ in range(updates):
+        direction = BUY if rnd.random() < 0.5 else SELL
+        order = BookOrder(
+            id=str(uuid.uuid4()),
+            user_id="bench",
+            direction=direction,
+            qty=rnd.randint(1, 10),
+            price=100 + rnd.randint(-5, 5),
+        )
+        publish_times.append(time.perf_counter())
+        engine.submit(TICKER, order)
+        publish_cost.append(time.perf_counter() - publish_times[-1])
+        # Отдаём управление подписчикам, как между HTTP запросами
+        await asyncio.sleep(0)
+
+    await asyncio.gather(*consumers)
+
+    print(f"subscribers:        {subscribers} ({subscribers - len(consumers)} slow)")
+    print(f"updates:            {updates}")
+    print(f"delivered:          {len(latencies)}")
+    print(f"dropped (lagged):   {hub.dropped}")
+    print(f"publish per update: p50 {percentile(publish_cost, 0.5) * 1000:.2f} ms, "
+          f"p99 {percentile(publish_cost, 0.99) * 1000:.2f} ms")
+    print(f"fan-out latency:    p50 {percentile(latencies, 0.5) * 1000:.2f} ms, "
+          f"p99 {percentile(latencies, 0.99) * 1000:.2f} ms, "
+          f"max {max(latencies) * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--subscribers", type=int, default=5000)
+    parser.add_argument("--slow", type=float, default=0.05, help="доля нечитающих клиентов")
+    parser.add_argument("--updates", type=int, default=500)
+    parser.add_argument("--buffer-size", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    asyncio.run(run(args.subscribers, args.slow, args.updates, args.buffer_size, args.seed))
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""Пропускная способность matching engine без базы данных.
+
+    python app/scripts/bench_matching.py --orders 200000 --tickers 4
+"""
+import argparse
+import random
+import sys
+import time
+import uuid
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent.parent))
+
+from app.services.matching import MatchingEngine, BookOrder, BUY, SELL
+
+
+def make_orders(n: int, tickers: list, seed: int):
+    rnd = random.Random(seed)
+    orders = []
+    for _ in range(n):
+        direction = BUY if rnd.random() < 0.5 else SELL
+        # Цены вокруг 100 с шагом 0.5, чтобы заявки регулярно пересекались
+        offset = rnd.randint(-20, 20) * 0.5
+        price = 100 + (-offset if direction == BUY else offset)
+        orders.append((
+            rnd.choice(tickers),
+            BookOrder(
+                id=str(uuid.uuid4()),
+                user_id="bench",
+                direction=direction,
+                qty=rnd.randint(1, 100),
+                price=price,
+            ),
+        ))
+    return orders
+
+
+def percentile(samples: list, p: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+
+def run(n: int, tickers: int, seed: int):
+    engine = MatchingEngine()
+    orders = make_orders(n, [f"T{i}" for i in range(tickers)], seed)
+    latencies = []
+    fills = 0
+
+    started = time.perf_counter()
+    for ticker, order in orders:
+        t0 = time.perf_counter_ns()
+        fills += len(engine.submit(ticker, order))
+        latencies.append(time.perf_counter_ns() - t0)
+    elapsed = time.perf_counter() - started
+
+    resting = sum(len(book.orders) for book in engine.books.values())
+    print(f"orders:      {n}")
+    print(f"fills:       {fills}")
+    print(f"resting:     {resting}")
+    print(f"throughput:  {n / elapsed:,.0f} orders/sec")
+    print(f"p50 latency: {percentile(latencies, 0.50) / 1000:.1f} us")
+    print(f"p99 latency: {percentile(latencies, 0.99) / 1000:.1f} us")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--orders", type=int, default=200_000)
+    parser.add_argument("--tickers", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    run(args.orders, args.tickers, args.seed)
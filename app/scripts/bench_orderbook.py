@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""Латентность чтения стакана в зависимости от числа стоящих ордеров.
+
+Сравнивает инкрементальный L2 агрегат движка с прежним подходом
+(отсортировать все открытые ордера и агрегировать на каждый запрос).
+
+    python app/scripts/bench_orderbook.py --limit 10
+"""
+import argparse
+import random
+import sys
+import time
+import uuid
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent.parent))
+
+from app.services.matching import MatchingEngine, BookOrder, BUY, SELL
+
+SIZES = (1_000, 10_000, 100_000)
+
+
+def legacy_depth(orders: list, limit: int):
+    """Прежний алгоритм get_orderbook: полная сортировка и агрегация"""
+    bid_levels, ask_levels = {}, {}
+    for order in sorted(orders, key=lambda x: x.price, reverse=True):
+        levels = bid_levels if order.direction == BUY else ask_levels
+        levels[order.price] = levels.get(order.price, 0) + order.remaining
+    return (
+        sorted(bid_levels.items(), reverse=True)[:limit],
+        sorted(ask_levels.items())[:limit],
+    )
+
+
+def measure(fn, repeat: int) -> float:
+    """Median call time in microseconds"""
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter_ns()
+        fn()
+        samples.append(time.perf_counter_ns() - t0)
+    samples.sort()
+    return samples[len(samples) // 2] / 1000
+
+
+def run(limit: int, repeat: int, seed: int):
+    rnd = random.Random(seed)
+    engine = MatchingEngine()
+    resting = []
+
+    print(f"{'resting':>8} {'engine, us':>12} {'legacy, us':>12}")
+    for size in SIZES:
+        while len(resting) < size:
+            direction = BUY if rnd.random() < 0.5 else SELL
+            # Не пересекающиеся стороны: bids ниже 100, asks выше
+            step = rnd.randint(1, 2000) * 0.01
+            order = BookOrder(
+                id=str(uuid.uuid4()),
+                user_id="bench",
+                direction=direction,
+                qty=rnd.randint(1, 100),
+                price=round(100 - step if direction == BUY else 100 + step, 2),
+            )
+            engine.submit("BENCH", order)
+            resting.append(order)
+
+        engine_us = measure(lambda: engine.depth("BENCH", limit), repeat)
+        legacy_us = measure(lambda: legacy_depth(resting, limit), max(3, repeat // 100))
+        print(f"{size:>8} {engine_us:>12.1f} {legacy_us:>12.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    run(args.limit, args.repeat, args.seed)
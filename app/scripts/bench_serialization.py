@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""Сериализация списковых ответов: Pydantic + response_model против serialization.dumps.
+
+Старый путь - то, что делал FastAPI: модель на каждую строку, повторная
+валидация через response_model (serialize_response) и JSONResponse.
+Новый - dict из строки и dumps в байты. Строки - объекты с атрибутами,
+как у ORM, уровни стакана - кортежи из engine.depth.
+
+    python app/scripts/bench_serialization.py --sizes 10 1000 100000
+"""
+import argparse
+import asyncio
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from types import SimpleNamespace
+from typing import List
+
+sys.path.append(str(Path(__file__).parent.parent.parent))
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_model_field
+
+from app.api.order import order_detail, order_row
+from app.schemas.order import OrderDetailResponse
+from app.schemas.orderbook import OrderbookResponse, PriceLevel
+from app.schemas.transaction import TransactionResponse
+from app.services.serialization import dumps, orjson
+
+
+def make_orders(n: int):
+    now = datetime.now(timezone.utc)
+    user_id = uuid.uuid4()
+    return [
+        SimpleNamespace(
+            id=uuid.uuid4(), status="NEW", user_id=user_id, created_at=now - timedelta(seconds=i),
+            direction="BUY" if i % 2 else "SELL", ticker="MEME", qty=1 + i % 10,
+            price=100.0 + i % 50, filled=i % 3
+        )
+        for i in range(n)
+    ]
+
+
+def make_trades(n: int):
+    now = datetime.now(timezone.utc)
+    return [
+        SimpleNamespace(id=n - i, ticker="MEME", qty=1 + i % 10, price=100.0 + i % 50,
+                        executed_at=now - timedelta(seconds=i))
+        for i in range(n)
+    ]
+
+
+def make_levels(n: int):
+    half = max(1, n // 2)
+    return [(100.0 - i * 0.01, 1 + i % 10) for i in range(half)], \
+           [(100.0 + i * 0.01, 1 + i % 10) for i in range(half)]
+
+
+async def via_response_model(field, content) -> bytes:
+    """Валидация + сериализация, как в fastapi.routing для response_model"""
+    value = await serialize_response(field=field, response_content=content)
+    return JSONResponse(value).body
+
+
+def cases(n: int):
+    orders, trades, (bids, asks) = make_orders(n), make_trades(n), make_levels(n)
+    orders_field = create_model_field("orders", List[OrderDetailResponse], mode="serialization")
+    trades_field = create_model_field("trades", List[TransactionResponse], mode="serialization")
+    book_field = create_model_field("book", OrderbookResponse, mode="serialization")
+
+    yield (
+        "orders",
+        lambda: via_response_model(orders_field, [order_detail(o) for o in orders]),
+        lambda: dumps([order_row(o) for o in orders]),
+    )
+    yield (
+        "transactions",
+        lambda: via_response_model(trades_field, [
+            TransactionResponse(ticker=t.ticker, amount=t.qty, price=t.price, timestamp=t.executed_at)
+            for t in trades
+        ]),
+        lambda: dumps([
+            {"ticker": t.ticker, "amount": t.qty, "price": t.price, "timestamp": t.executed_at}
+            for t in trades
+        ]),
+    )
+    yield (
+        "orderbook",
+        lambda: via_response_model(book_field, OrderbookResponse(
+            bid_levels=[PriceLevel(price=p, qty=q) for p, q in bids],
+            ask_levels=[PriceLevel(price=p, qty=q) for p, q in asks],
+        )),
+        lambda: dumps({
+            "bid_levels": [{"price": float(p), "qty": q} for p, q in bids],
+            "ask_levels": [{"price": float(p), "qty": q} for p, q in asks],
+        }),
+    )
+
+
+async def measure(fn, is_async: bool, min_time: float) -> float:
+    """Среднее время одного вызова, секунды"""
+    calls = 0
+    started = time.perf_counter()
+    while True:
+        if is_async:
+            await fn()
+        else:
+            fn()
+        calls += 1
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_time:
+            return elapsed / calls
+
+
+async def run(sizes: List[int], min_time: float):
+    print(f"encoder: {'orjson' if orjson is not None else 'json (stdlib)'}")
+    print(f"{'endpoint':<14}{'rows':>8}{'response_model':>18}{'dumps':>14}{'speedup':>10}")
+    for n in sizes:
+        for name, old, new in cases(n):
+            # Одинаковый JSON - иначе сравнение бессмысленно
+            assert await old() == new(), f"{name}: outputs differ"
+            old_time = await measure(old, True, min_time)
+            new_time = await measure(new, False, min_time)
+            print(f"{name:<14}{n:>8}{old_time * 1000:>15.3f} ms{new_time * 1000:>11.3f} ms"
+                  f"{old_time / new_time:>9.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 1000, 100000])
+    parser.add_argument("--min-time", type=float, default=1.0, help="секунд на каждый замер")
+    args = parser.parse_args()
+    asyncio.run(run(args.sizes, args.min_time))
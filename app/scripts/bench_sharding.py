@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""Пропускная способность матчинга по числу шардов (процессов).
+
+Для каждого значения --shards запускает шарды (app/services/sharding.py)
+и --clients клиентских процессов, которые, как процессы API, держат
+зеркало книг и шлют submit по Unix сокетам, до --window команд в полёте
+на клиента. Ордера равномерно раскиданы по --tickers инструментам.
+Считается общее число ордеров в секунду и ускорение к одному шарду;
+для сравнения - тот же поток через движок в одном процессе, без IPC.
+
+Масштабирование видно только при свободных ядрах: нужно примерно
+shards + clients ядер.
+
+    python app/scripts/bench_sharding.py --shards 1,2,4 --clients 4 --orders 200000
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent.parent))
+
+from app.scripts.bench_matching import make_orders
+from app.services.matching import MatchingEngine
+from app.services.sharding import Matcher, spawn_shards
+
+
+async def drive(count: int, socket_dir: str, orders: list, window: int, start, results):
+    matcher = Matcher()
+    await matcher.start(count, socket_dir, spawn=False)
+    results.put("ready")
+    start.wait()
+    started = time.perf_counter()
+    for offset in range(0, len(orders), window):
+        await matcher.submit_many(orders[offset:offset + window])
+    results.put((started, time.perf_counter()))
+    await matcher.stop()
+
+
+def client(count: int, socket_dir: str, n: int, tickers: list, seed: int, window: int, start, results):
+    """Процесс-клиент: свой поток ордеров, время начала и конца в results"""
+    asyncio.run(drive(count, socket_dir, make_orders(n, tickers, seed), window, start, results))
+
+
+def run(count: int, args, tickers: list) -> float:
+    """Ордеров в секунду через `count` шардов"""
+    context = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as socket_dir:
+        shards = spawn_shards(count, socket_dir, None)
+        start, results = context.Event(), context.Queue()
+        per_client = args.orders // args.clients
+        clients = [
+            context.Process(target=client, args=(count, socket_dir, per_client, tickers, seed, args.window, start, results))
+            for seed in range(args.clients)
+        ]
+        try:
+            for process in clients:
+                process.start()
+            for _ in clients:
+                results.get()  # подключились и получили снимок
+            start.set()
+            spans = [results.get() for _ in clients]
+            for process in clients:
+                process.join()
+        finally:
+            for process in shards:
+                process.terminate()
+                process.join()
+    elapsed = max(end for _, end in spans) - min(begin for begin, _ in spans)
+    return per_client * args.clients / elapsed
+
+
+def in_process(args, tickers: list) -> float:
+    engine = MatchingEngine()
+    orders = make_orders(args.orders, tickers, 0)
+    started = time.perf_counter()
+    for ticker, order in orders:
+        engine.submit(ticker, order)
+    return args.orders / (time.perf_counter() - started)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--shards", default="1,2,4", help="числа шардов через запятую")
+    parser.add_argument("--clients", type=int, default=4, help="клиентских процессов (как воркеров API)")
+    parser.add_argument("--orders", type=int, default=200000)
+    parser.add_argument("--tickers", type=int, default=64)
+    parser.add_argument("--window", type=int, default=256, help="команд в полёте на клиента")
+    args = parser.parse_args()
+
+    tickers = [f"T{i}" for i in range(args.tickers)]
+    print(f"cpus: {os.cpu_count()}, clients: {args.clients}, orders: {args.orders}, tickers: {args.tickers}")
+    print(f"{'in-process':>10} {in_process(args, tickers):>12,.0f} orders/s  (один процесс, без IPC)")
+    baseline = None
+    for count in [int(value) for value in args.shards.split(",")]:
+        rate = run(count, args, tickers)
+        baseline = baseline or rate
+        print(f"{count:>4} shards {rate:>12,.0f} orders/s  x{rate / baseline:.2f}")
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""Применяет SQL миграции из app/migrations по порядку.
+
+Каждый файл NNNN_name.sql применяется один раз в отдельной транзакции,
+применённые версии хранятся в таблице schema_migrations. Тикер котировки
+(QUOTE_TICKER) миграции берут из настроек: current_setting('app.quote_ticker').
+"""
+import asyncio
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent.parent))
+
+from tortoise import Tortoise, connections
+from tortoise.transactions import in_transaction
+from app.core.config import settings
+from app.core.database import TORTOISE_ORM
+
+MIGRATIONS_DIR = Path(__file__).parent.parent / "migrations"
+
+
+async def migrate():
+    await Tortoise.init(config=TORTOISE_ORM)
+    try:
+        conn = connections.get("default")
+        await conn.execute_script(
+            "CREATE TABLE IF NOT EXISTS schema_migrations ("
+            "version VARCHAR(255) PRIMARY KEY, "
+            "applied_at TIMESTAMPTZ NOT NULL DEFAULT now())"
+        )
+        _, rows = await conn.execute_query("SELECT version FROM schema_migrations")
+        applied = {row["version"] for row in rows}
+
+        for path in sorted(MIGRATIONS_DIR.glob("*.sql")):
+            if path.stem in applied:
+                continue
+            print(f"Применяем {path.name}")
+            async with in_transaction("default") as tx:
+                await tx.execute_query("SELECT set_config('app.quote_ticker', $1, true)", [settings.QUOTE_TICKER])
+                await tx.execute_script(path.read_text())
+                await tx.execute_query(
+                    "INSERT INTO schema_migrations (version) VALUES ($1)",
+                    [path.stem]
+                )
+        print("Миграции применены")
+    finally:
+        await Tortoise.close_connections()
+
+
+if __name__ == "__main__":
+    asyncio.run(migrate())
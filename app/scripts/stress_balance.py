@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""Стресс-тест конкурентных пополнений и списаний баланса.
+
+Запускает тысячи параллельных deposit/withdraw по одному балансу и
+проверяет, что итоговая сумма равна сумме пополнений минус сумма успешных
+списаний и что баланс ни разу не ушёл в минус.
+
+    python app/scripts/stress_balance.py --db-url sqlite:///tmp/stress.sqlite3
+    python app/scripts/stress_balance.py --legacy   # прежний read-modify-write
+"""
+import argparse
+import asyncio
+import random
+import sys
+import uuid
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent.parent))
+
+from tortoise import Tortoise
+
+from app.core.database import TORTOISE_ORM, configure
+from app.models.balance import Balance
+from app.models.instrument import Instrument
+from app.models.user import User
+from app.services import balance as balance_service
+from app.services.balance import InsufficientFunds
+
+
+async def legacy_deposit(user, instrument, amount):
+    balance, created = await Balance.get_or_create(
+        user=user, instrument=instrument, defaults={"amount": amount}
+    )
+    if not created:
+        balance.amount += amount
+        await balance.save()
+
+
+async def legacy_withdraw(user, instrument, amount):
+    balance = await Balance.get_or_none(user=user, instrument=instrument)
+    if not balance or balance.amount < amount:
+        raise InsufficientFunds(balance.amount if balance else 0, amount)
+    balance.amount -= amount
+    await balance.save()
+
+
+async def run(db_url: str, operations: int, legacy: bool, seed: int):
+    if db_url:
+        configure(db_url)
+    await Tortoise.init(config=TORTOISE_ORM)
+    await Tortoise.generate_schemas()
+
+    try:
+        user = await User.create(name=f"stress-{uuid.uuid4().hex[:8]}", api_key=str(uuid.uuid4()))
+        instrument = await Instrument.create(name="Stress", ticker=f"S{uuid.uuid4().hex[:6].upper()}")
+
+        rnd = random.Random(seed)
+        deposited = 0
+        withdrawn = 0
+
+        async def deposit(amount):
+            nonlocal deposited
+            if legacy:
+                await legacy_deposit(user, instrument, amount)
+            else:
+                await balance_service.credit(user.id, instrument.id, amount)
+            deposited += amount
+
+        async def withdraw(amount):
+            nonlocal withdrawn
+            try:
+                if legacy:
+                    await legacy_withdraw(user, instrument, amount)
+                else:
+                    await balance_service.debit(user.id, instrument.id, amount)
+            except InsufficientFunds:
+                return
+            withdrawn += amount
+
+        tasks = []
+        for _ in range(operations):
+            amount = rnd.randint(1, 100)
+            tasks.append(deposit(amount) if rnd.random() < 0.5 else withdraw(amount))
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        errors = [r for r in results if isinstance(r, Exception)]
+
+        final = (await Balance.get(user=user, instrument=instrument)).amount
+        expected = deposited - withdrawn
+        print(f"operations: {operations}, errors: {len(errors)}")
+        print(f"deposited:  {deposited}")
+        print(f"withdrawn:  {withdrawn}")
+        print(f"final:      {final} (expected {expected})")
+
+        await Balance.filter(user=user).delete()
+        await instrument.delete()
+        await user.delete()
+
+        if errors or final != expected or final < 0:
+            print("FAIL")
+            return 1
+        print("OK")
+        return 0
+    finally:
+        await Tortoise.close_connections()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--db-url", default="", help="по умолчанию из настроек")
+    parser.add_argument("--operations", type=int, default=5000)
+    parser.add_argument("--legacy", action="store_true")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    sys.exit(asyncio.run(run(args.db_url, args.operations, args.legacy, args.seed)))
@@ -1,23 +1,121 @@
-from fastapi import Header, HTTPException, Depends
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Collection, Optional
+from uuid import UUID
+
+from fastapi import HTTPException, Depends, Security
+from fastapi.security import APIKeyHeader
+
+from app.core.config import settings
+from tortoise.expressions import Q
+
 from app.models.user import User
 
-async def get_user_by_token(
-    authorization: str = Header(..., alias="Authorization")
-) -> User:
-    """Проверка токена и получение объекта пользователя."""
-    if not authorization.startswith("TOKEN "):
-        raise HTTPException(
-            status_code=401,
-            detail="Формат токена: 'TOKEN ваш_токен'"
-        )
-
-    api_key = authorization.split(" ")[1]
-    user = await User.get_or_none(api_key=api_key)
-    
+api_key_header = APIKeyHeader(name="Authorization", auto_error=False)
+
+
+@dataclass(frozen=True, slots=True)
+class AuthUser:
+    """То, что нужно эндпоинтам о пользователе после аутентификации"""
+    id: UUID
+    name: str
+    role: str
+
+    @property
+    def is_admin(self) -> bool:
+        return self.role == "ADMIN"
+
+
+class TokenCache:
+    """Bounded LRU cache token -> AuthUser with a TTL per entry"""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def get(self, token: str) -> Optional[AuthUser]:
+        entry = self._entries.get(token)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._entries[token]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(token)
+        self.hits += 1
+        return entry[1]
+
+    def peek(self, token: str) -> Optional[AuthUser]:
+        """get() without touching LRU order or hit/miss stats"""
+        entry = self._entries.get(token)
+        if entry is None or entry[0] < time.monotonic():
+            return None
+        return entry[1]
+
+    def put(self, token: str, user: AuthUser):
+        self._entries[token] = (time.monotonic() + self.ttl, user)
+        self._entries.move_to_end(token)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def invalidate_user(self, user_id):
+        """Drop every cached token of a user (e.g. after deletion)"""
+        user_id = str(user_id)
+        for token in [t for t, (_, u) in self._entries.items() if str(u.id) == user_id]:
+            del self._entries[token]
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
+
+
+auth_cache = TokenCache(settings.AUTH_CACHE_SIZE, settings.AUTH_CACHE_TTL)
+
+
+async def authenticate(token: str) -> Optional[AuthUser]:
+    """Resolve an API key, going to the database only on a cache miss"""
+    user = auth_cache.get(token)
+    if user is None:
+        db_user = await User.get_by_token(token)
+        if not db_user:
+            return None
+        user = AuthUser(id=db_user.id, name=db_user.name, role=db_user.role)
+        auth_cache.put(token, user)
+    return user
+
+
+async def warm_auth_cache(limit: int, user_ids: Collection = ()) -> int:
+    """Preload keys of admins and of `user_ids` (users with resting orders)"""
+    query = User.filter(role="ADMIN")
+    if user_ids:
+        query = User.filter(Q(id__in=list(user_ids)[:limit]) | Q(role="ADMIN"))
+    users = await query.limit(limit)
+    for user in users:
+        auth_cache.put(user.api_key, AuthUser(id=user.id, name=user.name, role=user.role))
+    return len(users)
+
+
+async def get_current_user(authorization: str = Security(api_key_header)) -> AuthUser:
+    """Проверка токена и получение пользователя."""
+    if not authorization:
+        raise HTTPException(status_code=401, detail="Authorization header is missing")
+
+    # Remove 'TOKEN ' prefix if present
+    token = authorization[6:] if authorization.startswith("TOKEN ") else authorization
+
+    user = await authenticate(token)
     if not user:
-        raise HTTPException(
-            status_code=403,
-            detail="Неверный токен"
-        )
-    
-    return user
\ No newline at end of file
+        raise HTTPException(status_code=401, detail="Invalid API key")
+    return user
+
+
+async def get_admin_user(user: AuthUser = Depends(get_current_user)) -> AuthUser:
+    """То же, что get_current_user, но только для администраторов."""
+    if not user.is_admin:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return user
@@ -0,0 +1,113 @@
+from collections import defaultdict
+from typing import Iterable, Optional, Tuple
+
+from tortoise import connections
+from tortoise.backends.base.client import BaseDBAsyncClient
+from tortoise.expressions import F
+
+from app.models.balance import Balance
+
+
+class InsufficientFunds(Exception):
+    def __init__(self, current_balance: int, required: int):
+        super().__init__("Insufficient funds")
+        self.current_balance = current_balance
+        self.required = required
+
+
+def _placeholders(conn: BaseDBAsyncClient, count: int, start: int = 0) -> list:
+    if conn.capabilities.dialect == "postgres":
+        return [f"${i}" for i in range(start + 1, start + count + 1)]
+    return ["?"] * count
+
+
+async def credit(user_id, instrument_id, amount: int,
+                 conn: Optional[BaseDBAsyncClient] = None) -> Optional[int]:
+    """Atomically add `amount`, creating the balance row if needed.
+
+    Returns the new amount, or None if the user does not exist.
+    """
+    conn = conn or connections.get("default")
+    instrument, value, user = _placeholders(conn, 3)
+    if conn.capabilities.dialect == "postgres":
+        # В списке SELECT тип параметра не выводится из целевой колонки
+        instrument, value = f"{instrument}::uuid", f"{value}::bigint"
+    _, rows = await conn.execute_query(
+        "INSERT INTO balances (user_id, instrument_id, amount) "
+        f"SELECT id, {instrument}, {value} FROM users WHERE id = {user} "
+        "ON CONFLICT (user_id, instrument_id) "
+        "DO UPDATE SET amount = balances.amount + excluded.amount "
+        "RETURNING amount",
+        [str(instrument_id), amount, str(user_id)]
+    )
+    return rows[0]["amount"] if rows else None
+
+
+async def debit(user_id, instrument_id, amount: int,
+                conn: Optional[BaseDBAsyncClient] = None, reserved: bool = False) -> None:
+    """Atomically subtract `amount` if the balance covers it (net of the
+    reservations with `reserved`).
+
+    Raises InsufficientFunds (with the current balance) otherwise.
+    """
+    query = Balance.filter(user_id=user_id, instrument_id=instrument_id)
+    if conn is not None:
+        query = query.using_db(conn)
+
+    floor = F("reserved") + amount if reserved else amount
+    updated = await query.filter(amount__gte=floor).update(amount=F("amount") - amount)
+    if not updated:
+        current = await query.values_list("amount", "reserved")
+        available = current[0][0] - (current[0][1] if reserved else 0) if current else 0
+        raise InsufficientFunds(available, amount)
+
+
+async def reserve(user_id, instrument_id, amount: int) -> bool:
+    """Atomically add `amount` to the reservations if the balance net of them covers it"""
+    updated = await Balance.filter(
+        user_id=user_id, instrument_id=instrument_id, amount__gte=F("reserved") + amount
+    ).update(reserved=F("reserved") + amount)
+    return bool(updated)
+
+
+async def credit_many(rows: Iterable[Tuple], conn: Optional[BaseDBAsyncClient] = None, existing_only: bool = False):
+    """Apply many (user_id, instrument_id, amount[, reserved]) changes in one multi-row upsert.
+
+    Amounts are signed, so callers may pass debits they have already checked.
+    Rows for the same (user, instrument) are summed first, since one upsert
+    statement may not touch the same row twice. With `existing_only` rows of
+    users or instruments deleted meanwhile are skipped instead of failing
+    the statement (changes written behind).
+    """
+    totals = defaultdict(lambda: [0, 0])
+    for user_id, instrument_id, amount, *reserved in rows:
+        total = totals[(str(user_id), str(instrument_id))]
+        total[0] += amount
+        total[1] += reserved[0] if reserved else 0
+    if not totals:
+        return
+
+    conn = conn or connections.get("default")
+    # Без целевой колонки (VALUES в WITH) postgres не выводит типы параметров
+    casts = ("::uuid", "::uuid", "::bigint", "::bigint") if existing_only and conn.capabilities.dialect == "postgres" else ("",) * 4
+    values, params = [], []
+    for (user_id, instrument_id), (amount, reserved) in totals.items():
+        placeholders = _placeholders(conn, 4, len(params))
+        values.append("(" + ", ".join(p + cast for p, cast in zip(placeholders, casts)) + ")")
+        params.extend((user_id, instrument_id, amount, reserved))
+    if existing_only:
+        query = (
+            f"WITH v (user_id, instrument_id, amount, reserved) AS (VALUES {', '.join(values)}) "
+            "INSERT INTO balances (user_id, instrument_id, amount, reserved) "
+            "SELECT user_id, instrument_id, amount, reserved FROM v "
+            "WHERE EXISTS (SELECT 1 FROM users WHERE users.id = v.user_id) "
+            "AND EXISTS (SELECT 1 FROM instruments WHERE instruments.id = v.instrument_id) "
+        )
+    else:
+        query = f"INSERT INTO balances (user_id, instrument_id, amount, reserved) VALUES {', '.join(values)} "
+    await conn.execute_query(
+        query +
+        "ON CONFLICT (user_id, instrument_id) "
+        "DO UPDATE SET amount = balances.amount + excluded.amount, reserved = balances.reserved + excluded.reserved",
+        params
+    )
@@ -0,0 +1,275 @@
+"""OHLCV candles built from trades as they happen.
+
+`candles` is an engine listener: every fill updates the candle of each
+period in PERIODS it falls in. The latest `memory` candles per ticker and
+period stay in memory; changed ones are written behind to `candles` every
+`interval` seconds with one multi-row upsert of their current values, so
+writing a candle twice (a retried flush, several API processes fed by the
+shards) is harmless. GET /public/candles reads memory and, for older
+ranges, the table - never the trades.
+
+Buckets are aligned to the unix epoch (days start at 00:00 UTC); a period
+without trades has no candle.
+
+On startup the 1m candles from the last flushed one on are rebuilt from
+the trades (plus the journal tail, not in the database yet), so a crash
+between flushes loses nothing; coarser ones are rebuilt from the finer
+candles, and the open candles are loaded into memory.
+"""
+import asyncio
+import logging
+import math
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from tortoise import connections
+
+from app.core.config import settings
+from app.models.candle import Candle
+from app.models.instrument import Instrument
+from app.models.trade import Trade
+from app.services.instruments import instruments
+from app.services.matching import BookUpdate, engine
+
+logger = logging.getLogger(__name__)
+
+# Период -> секунд; каждый делит следующий
+PERIODS = {"1m": 60, "5m": 300, "1h": 3600, "1d": 86400}
+FLUSH_CHUNK = 1000  # строк на один INSERT
+
+_COLUMNS = "instrument_id, period, start, open, high, low, close, volume"
+_CASTS = ("::uuid", "::varchar", "::bigint", "::float8", "::float8", "::float8", "::float8", "::bigint")
+
+
+def bucket(ts: float, seconds: int) -> int:
+    return int(ts // seconds) * seconds
+
+
+def _fold(candles: Dict[tuple, list], key: tuple, part: list):
+    """Add a later part (a trade or a finer candle) to the candle at `key`"""
+    candle = candles.get(key)
+    if candle is None:
+        candles[key] = list(part)
+        return
+    if part[1] > candle[1]:
+        candle[1] = part[1]
+    if part[2] < candle[2]:
+        candle[2] = part[2]
+    candle[3] = part[3]
+    candle[4] += part[4]
+
+
+class CandleStore:
+    def __init__(self, memory: int):
+        self.memory = memory
+        self.interval = 1.0
+        # (ticker, period) -> start -> [open, high, low, close, volume], по возрастанию start
+        self._recent: Dict[Tuple[str, str], "OrderedDict[int, list]"] = {}
+        # (ticker, period) -> с какого start память полна после вытеснения старых свечей
+        self._evicted: Dict[Tuple[str, str], int] = {}
+        self._dirty: Dict[Tuple[str, str, int], list] = {}
+        self._since: Optional[float] = None  # время load(), раньше - только из базы
+        self._task: Optional[asyncio.Task] = None
+
+    def add(self, ticker: str, price: float, qty: int, ts: float):
+        """Account one trade in the candle of every period"""
+        for period, seconds in PERIODS.items():
+            start = bucket(ts, seconds)
+            key = (ticker, period)
+            recent = self._recent.get(key)
+            if recent is None:
+                recent = self._recent[key] = OrderedDict()
+            candle = recent.get(start)
+            if candle is None:
+                candle = recent[start] = [price, price, price, price, qty]
+                if len(recent) > self.memory:
+                    evicted, _ = recent.popitem(last=False)
+                    self._evicted[key] = evicted + seconds
+            else:
+                if price > candle[1]:
+                    candle[1] = price
+                elif price < candle[2]:
+                    candle[2] = price
+                candle[3] = price
+                candle[4] += qty
+            self._dirty[(ticker, period, start)] = candle
+
+    def on_update(self, update: BookUpdate):
+        """Engine listener"""
+        for fill in update.fills:
+            # Время сделки, а не получения: обновление шарда могло прийти с задержкой
+            self.add(update.ticker, fill.price, fill.qty, fill.ts)
+
+    async def history(self, instrument: Instrument, period: str, start: Optional[float],
+                      end: Optional[float], limit: int) -> List[Tuple[int, list]]:
+        """Up to `limit` latest (start, [open, high, low, close, volume]) starting in [start, end), oldest first"""
+        key = (instrument.ticker, period)
+        recent = [
+            (candle_start, candle) for candle_start, candle in self._recent.get(key, {}).items()
+            if (start is None or candle_start >= start) and (end is None or candle_start < end)
+        ][-limit:]
+
+        complete_from = self._complete_from(key)
+        if len(recent) == limit or (start is not None and start >= complete_from):
+            return recent
+        # Старше памяти - из таблицы
+        query = Candle.filter(instrument_id=instrument.id, period=period)
+        if start is not None:
+            query = query.filter(start__gte=math.ceil(start))
+        upper = min(complete_from, math.inf if end is None else end)
+        if upper != math.inf:
+            query = query.filter(start__lt=math.ceil(upper))
+        rows = await query.order_by("-start").limit(limit - len(recent)).values_list(
+            "start", "open", "high", "low", "close", "volume"
+        )
+        return [(row[0], list(row[1:])) for row in reversed(rows)] + recent
+
+    def _complete_from(self, key: Tuple[str, str]) -> float:
+        if self._since is None:
+            return math.inf
+        return max(bucket(self._since, PERIODS[key[1]]), self._evicted.get(key, 0))
+
+    async def load(self, tail: Iterable[Tuple[str, float, int, float]] = ()):
+        """Rebuild what the last flushes may have missed and load the open candles.
+
+        `tail` - (ticker, price, qty, ts) trades not in the database yet (the journal).
+        """
+        self._recent.clear()
+        self._evicted.clear()
+        self._dirty.clear()
+        self._since = now = time.time()
+
+        last = await Candle.filter(period="1m").order_by("-start").limit(1).values_list("start", flat=True)
+        last = last[0] if last else None
+        tail = list(tail)
+        if tail and last is not None:
+            # Хвост журнала может быть старше уже сброшенных свечей
+            last = min(last, bucket(min(ts for *_, ts in tail), 60))
+        query = Trade.all() if last is None else Trade.filter(executed_at__gte=datetime.fromtimestamp(last, timezone.utc))
+        trades = [
+            (ticker, price, qty, executed_at.timestamp())
+            for ticker, price, qty, executed_at in await query.order_by("executed_at", "id").values_list(
+                "ticker", "price", "qty", "executed_at"
+            )
+        ]
+        trades.extend(tail)
+        rebuilt = await self._rebuild(trades, last)
+
+        for period, seconds in PERIODS.items():
+            rows = await Candle.filter(period=period, start__gte=bucket(now, seconds)).values_list(
+                "instrument__ticker", "start", "open", "high", "low", "close", "volume"
+            )
+            for ticker, start, *values in rows:
+                self._recent.setdefault((ticker, period), OrderedDict())[start] = values
+        for (ticker, period, start), candle in sorted(rebuilt.items(), key=lambda item: item[0][2]):
+            self._dirty[(ticker, period, start)] = candle
+            if start >= bucket(now, PERIODS[period]):
+                self._recent.setdefault((ticker, period), OrderedDict())[start] = candle
+        await self.flush()
+
+    async def _rebuild(self, trades: List[Tuple[str, float, int, float]], last: Optional[int]) -> Dict[tuple, list]:
+        """Candles from `last` on (all with None): 1m from the trades, each coarser
+        period from the finer candles in the table before `last` and the rebuilt ones"""
+        rebuilt: Dict[tuple, list] = {}
+        for ticker, price, qty, ts in trades:
+            _fold(rebuilt, (ticker, "1m", bucket(ts, 60)), [price, price, price, price, qty])
+        tickers = {ticker for ticker, *_ in trades}
+        if not tickers:
+            return rebuilt
+
+        periods = list(PERIODS.items())
+        for (finer, finer_seconds), (period, seconds) in zip(periods, periods[1:]):
+            parts = []
+            if last is not None:
+                rows = await Candle.filter(
+                    period=finer, instrument__ticker__in=tickers,
+                    start__gte=bucket(last, seconds), start__lt=bucket(last, finer_seconds)
+                ).order_by("start").values_list("instrument__ticker", "start", "open", "high", "low", "close", "volume")
+                parts = [(ticker, start, values) for ticker, start, *values in rows]
+            parts += sorted(
+                ((ticker, start, candle) for (ticker, candle_period, start), candle in rebuilt.items() if candle_period == finer),
+                key=lambda part: part[1]
+            )
+            for ticker, start, candle in parts:
+                _fold(rebuilt, (ticker, period, bucket(start, seconds)), candle)
+        return rebuilt
+
+    def start(self, interval: float):
+        """Write changed candles to the database every `interval` seconds"""
+        self.interval = interval
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Candle flush failed, retrying", extra={"fields": {"rows": len(self._dirty)}})
+
+    async def flush(self):
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, {}
+        rows = []
+        for (ticker, period, start), candle in dirty.items():
+            instrument = instruments.get(ticker)
+            if instrument is not None:
+                rows.append((str(instrument.id), period, start, *candle))
+        try:
+            for offset in range(0, len(rows), FLUSH_CHUNK):
+                await _upsert(rows[offset:offset + FLUSH_CHUNK])
+        except Exception:
+            # Свечи - общие ссылки, в них уже последние значения
+            for key, candle in dirty.items():
+                self._dirty.setdefault(key, candle)
+            raise
+
+    def drop_ticker(self, ticker: str):
+        """The instrument is deleted (its candles go with it)"""
+        for period in PERIODS:
+            self._recent.pop((ticker, period), None)
+            self._evicted.pop((ticker, period), None)
+        for key in [key for key in self._dirty if key[0] == ticker]:
+            del self._dirty[key]
+
+
+async def _upsert(rows: List[tuple]):
+    """Write candles with their current values; rows of instruments deleted meanwhile are skipped"""
+    conn = connections.get("default")
+    postgres = conn.capabilities.dialect == "postgres"
+    values, params = [], []
+    for row in rows:
+        if postgres:
+            # Без целевой колонки (VALUES в WITH) postgres не выводит типы параметров
+            placeholders = [f"${len(params) + i + 1}{cast}" for i, cast in enumerate(_CASTS)]
+        else:
+            placeholders = ["?"] * len(_CASTS)
+        values.append("(" + ", ".join(placeholders) + ")")
+        params.extend(row)
+    await conn.execute_query(
+        f"WITH v ({_COLUMNS}) AS (VALUES {', '.join(values)}) "
+        f"INSERT INTO candles ({_COLUMNS}) SELECT {_COLUMNS} FROM v "
+        "WHERE EXISTS (SELECT 1 FROM instruments WHERE instruments.id = v.instrument_id) "
+        "ON CONFLICT (instrument_id, period, start) DO UPDATE SET "
+        "open = excluded.open, high = excluded.high, low = excluded.low, "
+        "close = excluded.close, volume = excluded.volume",
+        params
+    )
+
+
+candles = CandleStore(settings.CANDLES_MEMORY)
+engine.listeners.append(candles.on_update)
@@ -0,0 +1,104 @@
+import asyncio
+import logging
+from typing import Callable, Dict, List, Optional
+
+from app.models.instrument import Instrument
+
+logger = logging.getLogger(__name__)
+
+
+class InstrumentRegistry:
+    """In-process ticker -> Instrument map.
+
+    Loaded at startup and kept coherent by the admin endpoints that create
+    and delete instruments, so hot paths never query the table. Other API
+    processes (uvicorn workers) see those changes when they reload the
+    table every `interval` seconds (`start`); `removed_listeners` are told
+    of tickers that disappeared that way.
+    """
+
+    def __init__(self):
+        self._by_ticker: Dict[str, Instrument] = {}
+        self._listing: List[dict] = []
+        self._changes = 0  # add/remove этого процесса: снимок, начатый до них, устарел
+        self.removed_listeners: List[Callable[[str], None]] = []
+        self._task: Optional[asyncio.Task] = None
+
+    async def load(self):
+        self._by_ticker = {i.ticker: i for i in await Instrument.all().order_by("created_at")}
+        self._rebuild_listing()
+
+    async def refresh(self):
+        """Pick up instruments created or deleted by other processes"""
+        changes = self._changes
+        current = {i.ticker: i for i in await Instrument.all().order_by("created_at")}
+        if changes != self._changes:
+            return
+        if {t: i.id for t, i in current.items()} == {t: i.id for t, i in self._by_ticker.items()}:
+            return
+        # Удалён и создан заново с тем же тикером - тоже удалён
+        removed = [t for t, i in self._by_ticker.items() if t not in current or current[t].id != i.id]
+        self._by_ticker = current
+        self._rebuild_listing()
+        for ticker in removed:
+            for listener in self.removed_listeners:
+                listener(ticker)
+
+    def start(self, interval: float):
+        """Reload the table every `interval` seconds"""
+        self._task = asyncio.create_task(self._run(interval))
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.refresh()
+            except Exception:
+                logger.exception("Instrument refresh failed, retrying")
+
+    def get(self, ticker: str) -> Optional[Instrument]:
+        return self._by_ticker.get(ticker)
+
+    async def require(self, ticker: str, create: bool = False) -> Instrument:
+        """An instrument the application cannot run without (QUOTE_TICKER).
+
+        Missing, it is created with `create` (a schema generated for
+        development) or fails startup: with migrations 0009 creates it.
+        """
+        instrument = self.get(ticker)
+        if instrument is None:
+            if not create:
+                raise RuntimeError(f"Instrument {ticker} (QUOTE_TICKER) does not exist; run app/scripts/migrate.py")
+            instrument = await Instrument.create(name=ticker, ticker=ticker)
+            self.add(instrument)
+        return instrument
+
+    def add(self, instrument: Instrument):
+        self._by_ticker[instrument.ticker] = instrument
+        self._changes += 1
+        self._rebuild_listing()
+
+    def remove(self, ticker: str):
+        self._changes += 1
+        if self._by_ticker.pop(ticker, None) is not None:
+            self._rebuild_listing()
+
+    def listing(self) -> List[dict]:
+        """Ответ GET /public/instrument"""
+        return self._listing
+
+    def _rebuild_listing(self):
+        self._listing = [{"name": i.name, "ticker": i.ticker} for i in self._by_ticker.values()]
+
+
+instruments = InstrumentRegistry()
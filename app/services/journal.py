@@ -0,0 +1,354 @@
+"""Append-only binary journal of order, cancel and trade events.
+
+On disk a record is a u32 payload length, the u32 crc32 of the payload
+and the payload: a fixed struct (type, seq, timestamp, ids as 16 raw
+bytes, numbers) followed by the ticker in UTF-8. Records go to segment
+files named after the seq of their first event; segments the database
+has fully caught up with are deleted (release()).
+
+Group commit: append() only encodes into a buffer and assigns the next
+seq. A writer task writes everything buffered with one write and one
+fdatasync per batch, in a worker thread. A batch closes `window`
+seconds after its first event or at `max_batch` events, whichever comes
+first, and everything appended during an fsync goes into the next one.
+commit() waits until all events appended so far are on disk. After each
+batch `listeners` receive its events in seq order.
+"""
+import asyncio
+import logging
+import math
+import os
+import struct
+import threading
+import time
+import uuid
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, List, Optional, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+ORDER = 1
+CANCEL = 2
+TRADE = 3
+
+_RECORD = struct.Struct("!II")  # длина, crc32
+# тип, seq, ts, order, user, direction, time in force, qty, price (NaN - рыночный)
+_ORDER = struct.Struct("!BQd16s16sBBqd")
+# тип, seq, ts, order
+_CANCEL = struct.Struct("!BQd16s")
+# тип, seq, ts, price, qty, maker order/user/qty/filled, taker order/user/direction/qty/filled
+_TRADE = struct.Struct("!BQddq16s16sqq16s16sBqq")
+
+_DIRECTIONS = ("BUY", "SELL")
+_TIME_IN_FORCE = ("GTC", "IOC", "FOK")
+
+
+@dataclass(slots=True)
+class OrderEvent:
+    order_id: str
+    user_id: str
+    ticker: str
+    direction: str
+    qty: int
+    price: Optional[float]
+    ts: float
+    time_in_force: str = "GTC"
+    seq: int = 0
+
+
+@dataclass(slots=True)
+class CancelEvent:
+    order_id: str
+    ticker: str
+    ts: float
+    seq: int = 0
+
+
+@dataclass(slots=True)
+class TradeEvent:
+    """One fill; filled values are totals of both orders after it"""
+    ticker: str
+    price: float
+    qty: int
+    maker_order_id: str
+    maker_user_id: str
+    maker_qty: int
+    maker_filled: int
+    taker_order_id: str
+    taker_user_id: str
+    taker_direction: str
+    taker_qty: int
+    taker_filled: int
+    ts: float
+    seq: int = 0
+
+
+Event = Union[OrderEvent, CancelEvent, TradeEvent]
+
+
+def _id(value: str) -> bytes:
+    return uuid.UUID(value).bytes
+
+
+def _str(raw: bytes) -> str:
+    return str(uuid.UUID(bytes=raw))
+
+
+def encode(event: Event) -> bytes:
+    if isinstance(event, OrderEvent):
+        price = math.nan if event.price is None else event.price
+        payload = _ORDER.pack(
+            ORDER, event.seq, event.ts, _id(event.order_id), _id(event.user_id),
+            _DIRECTIONS.index(event.direction), _TIME_IN_FORCE.index(event.time_in_force), event.qty, price
+        )
+    elif isinstance(event, CancelEvent):
+        payload = _CANCEL.pack(CANCEL, event.seq, event.ts, _id(event.order_id))
+    else:
+        payload = _TRADE.pack(
+            TRADE, event.seq, event.ts, event.price, event.qty,
+            _id(event.maker_order_id), _id(event.maker_user_id), event.maker_qty, event.maker_filled,
+            _id(event.taker_order_id), _id(event.taker_user_id), _DIRECTIONS.index(event.taker_direction),
+            event.taker_qty, event.taker_filled
+        )
+    payload += event.ticker.encode()
+    return _RECORD.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def decode(payload: bytes) -> Event:
+    kind = payload[0]
+    if kind == ORDER:
+        _, seq, ts, order_id, user_id, direction, time_in_force, qty, price = _ORDER.unpack_from(payload)
+        return OrderEvent(
+            _str(order_id), _str(user_id), payload[_ORDER.size:].decode(), _DIRECTIONS[direction], qty,
+            None if math.isnan(price) else price, ts, _TIME_IN_FORCE[time_in_force], seq
+        )
+    if kind == CANCEL:
+        _, seq, ts, order_id = _CANCEL.unpack_from(payload)
+        return CancelEvent(_str(order_id), payload[_CANCEL.size:].decode(), ts, seq)
+    if kind == TRADE:
+        (_, seq, ts, price, qty, maker_order, maker_user, maker_qty, maker_filled,
+         taker_order, taker_user, taker_direction, taker_qty, taker_filled) = _TRADE.unpack_from(payload)
+        return TradeEvent(
+            payload[_TRADE.size:].decode(), price, qty, _str(maker_order), _str(maker_user), maker_qty, maker_filled,
+            _str(taker_order), _str(taker_user), _DIRECTIONS[taker_direction], taker_qty, taker_filled, ts, seq
+        )
+    raise ValueError(f"Unknown journal record type {kind}")
+
+
+def read_segment(path: str) -> Tuple[List[Event], int]:
+    """Events of one segment and the length of its intact prefix"""
+    with open(path, "rb") as file:
+        data = file.read()
+    events = []
+    offset = 0
+    while offset + _RECORD.size <= len(data):
+        length, crc = _RECORD.unpack_from(data, offset)
+        payload = data[offset + _RECORD.size:offset + _RECORD.size + length]
+        if len(payload) < length or zlib.crc32(payload) != crc:
+            break
+        events.append(decode(payload))
+        offset += _RECORD.size + length
+    return events, offset
+
+
+def segments(directory: str) -> List[Tuple[int, str]]:
+    """(first seq, path) of every segment, oldest first"""
+    found = []
+    for name in os.listdir(directory):
+        if name.endswith(".wal"):
+            found.append((int(name[:-4]), os.path.join(directory, name)))
+    return sorted(found)
+
+
+def read_journal(directory: str) -> List[Event]:
+    """All events on disk, oldest first.
+
+    A torn record at the end of the last segment (crash mid-write, never
+    acknowledged) is cut off; damage anywhere else is an error.
+    """
+    events = []
+    found = segments(directory)
+    for index, (_, path) in enumerate(found):
+        segment_events, intact = read_segment(path)
+        size = os.path.getsize(path)
+        if intact < size:
+            if index != len(found) - 1:
+                raise RuntimeError(f"Journal segment {path} is damaged at byte {intact}")
+            logger.warning("Cutting torn journal tail", extra={"fields": {"segment": path, "bytes": size - intact}})
+            os.truncate(path, intact)
+        events.extend(segment_events)
+    return events
+
+
+def _fsync_directory(directory: str):
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+_sync = getattr(os, "fdatasync", os.fsync)
+
+
+class Journal:
+    def __init__(self):
+        self.directory = ""
+        self.window = 0.0
+        self.max_batch = 0
+        self.segment_bytes = 0
+        self.seq = 0  # последний выданный seq
+        self.listeners: List[Callable[[List[Event]], None]] = []
+        self.batches = 0  # счётчики для бенчмарка и метрик
+        self.events = 0
+        self._fd: Optional[int] = None
+        # Дописывает поток записи при смене сегмента, удаляет release() из цикла событий
+        self._segments: List[Tuple[int, str]] = []
+        self._segments_lock = threading.Lock()
+        self._size = 0
+        self._buffer = bytearray()
+        self._batch: List[Event] = []
+        self._batch_started = 0.0
+        self._done: Optional[asyncio.Future] = None  # коммит открытого батча
+        self._inflight: Optional[asyncio.Future] = None  # коммит батча, который пишется
+        self._error: Optional[BaseException] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._full: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    @property
+    def active(self) -> bool:
+        return self._task is not None
+
+    @property
+    def error(self) -> Optional[BaseException]:
+        """Why the journal stopped accepting events (a failed write); None while it is writable"""
+        return self._error
+
+    def open(self, directory: str, next_seq: int, window: float, max_batch: int, segment_bytes: int):
+        """Start appending at `next_seq` (read_journal() the directory first)"""
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.window = window
+        self.max_batch = max_batch
+        self.segment_bytes = segment_bytes
+        self.seq = next_seq - 1
+        self._segments = segments(directory)
+        if self._segments:
+            path = self._segments[-1][1]
+            self._fd = os.open(path, os.O_WRONLY | os.O_APPEND)
+            self._size = os.path.getsize(path)
+        else:
+            self._new_segment(next_seq)
+        self._wake = asyncio.Event()
+        self._full = asyncio.Event()
+        self._done = asyncio.get_running_loop().create_future()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="journal")
+        self._task = asyncio.create_task(self._run())
+
+    def append(self, event: Event) -> int:
+        """Buffer an event; it is durable once commit() returns"""
+        if self._error is not None:
+            raise RuntimeError("Journal is not writable") from self._error
+        self.seq += 1
+        event.seq = self.seq
+        self._buffer += encode(event)
+        if not self._batch:
+            self._batch_started = time.monotonic()
+            self._wake.set()
+        self._batch.append(event)
+        if len(self._batch) >= self.max_batch:
+            self._full.set()
+        return event.seq
+
+    async def commit(self):
+        """Wait until everything appended so far is fsynced"""
+        if self._batch:
+            await asyncio.shield(self._done)
+        elif self._inflight is not None:
+            await asyncio.shield(self._inflight)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._wake.wait()
+            remaining = self.window - (time.monotonic() - self._batch_started)
+            if remaining > 0 and not self._full.is_set():
+                try:
+                    await asyncio.wait_for(self._full.wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+            self._wake.clear()
+            self._full.clear()
+
+            data, self._buffer = bytes(self._buffer), bytearray()
+            batch, self._batch = self._batch, []
+            done, self._done = self._done, loop.create_future()
+            self._inflight = done
+            try:
+                await loop.run_in_executor(self._executor, self._write, data, batch[-1].seq)
+            except Exception as error:
+                # Память уже впереди диска - дальше принимать события нельзя
+                logger.critical("Journal write failed", exc_info=True)
+                self._error = error
+                for future in (done, self._done):
+                    future.set_exception(error)
+                return
+            finally:
+                self._inflight = None
+            self.batches += 1
+            self.events += len(batch)
+            for listener in self.listeners:
+                listener(batch)
+            done.set_result(None)
+
+    def _write(self, data: bytes, last_seq: int):
+        view = memoryview(data)
+        while view:
+            view = view[os.write(self._fd, view):]
+        _sync(self._fd)
+        self._size += len(data)
+        if self._size >= self.segment_bytes:
+            os.close(self._fd)
+            self._new_segment(last_seq + 1)
+
+    def _new_segment(self, first_seq: int):
+        path = os.path.join(self.directory, f"{first_seq:020d}.wal")
+        self._fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        self._size = 0
+        with self._segments_lock:
+            self._segments.append((first_seq, path))
+        # Иначе после сбоя питания файла может не оказаться в каталоге
+        _fsync_directory(self.directory)
+
+    def release(self, upto_seq: int):
+        """Delete segments whose every event is at or below `upto_seq`"""
+        with self._segments_lock:
+            released = []
+            while len(self._segments) > 1 and self._segments[1][0] <= upto_seq + 1:
+                released.append(self._segments.pop(0)[1])
+        for path in released:
+            os.unlink(path)
+
+    async def close(self):
+        """Commit what is buffered and stop"""
+        if self._task is None:
+            return
+        if self._batch:
+            self._full.set()
+            await self.commit()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        self._executor.shutdown()
+        os.close(self._fd)
+        self._fd = None
+
+
+journal = Journal()
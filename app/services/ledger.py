@@ -0,0 +1,487 @@
+"""In-memory balances with reservations for open orders.
+
+`ledger` keeps, per user and ticker, the total amount and the part
+reserved by the user's open orders, so order entry checks and reserves
+funds without a database round trip. A BUY reserves its cost in
+QUOTE_TICKER (qty * price rounded up; a market BUY at the worst level it
+would reach now, its sweep limit), a SELL reserves the quantity of the
+instrument. A reservation is always what the order's remaining quantity
+needs: a fill pays the counterparty and the rest of a reservation is
+released once the order is cancelled or cannot fill any more. Prices are
+whole numbers of QUOTE_TICKER (the order schema rejects others), so a
+fill costs exactly qty * price and nobody gains on rounding.
+
+Loaded at startup from `balances` and the open orders. Changes made by
+fills are kept per taker order and written by `persist_fills` in the
+transaction of its trades; with the journal the settler writes them
+instead, also with the trades. What is left over (reservations released
+in shared mode, fills whose trades could not be written) is written
+behind: summed per (user, ticker) and flushed with one multi-row upsert
+every `interval` seconds. Admin withdrawals are checked here first and
+then by a conditional UPDATE.
+
+With `shared` (LEDGER_SHARED: several API processes sharing the shards)
+no process can own the balances, so they are not kept in memory: an
+order reserves funds with a conditional UPDATE of `balances.reserved`,
+and the process that accepted the taker of a fill writes the amounts and
+reservations of both sides together, computed from the fill alone.
+"""
+import asyncio
+import logging
+import math
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from app.core.config import settings
+from app.models.balance import Balance
+from app.models.order import Order, OPEN_STATUSES
+from tortoise.transactions import in_transaction
+
+from app.services import balance as balance_service
+from app.services.balance import InsufficientFunds, credit_many
+from app.services.instruments import instruments
+from app.models.instrument import Instrument
+from app.services.matching import BUY, SELL, GTC, BookOrder, BookUpdate, Fill, engine, persist_fills
+
+logger = logging.getLogger(__name__)
+
+
+def reserve_cost(qty: int, price: float) -> int:
+    return math.ceil(qty * price)
+
+
+def fill_cost(qty: int, price: float) -> int:
+    # Цены целые, floor - только для ордеров, принятых до этого правила:
+    # сумма по сделкам ордера не превысит его резерв
+    return math.floor(qty * price)
+
+
+def requirement(direction: str, price: float, remaining: int) -> int:
+    """What an order keeps reserved for its `remaining` quantity"""
+    return reserve_cost(remaining, price) if direction == BUY else remaining
+
+
+def fill_deltas(ticker: str, price: float, qty: int, buyer_id: str, seller_id: str) -> List[Tuple[str, str, int]]:
+    """(user_id, ticker, amount) changes a trade makes to balances"""
+    cost = fill_cost(qty, price)
+    quote = settings.QUOTE_TICKER
+    return [(buyer_id, quote, -cost), (buyer_id, ticker, qty), (seller_id, ticker, -qty), (seller_id, quote, cost)]
+
+
+def balance_rows(deltas: Iterable[Tuple[str, str, int]]) -> List[Tuple[str, object, int]]:
+    """(user_id, instrument_id, amount) for credit_many; tickers deleted meanwhile are skipped"""
+    rows = []
+    for user_id, ticker, amount in deltas:
+        instrument = instruments.get(ticker)
+        if instrument is not None and amount:
+            rows.append((user_id, instrument.id, amount))
+    return rows
+
+
+def _pending_row() -> List[int]:
+    return [0, 0]
+
+
+def _changes() -> Dict[Tuple[str, str], List[int]]:
+    return defaultdict(_pending_row)
+
+
+def _merge(target: Dict[Tuple[str, str], List[int]], changes: Dict[Tuple[str, str], List[int]]):
+    for key, (amount, reserved) in changes.items():
+        row = target[key]
+        row[0] += amount
+        row[1] += reserved
+
+
+def _rows(changes: Dict[Tuple[str, str], List[int]]) -> List[Tuple[str, object, int, int]]:
+    """(user_id, instrument_id, amount, reserved) for credit_many; tickers deleted meanwhile are skipped"""
+    rows = []
+    for (user_id, ticker), (amount, reserved) in changes.items():
+        instrument = instruments.get(ticker)
+        if instrument is not None and (amount or reserved):
+            rows.append((user_id, instrument.id, amount, reserved))
+    return rows
+
+
+class Ledger:
+    def __init__(self, shared: bool = False):
+        self.shared = shared
+        self.interval = 0.1
+        # user_id -> ticker -> [всего, в резерве]; с shared не используется
+        self._balances: Dict[str, Dict[str, List[int]]] = {}
+        # order_id -> [user_id, ticker ордера, ticker резерва, резерв, direction, price, остаток];
+        # с shared - только ордера этого процесса, пока идёт их матчинг
+        self._orders: Dict[str, list] = {}
+        # (user_id, ticker) -> [изменение amount, изменение reserved] к записи
+        self._pending: Dict[Tuple[str, str], List[int]] = _changes()
+        # taker order_id -> изменения от его сделок, пока их не записал persist_fills
+        self._unsettled: Dict[str, Dict[Tuple[str, str], List[int]]] = defaultdict(_changes)
+        self._flushing = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    def _entry(self, user_id: str, ticker: str) -> List[int]:
+        balances = self._balances.get(user_id)
+        if balances is None:
+            balances = self._balances[user_id] = {}
+        entry = balances.get(ticker)
+        if entry is None:
+            entry = balances[ticker] = [0, 0]
+        return entry
+
+    async def load(self, from_books: bool = False):
+        """Balances from the database; reservations of the open orders there, or of
+        the in-memory books with `from_books` (the journal, where the database lags)"""
+        self._balances = {}
+        self._orders = {}
+        self._pending.clear()
+        self._unsettled.clear()
+        self._flushing = asyncio.Lock()
+        if self.shared:
+            # Балансы и резервы - в базе
+            return
+        for user_id, ticker, amount in await Balance.all().values_list("user_id", "instrument__ticker", "amount"):
+            self._entry(str(user_id), ticker)[0] = amount
+
+        if from_books:
+            resting = [(book.ticker, order) for book in engine.books.values() for order in book.orders.values()]
+        else:
+            rows = await Order.filter(status__in=OPEN_STATUSES, price__isnull=False).values_list(
+                "ticker", "id", "user_id", "direction", "qty", "price", "filled"
+            )
+            resting = [
+                (ticker, BookOrder(id=str(order_id), user_id=str(user_id), direction=direction, qty=qty, price=price, filled=filled))
+                for ticker, order_id, user_id, direction, qty, price, filled in rows
+            ]
+        for ticker, order in resting:
+            # Без проверки: ордера уже приняты
+            self._hold(ticker, order)
+        await self._store_reserved()
+
+    async def _store_reserved(self):
+        """Write the reservations to `balances.reserved`, so LEDGER_SHARED can start from them"""
+        rows = []
+        for user_id, balances in self._balances.items():
+            for ticker, (_, reserved) in balances.items():
+                instrument = instruments.get(ticker)
+                if instrument is not None and reserved:
+                    rows.append((user_id, instrument.id, 0, reserved))
+        async with in_transaction("default") as conn:
+            await Balance.filter(reserved__not=0).using_db(conn).update(reserved=0)
+            await credit_many(rows, conn, existing_only=True)
+
+    def start(self, interval: float):
+        """Write fills behind to the database every `interval` seconds"""
+        self.interval = interval
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+        if not self.shared:
+            await self._store_reserved()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Balance flush failed, retrying", extra={"fields": {"rows": len(self._pending)}})
+
+    async def flush(self):
+        """Write the pending changes; waits for a flush already running, so after it they are all in"""
+        async with self._flushing:
+            if not self._pending:
+                return
+            pending, self._pending = self._pending, _changes()
+            try:
+                await credit_many(_rows(pending), existing_only=True)
+            except Exception:
+                _merge(self._pending, pending)
+                raise
+
+    async def persist_fills(self, matches: List[Tuple[Instrument, BookOrder, List[Fill]]], new_orders: Sequence[Order] = ()):
+        """matching.persist_fills with the balance changes of these takers' fills in its transaction"""
+        changes = _changes()
+        for _, taker, _ in matches:
+            _merge(changes, self._unsettled.pop(taker.id, {}))
+        try:
+            await persist_fills(matches, new_orders, _rows(changes))
+        except Exception:
+            # Сделки уже в стаканах и в памяти: база балансов не должна от них отстать
+            _merge(self._pending, changes)
+            raise
+
+    # --- ордера ---
+
+    def _hold(self, ticker: str, order: BookOrder):
+        asset = settings.QUOTE_TICKER if order.direction == BUY else ticker
+        amount = requirement(order.direction, order.limit_price, order.remaining)
+        if not self.shared:
+            self._entry(order.user_id, asset)[1] += amount
+        self._orders[order.id] = [order.user_id, ticker, asset, amount, order.direction, order.limit_price, order.remaining]
+
+    def _unreserve(self, user_id: str, asset: str, amount: int):
+        if self.shared:
+            self._pending[(user_id, asset)][1] -= amount
+            return
+        entry = self._balances.get(user_id, {}).get(asset)
+        if entry is not None:
+            entry[1] -= amount
+
+    async def reserve(self, ticker: str, order: BookOrder) -> bool:
+        """Reserve funds for an incoming order; False if the available balance does not cover it.
+
+        A market BUY gets the worst ask it would reach now as its sweep
+        limit, so it cannot spend more than was reserved. Market orders are
+        submitted only while the opposite side has orders (engine.has_liquidity).
+        With `shared` the database decides.
+        """
+        if order.price is None and order.direction == BUY:
+            order.sweep_limit = engine.sweep_price(ticker, BUY, order.remaining)
+            if order.sweep_limit is None:
+                # Без ограничения рыночный BUY прошёл бы по любой цене без резерва
+                return False
+        asset = settings.QUOTE_TICKER if order.direction == BUY else ticker
+        amount = requirement(order.direction, order.limit_price, order.remaining)
+        if self.shared:
+            instrument = instruments.get(asset)
+            if amount and (instrument is None or not await balance_service.reserve(order.user_id, instrument.id, amount)):
+                return False
+        else:
+            entry = self._balances.get(order.user_id, {}).get(asset)
+            if amount and (entry is None or entry[0] - entry[1] < amount):
+                return False
+        self._hold(ticker, order)
+        return True
+
+    def release(self, order_id: str):
+        """Give back what is left of an order's reservation"""
+        # Сделки, которые не дошли до persist_fills (матчинг оборвался), - в фоновую запись
+        unsettled = self._unsettled.pop(order_id, None)
+        if unsettled:
+            _merge(self._pending, unsettled)
+        reservation = self._orders.pop(order_id, None)
+        if reservation is not None:
+            self._unreserve(reservation[0], reservation[2], reservation[3])
+
+    def cancelled(self, order_id: str, user_id, ticker: str, direction: str, price: float, remaining: int):
+        """An order left the book with `remaining` unfilled: release its reservation.
+
+        With `shared` another process may have reserved it, so what is left
+        is computed from the order.
+        """
+        if not self.shared:
+            self.release(order_id)
+            return
+        self._orders.pop(order_id, None)
+        asset = settings.QUOTE_TICKER if direction == BUY else ticker
+        self._unreserve(str(user_id), asset, requirement(direction, price, remaining))
+
+    def matched(self, order: BookOrder):
+        """After matching an incoming order: release the rest unless it rests in the book"""
+        if not order.remaining or order.time_in_force != GTC:
+            self.release(order.id)
+        elif self.shared:
+            # Резерв остаётся в базе, дальше его ведут сделки и отмена
+            self._orders.pop(order.id, None)
+
+    def on_update(self, update: BookUpdate):
+        """Engine listener: move the funds of every fill"""
+        quote = settings.QUOTE_TICKER
+        for fill in update.fills:
+            taker = self._orders.get(fill.taker_order_id)
+            # В базу пишет процесс, принявший taker (с шардами обновления получают все),
+            # вместе со сделками: persist_fills заберёт изменения по id taker
+            changes = self._unsettled[fill.taker_order_id] if self._task is not None and taker is not None else None
+            if self.shared and changes is None:
+                continue
+
+            # Резерв - всегда то, что нужно остатку ордера: сделка освобождает разницу
+            maker = self._orders.get(fill.maker_order_id)
+            maker_direction = SELL if fill.taker_direction == BUY else BUY
+            maker_remaining = fill.maker_qty - fill.maker_filled
+            maker_freed = 0
+            if maker is not None or self.shared:
+                maker_freed = (requirement(maker_direction, fill.price, maker_remaining + fill.qty)
+                               - requirement(maker_direction, fill.price, maker_remaining))
+            if maker is not None:
+                maker[3] -= maker_freed
+                maker[6] = maker_remaining
+            taker_freed = 0
+            if taker is not None:
+                taker[6] -= fill.qty
+                left = requirement(taker[4], taker[5], taker[6])
+                taker_freed, taker[3] = taker[3] - left, left
+
+            if fill.taker_direction == BUY:
+                buyer, buyer_freed, seller, seller_freed = fill.taker_user_id, taker_freed, fill.maker_user_id, maker_freed
+            else:
+                buyer, buyer_freed, seller, seller_freed = fill.maker_user_id, maker_freed, fill.taker_user_id, taker_freed
+            cost = fill_cost(fill.qty, fill.price)
+            self._move(buyer, quote, -cost, buyer_freed, changes)
+            self._move(buyer, update.ticker, fill.qty, 0, changes)
+            self._move(seller, update.ticker, -fill.qty, seller_freed, changes)
+            self._move(seller, quote, cost, 0, changes)
+            if maker is not None and not maker_remaining:
+                del self._orders[fill.maker_order_id]
+
+    def _move(self, user_id: str, ticker: str, amount: int, freed: int = 0,
+              changes: Optional[Dict[Tuple[str, str], List[int]]] = None):
+        """Change a balance by `amount` and its reservation by -`freed`; `changes` collects it for the database"""
+        if not self.shared:
+            entry = self._entry(user_id, ticker)
+            entry[0] += amount
+            entry[1] -= freed
+        if changes is not None:
+            row = changes[(user_id, ticker)]
+            row[0] += amount
+            if self.shared:
+                row[1] -= freed
+
+    def apply(self, deltas: Iterable[Tuple[str, str, int]]):
+        """Changes already in the database or written elsewhere (journal replay)"""
+        for user_id, ticker, amount in deltas:
+            self._move(user_id, ticker, amount)
+
+    # --- балансы ---
+
+    async def available(self, user_id: str) -> Dict[str, int]:
+        """ticker -> amount not reserved by open orders"""
+        if self.shared:
+            rows = await Balance.filter(user_id=user_id).values_list("instrument__ticker", "amount", "reserved")
+            return {ticker: amount - reserved for ticker, amount, reserved in rows}
+        return {ticker: total - reserved for ticker, (total, reserved) in self._balances.get(user_id, {}).items()}
+
+    def credit(self, user_id: str, ticker: str, amount: int):
+        """A deposit already written to the database"""
+        self._move(str(user_id), ticker, amount)
+
+    async def withdraw(self, user_id, ticker: str, amount: int):
+        """Take `amount` out of the available balance or raise InsufficientFunds.
+
+        The in-memory check only rejects early; the write is a conditional
+        UPDATE, so the database never lets a balance go below its
+        reservations (below zero without `shared`).
+        """
+        user_id = str(user_id)
+        entry = None
+        if not self.shared:
+            entry = self._balances.get(user_id, {}).get(ticker)
+            available = entry[0] - entry[1] if entry else 0
+            if available < amount:
+                raise InsufficientFunds(available, amount)
+            # До await: ордера не зарезервируют то, что списывается
+            entry[0] -= amount
+        try:
+            # Сделки, ещё не записанные в базу, - до проверки в ней
+            await self.flush()
+            await balance_service.debit(user_id, instruments.get(ticker).id, amount, reserved=self.shared)
+        except Exception:
+            if entry is not None:
+                entry[0] += amount
+            raise
+
+    async def apply_bulk(self, rows: Sequence[Tuple[object, str, int]], atomic: bool = False) -> List[Tuple[int, str]]:
+        """Apply signed (user_id, ticker, amount) rows: debits are checked in order
+        against the available balances in memory, then against the locked rows
+        in the database; accepted rows are written with one multi-row upsert.
+
+        Returns (index, error) for every rejected row; with `atomic=True` any
+        rejection means nothing is applied.
+        """
+        failures = []
+        accepted = []  # (index, user_id, ticker, amount)
+        deltas = defaultdict(int)
+        for index, (user_id, ticker, amount) in enumerate(rows):
+            key = (str(user_id), ticker)
+            if amount < 0 and not self.shared:
+                entry = self._balances.get(key[0], {}).get(ticker)
+                available = entry[0] - entry[1] if entry else 0
+                if available + deltas[key] + amount < 0:
+                    failures.append((index, "Insufficient funds"))
+                    continue
+            deltas[key] += amount
+            accepted.append((index, key[0], ticker, amount))
+        if failures and atomic:
+            return failures
+
+        # Списания - в памяти до await, пополнения - после записи
+        debits = [(user_id, ticker, amount) for _, user_id, ticker, amount in accepted if amount < 0]
+        self.apply(debits)
+        try:
+            await self.flush()
+            rejected = await self._write_bulk(accepted, atomic)
+        except Exception:
+            self.apply((user_id, ticker, -amount) for user_id, ticker, amount in debits)
+            raise
+        failures.extend((index, "Insufficient funds") for index in rejected)
+        if rejected and atomic:
+            self.apply((user_id, ticker, -amount) for user_id, ticker, amount in debits)
+            return failures
+        self.apply(
+            (user_id, ticker, -amount if index in rejected else amount)
+            for index, user_id, ticker, amount in accepted if amount > 0 or index in rejected
+        )
+        return failures
+
+    async def _write_bulk(self, accepted: List[Tuple[int, str, str, int]], atomic: bool) -> set:
+        """Check debits against the locked balances and write the rest; indexes of rejected rows"""
+        rejected = set()
+        async with in_transaction("default") as conn:
+            current = {}
+            debited = {instruments.get(ticker).id: ticker for _, _, ticker, amount in accepted if amount < 0}
+            if debited:
+                balances = await Balance.filter(
+                    user_id__in={user_id for _, user_id, _, amount in accepted if amount < 0},
+                    instrument_id__in=list(debited)
+                ).select_for_update().using_db(conn)
+                current = {
+                    (str(b.user_id), debited[b.instrument_id]): b.amount - (b.reserved if self.shared else 0)
+                    for b in balances
+                }
+
+            deltas = defaultdict(int)
+            for index, user_id, ticker, amount in accepted:
+                key = (user_id, ticker)
+                if amount < 0 and current.get(key, 0) + deltas[key] + amount < 0:
+                    rejected.add(index)
+                    continue
+                deltas[key] += amount
+            if rejected and atomic:
+                return rejected
+            await credit_many(balance_rows((user_id, ticker, amount) for (user_id, ticker), amount in deltas.items()), conn)
+        return rejected
+
+    def drop_user(self, user_id: str):
+        """The user is deleted (balances go with it)"""
+        user_id = str(user_id)
+        self._balances.pop(user_id, None)
+        for key in [key for key in self._pending if key[0] == user_id]:
+            del self._pending[key]
+
+    async def drop_ticker(self, ticker: str):
+        """The instrument is deleted: its balances are gone and its orders release their reservations"""
+        if self.shared:
+            # Резервы BUY ордеров в QUOTE_TICKER - в базе, их ставили и другие процессы
+            rows = await Order.filter(ticker=ticker, direction=BUY, status__in=OPEN_STATUSES, price__isnull=False).values_list(
+                "id", "user_id", "qty", "filled", "price"
+            )
+            for order_id, user_id, qty, filled, price in rows:
+                self.cancelled(str(order_id), user_id, ticker, BUY, price, qty - filled)
+        for order_id in [order_id for order_id, reservation in self._orders.items() if reservation[1] == ticker]:
+            self.release(order_id)
+        for balances in self._balances.values():
+            balances.pop(ticker, None)
+        for key in [key for key in self._pending if key[1] == ticker]:
+            del self._pending[key]
+
+
+ledger = Ledger(settings.LEDGER_SHARED)
+engine.listeners.append(ledger.on_update)
@@ -1,32 +1,145 @@
+import json
 import logging
-from fastapi import Request
+import queue
+import random
 import time
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
+
+from app.core.config import settings
 
 logger = logging.getLogger(__name__)
 
-async def log_requests(request: Request, call_next):
-    start_time = time.time()
-    
-    # Логируем входящий запрос
-    logger.info(
-        f"Request: {request.method} {request.url.path} | "
-        f"Headers: {dict(request.headers)} | "
-        f"Body: {await request.body()} |"
-        f"Query Params: {dict(request.query_params)} | "
-        f"Client: {request.client.host if request.client else None}"
-        
-    )
-    
-    try:
-        response = await call_next(request)
-    except Exception as e:
-        logger.error(f"Request failed: {str(e)}")
-        raise
-    
-    process_time = time.time() - start_time
-    logger.info(
-        f"Response: {response.status_code} | "
-        f"Process Time: {process_time:.2f}s"
-    )
-    
-    return response
\ No newline at end of file
+_listener: Optional[QueueListener] = None
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line; structured fields come from `extra={"fields": ...}`"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        fields = getattr(record, "fields", None)
+        if fields:
+            entry.update(fields)
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class _DeferredQueueHandler(QueueHandler):
+    """QueueHandler that leaves all formatting to the listener thread"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def setup_logging():
+    """Route all logging through a queue drained by a background writer thread.
+
+    The event loop only pays for a `queue.put`; formatting and file/console
+    I/O happen on the listener thread.
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    formatter = JsonFormatter()
+    handlers = [logging.StreamHandler()]
+    if settings.LOG_FILE:
+        handlers.append(logging.FileHandler(settings.LOG_FILE))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    root.handlers = [_DeferredQueueHandler(log_queue)]
+    root.setLevel(settings.LOG_LEVEL)
+
+    _listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+
+
+def shutdown_logging():
+    """Flush queued records and stop the writer thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+class RequestLogMiddleware:
+    """ASGI middleware that logs one structured line per (sampled) request.
+
+    Headers listed in LOG_REDACT_HEADERS are masked. Request bodies are only
+    captured when LOG_BODY_MAX_BYTES > 0, and then only the first
+    LOG_BODY_MAX_BYTES bytes as the application reads them, so nothing is
+    buffered on the middleware's behalf. Failed requests and 5xx responses
+    are always logged regardless of sampling.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.sample_rate = settings.LOG_SAMPLE_RATE
+        self.body_max_bytes = settings.LOG_BODY_MAX_BYTES
+        self.redact = {h.strip().lower().encode() for h in settings.LOG_REDACT_HEADERS.split(",") if h.strip()}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        sampled = self.sample_rate >= 1 or random.random() < self.sample_rate
+        start_time = time.perf_counter()
+        status_code = 500
+        body = bytearray()
+
+        if sampled and self.body_max_bytes > 0:
+            downstream_receive = receive
+
+            async def receive():
+                message = await downstream_receive()
+                if message["type"] == "http.request" and len(body) < self.body_max_bytes:
+                    body.extend(message.get("body", b"")[:self.body_max_bytes - len(body)])
+                return message
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except Exception:
+            self._log(scope, 500, start_time, body, exc_info=True)
+            raise
+
+        if sampled or status_code >= 500:
+            self._log(scope, status_code, start_time, body)
+
+    def _log(self, scope, status_code: int, start_time: float, body: bytearray, exc_info=False):
+        fields = {
+            "method": scope["method"],
+            "path": scope["path"],
+            "query": scope.get("query_string", b"").decode("latin-1"),
+            "status": status_code,
+            "duration_ms": round((time.perf_counter() - start_time) * 1000, 3),
+            "client": scope["client"][0] if scope.get("client") else None,
+            "headers": {
+                name.decode("latin-1"): "***" if name in self.redact else value.decode("latin-1")
+                for name, value in scope["headers"]
+            },
+        }
+        if self.body_max_bytes > 0:
+            fields["body"] = body.decode("utf-8", errors="replace")
+
+        if exc_info:
+            logger.error("Request failed", exc_info=True, extra={"fields": fields})
+        else:
+            logger.info("Request", extra={"fields": fields})
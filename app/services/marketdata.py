@@ -0,0 +1,114 @@
+import asyncio
+import json
+import time
+from typing import Dict, Optional, Set
+
+from app.core.config import settings
+from app.services.matching import BookUpdate, engine
+
+# Сигнал подписчику: буфер переполнен, нужно переподписаться за новым снимком
+LAGGED = object()
+
+
+class Subscriber:
+    """One client connection with its own bounded outgoing buffer"""
+
+    __slots__ = ("ticker", "queue")
+
+    def __init__(self, ticker: str, buffer_size: int):
+        self.ticker = ticker
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=buffer_size)
+
+
+class MarketDataHub:
+    """Fans book updates of each ticker out to its WebSocket subscribers.
+
+    Every update is encoded once and pushed to each subscriber's queue with
+    put_nowait, so the publisher (the matching path) never waits on a
+    client. A subscriber whose buffer is full is dropped and receives
+    LAGGED; it has to resubscribe to get a fresh snapshot.
+    """
+
+    def __init__(self, buffer_size: int):
+        self.buffer_size = buffer_size
+        self.feeds: Dict[str, Set[Subscriber]] = {}
+        self.dropped = 0
+
+    def subscribe(self, ticker: str, depth: int) -> Subscriber:
+        """Register a subscriber; its first message is a book snapshot.
+
+        Snapshot and registration happen without yielding to the event
+        loop, so the first update the subscriber sees has seq == snapshot
+        seq + 1.
+        """
+        subscriber = Subscriber(ticker, self.buffer_size)
+        book = engine.books.get(ticker)
+        bids, asks = engine.depth(ticker, depth)
+        subscriber.queue.put_nowait(json.dumps({
+            "type": "snapshot",
+            "ticker": ticker,
+            "seq": book.seq if book else 0,
+            "bids": bids,
+            "asks": asks,
+        }))
+        self.feeds.setdefault(ticker, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        feed = self.feeds.get(subscriber.ticker)
+        if feed is not None:
+            feed.discard(subscriber)
+            if not feed:
+                del self.feeds[subscriber.ticker]
+
+    def publish(self, update: BookUpdate):
+        """Engine listener: encode the update once and fan it out"""
+        feed = self.feeds.get(update.ticker)
+        if not feed:
+            return
+
+        message = json.dumps({
+            "type": "update",
+            "ticker": update.ticker,
+            "seq": update.seq,
+            "ts": time.time(),
+            "bids": update.bids,
+            "asks": update.asks,
+            "trades": [
+                {
+                    "price": fill.price,
+                    "qty": fill.qty,
+                    "side": fill.taker_direction,
+                }
+                for fill in update.fills
+            ],
+        })
+
+        lagging = []
+        for subscriber in feed:
+            try:
+                subscriber.queue.put_nowait(message)
+            except asyncio.QueueFull:
+                lagging.append(subscriber)
+
+        for subscriber in lagging:
+            self._drop(subscriber)
+
+    def _drop(self, subscriber: Subscriber):
+        self.unsubscribe(subscriber)
+        self.dropped += 1
+        # Освобождаем буфер, чтобы сигнал точно поместился
+        while not subscriber.queue.empty():
+            subscriber.queue.get_nowait()
+        subscriber.queue.put_nowait(LAGGED)
+
+    def close(self, ticker: Optional[str] = None):
+        """Disconnect every subscriber (of one ticker, e.g. a deleted instrument)"""
+        tickers = [ticker] if ticker is not None else list(self.feeds)
+        for name in tickers:
+            for subscriber in list(self.feeds.get(name, ())):
+                self._drop(subscriber)
+
+
+hub = MarketDataHub(settings.MARKETDATA_BUFFER_SIZE)
+engine.listeners.append(hub.publish)
@@ -0,0 +1,502 @@
+import time
+from bisect import bisect_left, insort
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from tortoise.transactions import in_transaction
+
+from app.models.instrument import Instrument
+from app.models.order import Order, OPEN_STATUSES, NEW, PARTIALLY_FILLED, FILLED, CANCELLED
+from app.models.trade import Trade
+from app.services.balance import credit_many
+
+BUY = "BUY"
+SELL = "SELL"
+
+# Time in force
+GTC = "GTC"  # остаток встаёт в стакан
+IOC = "IOC"  # остаток снимается
+FOK = "FOK"  # исполняется целиком или не исполняется вовсе
+TIME_IN_FORCE = (GTC, IOC, FOK)
+
+
+@dataclass(slots=True)
+class BookOrder:
+    """Ордер, стоящий в стакане или входящий в него.
+
+    price is None for a market order, which never rests. A market BUY
+    gets `sweep_limit`, the worst price its reservation covers, when funds
+    are reserved; it bounds matching only and is never written as price.
+    """
+    id: str
+    user_id: str
+    direction: str
+    qty: int
+    price: Optional[float]
+    filled: int = 0
+    time_in_force: str = GTC
+    sweep_limit: Optional[float] = None
+
+    @property
+    def remaining(self) -> int:
+        return self.qty - self.filled
+
+    @property
+    def limit_price(self) -> Optional[float]:
+        """Worst price the order may trade at; None - any (a market SELL)"""
+        return self.price if self.price is not None else self.sweep_limit
+
+
+@dataclass(slots=True)
+class Fill:
+    """Одна сделка между стоящим (maker) и входящим (taker) ордером"""
+    price: float
+    qty: int
+    maker_order_id: str
+    maker_user_id: str
+    maker_qty: int
+    maker_filled: int  # filled у maker после этой сделки
+    taker_order_id: str
+    taker_user_id: str
+    taker_direction: str
+    ts: float  # время сделки (unix): по нему свечи и executed_at
+
+
+@dataclass(slots=True)
+class BookUpdate:
+    """Изменение книги после одной операции, для рассылки подписчикам.
+
+    bids/asks содержат новые (price, qty) затронутых уровней, qty == 0
+    означает, что уровень исчез.
+    """
+    ticker: str
+    seq: int
+    bids: List[Tuple[float, int]]
+    asks: List[Tuple[float, int]]
+    fills: List[Fill]
+
+
+class _Side:
+    """One side of the book: sorted price levels with a FIFO queue per level.
+
+    Prices are stored as sort keys (price for bids, -price for asks), so the
+    best level is always the last key and can be popped in O(1). `volume`
+    keeps the L2 aggregate (price -> total remaining qty) up to date.
+    """
+
+    __slots__ = ("sign", "keys", "levels", "volume")
+
+    def __init__(self, direction: str):
+        self.sign = 1 if direction == BUY else -1
+        self.keys: List[float] = []
+        self.levels: Dict[float, deque] = {}
+        self.volume: Dict[float, int] = {}
+
+    def __bool__(self) -> bool:
+        return bool(self.keys)
+
+    def best_price(self) -> Optional[float]:
+        return self.sign * self.keys[-1] if self.keys else None
+
+    def crossed_by(self, price: Optional[float]) -> bool:
+        """Does an incoming order at `price` (None - market) cross the best level of this side"""
+        return bool(self.keys) and (price is None or self.keys[-1] >= self.sign * price)
+
+    def can_fill(self, price: Optional[float], qty: int) -> bool:
+        """Is there `qty` on the levels an incoming order at `price` crosses"""
+        sign, volume = self.sign, self.volume
+        for key in reversed(self.keys):
+            if price is not None and key < sign * price:
+                break
+            qty -= volume[sign * key]
+            if qty <= 0:
+                return True
+        return False
+
+    def add(self, order: BookOrder):
+        level = self.levels.get(order.price)
+        if level is None:
+            level = self.levels[order.price] = deque()
+            self.volume[order.price] = 0
+            insort(self.keys, self.sign * order.price)
+        level.append(order)
+        self.volume[order.price] += order.remaining
+
+    def remove(self, order: BookOrder):
+        level = self.levels[order.price]
+        level.remove(order)
+        self.volume[order.price] -= order.remaining
+        if not level:
+            self._drop_level(order.price)
+
+    def reduce(self, price: float, qty: int):
+        """Account for `qty` executed against the level at `price`"""
+        self.volume[price] -= qty
+
+    def pop_best_level(self):
+        price = self.sign * self.keys.pop()
+        del self.levels[price]
+        del self.volume[price]
+
+    def sweep_price(self, qty: int) -> Optional[float]:
+        """Worst price an incoming order for `qty` would reach (the last level if there is not enough)"""
+        sign, volume = self.sign, self.volume
+        price = None
+        for key in reversed(self.keys):
+            price = sign * key
+            qty -= volume[price]
+            if qty <= 0:
+                break
+        return price
+
+    def top(self, limit: int) -> List[Tuple[float, int]]:
+        """Best `limit` levels as (price, qty), best first"""
+        sign, volume = self.sign, self.volume
+        return [(sign * key, volume[sign * key]) for key in self.keys[:-limit - 1:-1]]
+
+    def _drop_level(self, price: float):
+        del self.levels[price]
+        del self.volume[price]
+        key = self.sign * price
+        del self.keys[bisect_left(self.keys, key)]
+
+
+class OrderBook:
+    """Книга заявок одного инструмента"""
+
+    def __init__(self, ticker: str):
+        self.ticker = ticker
+        self.bids = _Side(BUY)
+        self.asks = _Side(SELL)
+        self.orders: Dict[str, BookOrder] = {}
+        self.seq = 0  # растёт при каждом изменении книги
+
+    def _side(self, direction: str) -> _Side:
+        return self.bids if direction == BUY else self.asks
+
+    def add(self, order: BookOrder):
+        """Put an order on the book without matching (used on restore)"""
+        self._side(order.direction).add(order)
+        self.orders[order.id] = order
+
+    def submit(self, order: BookOrder) -> List[Fill]:
+        """Match an incoming order in one pass over the levels it crosses.
+
+        The remainder of a GTC limit order rests; that of IOC, FOK and
+        market orders is dropped. A FOK order that cannot fill completely
+        is rejected before anything in the book changes.
+        """
+        opposite = self.asks if order.direction == BUY else self.bids
+        limit_price = order.limit_price
+        if order.time_in_force == FOK and not opposite.can_fill(limit_price, order.remaining):
+            return []
+        fills = []
+        ts = time.time()
+
+        while order.remaining and opposite.crossed_by(limit_price):
+            price = opposite.best_price()
+            level = opposite.levels[price]
+            while level and order.remaining:
+                maker = level[0]
+                qty = min(maker.remaining, order.remaining)
+                maker.filled += qty
+                order.filled += qty
+                opposite.reduce(price, qty)
+                fills.append(Fill(
+                    price=price,
+                    qty=qty,
+                    maker_order_id=maker.id,
+                    maker_user_id=maker.user_id,
+                    maker_qty=maker.qty,
+                    maker_filled=maker.filled,
+                    taker_order_id=order.id,
+                    taker_user_id=order.user_id,
+                    taker_direction=order.direction,
+                    ts=ts,
+                ))
+                if not maker.remaining:
+                    level.popleft()
+                    del self.orders[maker.id]
+            if not level:
+                opposite.pop_best_level()
+
+        if order.remaining and order.time_in_force == GTC and order.price is not None:
+            self.add(order)
+        if fills or order.id in self.orders:
+            self.seq += 1
+        return fills
+
+    def cancel(self, order_id: str) -> Optional[BookOrder]:
+        order = self.orders.pop(order_id, None)
+        if order is not None:
+            self._side(order.direction).remove(order)
+            self.seq += 1
+        return order
+
+    def cancel_many(self, order_ids) -> List[BookOrder]:
+        """Cancel several orders as one book change (seq grows once)"""
+        cancelled = []
+        for order_id in order_ids:
+            order = self.orders.pop(order_id, None)
+            if order is not None:
+                self._side(order.direction).remove(order)
+                cancelled.append(order)
+        if cancelled:
+            self.seq += 1
+        return cancelled
+
+    def set_filled(self, order_id: str, filled: int):
+        """Apply a fill recorded elsewhere (journal replay); removes the order once done"""
+        order = self.orders.get(order_id)
+        if order is None:
+            return
+        side = self._side(order.direction)
+        side.reduce(order.price, filled - order.filled)
+        order.filled = filled
+        if not order.remaining:
+            del self.orders[order_id]
+            side.remove(order)
+        self.seq += 1
+
+    def level_update(self, direction: str, prices) -> List[Tuple[float, int]]:
+        """Current (price, qty) of the given levels of one side"""
+        volume = self._side(direction).volume
+        return [(price, volume.get(price, 0)) for price in prices]
+
+    def depth(self, limit: int):
+        """L2 snapshot: (bid_levels, ask_levels), `limit` levels per side"""
+        return self.bids.top(limit), self.asks.top(limit)
+
+    def sweep_price(self, direction: str, qty: int) -> Optional[float]:
+        return (self.asks if direction == BUY else self.bids).sweep_price(qty)
+
+
+class MatchingEngine:
+    """Набор книг заявок, по одной на тикер"""
+
+    def __init__(self):
+        self.books: Dict[str, OrderBook] = {}
+        # Вызываются синхронно с BookUpdate после каждого изменения книги
+        self.listeners: List[Callable[[BookUpdate], None]] = []
+
+    def book(self, ticker: str) -> OrderBook:
+        book = self.books.get(ticker)
+        if book is None:
+            book = self.books[ticker] = OrderBook(ticker)
+        return book
+
+    def submit(self, ticker: str, order: BookOrder) -> List[Fill]:
+        book = self.book(ticker)
+        fills = book.submit(order)
+        rested = order.id in book.orders
+        if self.listeners and (fills or rested):
+            opposite = SELL if order.direction == BUY else BUY
+            changed = {opposite: {fill.price for fill in fills}, order.direction: set()}
+            if rested:
+                changed[order.direction].add(order.price)
+            self._notify(book, changed, fills)
+        return fills
+
+    def cancel(self, ticker: str, order_id: str) -> Optional[BookOrder]:
+        book = self.books.get(ticker)
+        order = book.cancel(order_id) if book else None
+        if order is not None and self.listeners:
+            self._notify(book, {order.direction: {order.price}}, [])
+        return order
+
+    def cancel_many(self, ticker: str, order_ids) -> List[BookOrder]:
+        """Cancel orders of one book with a single update to the listeners"""
+        book = self.books.get(ticker)
+        cancelled = book.cancel_many(order_ids) if book else []
+        if cancelled and self.listeners:
+            changed = {BUY: set(), SELL: set()}
+            for order in cancelled:
+                changed[order.direction].add(order.price)
+            self._notify(book, changed, [])
+        return cancelled
+
+    def find(self, order_id: str) -> Optional[Tuple[str, BookOrder]]:
+        """(ticker, order) of a resting order"""
+        for book in self.books.values():
+            order = book.orders.get(order_id)
+            if order is not None:
+                return book.ticker, order
+        return None
+
+    def _notify(self, book: OrderBook, changed: Dict[str, set], fills: List[Fill]):
+        update = BookUpdate(
+            ticker=book.ticker,
+            seq=book.seq,
+            bids=book.level_update(BUY, changed.get(BUY, ())),
+            asks=book.level_update(SELL, changed.get(SELL, ())),
+            fills=fills,
+        )
+        for listener in self.listeners:
+            listener(update)
+
+    def depth(self, ticker: str, limit: int):
+        book = self.books.get(ticker)
+        return book.depth(limit) if book else ([], [])
+
+    def sweep_price(self, ticker: str, direction: str, qty: int) -> Optional[float]:
+        """Worst opposite price a market order for `qty` would reach now; None if the side is empty"""
+        book = self.books.get(ticker)
+        return book.sweep_price(direction, qty) if book else None
+
+    def has_liquidity(self, ticker: str, direction: str) -> bool:
+        """Is there anything an incoming `direction` order could trade against now"""
+        return self.sweep_price(ticker, direction, 1) is not None
+
+    def drop(self, ticker: str):
+        self.books.pop(ticker, None)
+
+    def clear(self):
+        self.books.clear()
+
+
+engine = MatchingEngine()
+
+
+async def restore_books(tickers: Optional[List[str]] = None):
+    """Load open orders from the database into the in-memory books.
+
+    `tickers` limits the load to those instruments (a matching shard).
+    """
+    engine.clear()
+    query = Order.filter(status__in=OPEN_STATUSES, price__isnull=False)
+    if tickers is not None:
+        query = query.filter(ticker__in=tickers)
+    # Кортежи вместо моделей: на десятках тысяч ордеров это большая часть старта
+    rows = await query.order_by("created_at").values_list("ticker", "id", "user_id", "direction", "qty", "price", "filled")
+    for ticker, order_id, user_id, direction, qty, price, filled in rows:
+        engine.book(ticker).add(BookOrder(
+            id=str(order_id),
+            user_id=str(user_id),
+            direction=direction,
+            qty=qty,
+            price=price,
+            filled=filled,
+        ))
+
+
+def order_status(filled: int, qty: int, time_in_force: str = GTC) -> str:
+    """Status of an order after matching; only a GTC remainder stays open"""
+    if filled == qty:
+        return FILLED
+    if time_in_force != GTC:
+        return CANCELLED
+    return PARTIALLY_FILLED if filled else NEW
+
+
+async def persist_fills(matches: List[Tuple[Instrument, BookOrder, List[Fill]]], new_orders: Sequence[Order] = (),
+                        balances: Sequence[Tuple[str, object, int, int]] = ()):
+    """Write trades and filled/status of every touched order in one transaction.
+
+    `matches` is a list of (instrument, taker, fills) as returned by
+    engine.submit, in submission order. `new_orders` are inserted in the
+    same transaction (takers matched before they were written, with their
+    final filled/status already set), and so are `balances`, the
+    (user_id, instrument_id, amount, reserved) changes the fills made.
+    """
+    filled = {}  # order_id -> (filled, qty)
+    trades = []
+
+    def touch(order_id, order_filled, qty):
+        if order_filled > filled.get(order_id, (-1, 0))[0]:
+            filled[order_id] = (order_filled, qty)
+
+    for instrument, taker, fills in matches:
+        for fill in fills:
+            touch(fill.maker_order_id, fill.maker_filled, fill.maker_qty)
+            if fill.taker_direction == BUY:
+                buy, buyer = fill.taker_order_id, fill.taker_user_id
+                sell, seller = fill.maker_order_id, fill.maker_user_id
+            else:
+                buy, buyer = fill.maker_order_id, fill.maker_user_id
+                sell, seller = fill.taker_order_id, fill.taker_user_id
+            trades.append(Trade(
+                instrument_id=instrument.id,
+                ticker=instrument.ticker,
+                price=fill.price,
+                qty=fill.qty,
+                buy_order_id=buy,
+                sell_order_id=sell,
+                buyer_id=buyer,
+                seller_id=seller,
+                executed_at=datetime.fromtimestamp(fill.ts, timezone.utc),
+            ))
+        if fills:
+            touch(taker.id, taker.filled, taker.qty)
+
+    if not trades and not new_orders:
+        return
+
+    created = {str(order.id) for order in new_orders}
+    orders = [
+        (order_id, order_filled, order_status(order_filled, qty))
+        for order_id, (order_filled, qty) in filled.items() if order_id not in created
+    ]
+    async with in_transaction("default") as conn:
+        if new_orders:
+            await Order.bulk_create(list(new_orders))
+        if trades:
+            await Trade.bulk_create(trades)
+        if balances:
+            await credit_many(balances, conn, existing_only=True)
+        if orders:
+            await _advance_filled(conn, orders)
+
+
+_OPEN = ", ".join(f"'{status}'" for status in OPEN_STATUSES)
+
+
+async def _advance_filled(conn, orders: List[Tuple[str, int, str]]):
+    """Write (order_id, filled, status) with one UPDATE that only moves filled forward.
+
+    Writes of the same order from concurrent requests may commit in any
+    order, so a row already at that filled or beyond is left alone. An
+    open remainder may have been cancelled meanwhile: CANCELLED is
+    overwritten only by a full fill, the cancel writes its own filled.
+    """
+    postgres = conn.capabilities.dialect == "postgres"
+    values, params = [], []
+    for row in orders:
+        if postgres:
+            # Без целевой колонки (VALUES в WITH) postgres не выводит типы параметров
+            placeholders = [f"${len(params) + i + 1}{cast}" for i, cast in enumerate(("::uuid", "::int", "::varchar"))]
+        else:
+            placeholders = ["?"] * 3
+        values.append("(" + ", ".join(placeholders) + ")")
+        params.extend(row)
+    await conn.execute_query(
+        f"WITH v (id, filled, status) AS (VALUES {', '.join(values)}) "
+        "UPDATE orders SET filled = v.filled, status = v.status FROM v "
+        "WHERE orders.id = v.id AND orders.filled < v.filled "
+        f"AND (orders.status IN ({_OPEN}) OR v.status = '{FILLED}')",
+        params
+    )
+
+
+async def open_orders(user_id, order_id=None, ticker=None) -> List[Tuple[str, str, str, int, float]]:
+    """(order_id, ticker, direction, qty, price) of open orders of a user: one
+    order, or all of them (of one ticker). The caller takes them off the
+    books first and then marks those the books had with mark_cancelled."""
+    query = Order.filter(user_id=user_id, status__in=OPEN_STATUSES)
+    if order_id is not None:
+        query = query.filter(id=order_id)
+    if ticker is not None:
+        query = query.filter(ticker=ticker)
+    rows = await query.values_list("id", "ticker", "direction", "qty", "price")
+    return [(str(order_id), ticker, direction, qty, price) for order_id, ticker, direction, qty, price in rows]
+
+
+async def mark_cancelled(cancelled: Sequence[Tuple[str, int]]):
+    """Write CANCELLED and the final filled of (order_id, filled) taken off the
+    books, with one UPDATE of the rows still open"""
+    if cancelled:
+        await Order.filter(status__in=OPEN_STATUSES).bulk_update(
+            [Order(id=order_id, filled=filled, status=CANCELLED) for order_id, filled in cancelled],
+            fields=["filled", "status"]
+        )
@@ -0,0 +1,221 @@
+"""Prometheus metrics without external dependencies.
+
+MetricsMiddleware records a latency histogram per (method, route, status)
+and in-flight gauges per method, where route is the path template
+("/api/v1/order/{order_id}") FastAPI stores in the scope after routing,
+so label cardinality stays bounded and no extra matching is done.
+instrument_db() wraps the execute_* methods of Tortoise's DB clients to
+time every query and attribute it to the route being served.
+monitor_event_loop() samples how late the loop wakes up. render() returns
+everything in the Prometheus text exposition format.
+"""
+import asyncio
+import functools
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Dict, Optional, Sequence, Tuple
+
+from app.services.ratelimit import rate_limiter
+from app.services.readiness import startup
+
+# scope текущего запроса - по нему относим запросы к базе к маршруту;
+# вне запросов (старт, фоновые задачи) - None
+_scope: ContextVar[Optional[dict]] = ContextVar("metrics_scope", default=None)
+# Уже внутри замера: execute_query_dict может звать execute_query и т.п.
+_in_query: ContextVar[bool] = ContextVar("metrics_in_query", default=False)
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DB_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = []
+    for name, value in zip(names, values):
+        escaped = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        parts.append(f'{name}="{escaped}"')
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: Sequence[str], buckets: Sequence[float]):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # labels -> [count per bucket (+Inf last), sum]
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *labels: str):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labels, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, labels)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.labels, labels)} {cumulative}")
+        return lines
+
+
+class Gauge:
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def set(self, value: float, *labels: str):
+        self._values[labels] = value
+
+    def inc(self, amount: float, *labels: str):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        for labels, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_labels(self.labels, labels)} {value}")
+        return lines
+
+
+http_latency = Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route and status.",
+    ("method", "route", "status"), LATENCY_BUCKETS
+)
+http_in_flight = Gauge("http_requests_in_flight", "Requests currently being served.", ("method",))
+db_latency = Histogram(
+    "db_query_duration_seconds", "Database query latency by the route that issued it.",
+    ("method", "route", "operation"), DB_BUCKETS
+)
+loop_lag = Histogram("event_loop_lag_seconds", "How late the event loop wakes up a sleeping task.", (), LAG_BUCKETS)
+loop_lag_last = Gauge("event_loop_lag_last_seconds", "Most recent event loop lag sample.")
+
+
+def render() -> str:
+    lines = []
+    for metric in (http_latency, http_in_flight, db_latency, loop_lag, loop_lag_last):
+        lines.extend(metric.render())
+    lines += ["# HELP rate_limit_rejected_total Requests rejected with 429.", "# TYPE rate_limit_rejected_total counter",
+              f"rate_limit_rejected_total {rate_limiter.rejected}"]
+    lines += ["# HELP load_shed_total Requests rejected with 503 over MAX_CONCURRENT_REQUESTS.", "# TYPE load_shed_total counter",
+              f"load_shed_total {rate_limiter.shed}"]
+    lines += ["# HELP app_ready 1 once startup warm-up is done.", "# TYPE app_ready gauge", f"app_ready {int(startup.ready)}"]
+    lines += ["# HELP app_startup_phase_seconds Duration of each startup phase.", "# TYPE app_startup_phase_seconds gauge"]
+    lines += [f'app_startup_phase_seconds{{phase="{name}"}} {seconds}' for name, seconds in startup.phases.items()]
+    return "\n".join(lines) + "\n"
+
+
+def _route_of(scope) -> str:
+    """Path template of the route serving the request, once routing is done"""
+    route = scope.get("route")
+    return route.path if route is not None else "unmatched"
+
+
+class MetricsMiddleware:
+    """ASGI middleware: latency histogram per route and in-flight gauge"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        token = _scope.set(scope)
+        http_in_flight.inc(1, method)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            http_latency.observe(time.perf_counter() - started, method, _route_of(scope), str(status_code))
+            http_in_flight.inc(-1, method)
+            _scope.reset(token)
+
+
+_DB_METHODS = ("execute_query", "execute_query_dict", "execute_insert", "execute_many", "execute_script")
+
+
+def _timed(method, operation: str):
+    @functools.wraps(method)
+    async def wrapper(*args, **kwargs):
+        if _in_query.get():
+            return await method(*args, **kwargs)
+        token = _in_query.set(True)
+        started = time.perf_counter()
+        try:
+            return await method(*args, **kwargs)
+        finally:
+            scope = _scope.get()
+            if scope is None:
+                db_latency.observe(time.perf_counter() - started, "", "background", operation)
+            else:
+                db_latency.observe(time.perf_counter() - started, scope["method"], _route_of(scope), operation)
+            _in_query.reset(token)
+    wrapper._metrics_timed = True
+    return wrapper
+
+
+def instrument_db():
+    """Time queries of every loaded Tortoise backend (call after Tortoise.init)"""
+    from tortoise.backends.base.client import BaseDBAsyncClient
+
+    pending = [BaseDBAsyncClient]
+    while pending:
+        cls = pending.pop()
+        pending.extend(cls.__subclasses__())
+        for name in _DB_METHODS:
+            method = cls.__dict__.get(name)
+            if method is not None and not getattr(method, "_metrics_timed", False):
+                setattr(cls, name, _timed(method, name[len("execute_"):]))
+
+
+async def monitor_event_loop(interval: float = 0.5):
+    """Background task: sleep `interval` and record how late the wake-up was"""
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - expected)
+        loop_lag.observe(lag)
+        loop_lag_last.set(lag)
+
+
+_lag_task: Optional[asyncio.Task] = None
+
+
+def start_loop_monitor():
+    global _lag_task
+    if _lag_task is None:
+        _lag_task = asyncio.create_task(monitor_event_loop())
+
+
+async def stop_loop_monitor():
+    global _lag_task
+    if _lag_task is not None:
+        _lag_task.cancel()
+        try:
+            await _lag_task
+        except asyncio.CancelledError:
+            pass
+        _lag_task = None
@@ -0,0 +1,60 @@
+import uuid
+from typing import Dict, Optional, Tuple
+
+from app.services.matching import engine
+from app.services.serialization import dumps
+
+
+class OrderbookCache:
+    """Encoded GET /public/orderbook responses per (ticker, limit).
+
+    An entry is valid while the book's seq is unchanged, so repeated polls
+    between book changes cost a dict lookup and no serialization.
+    """
+
+    def __init__(self):
+        self._entries: Dict[Tuple[str, int], Tuple[int, bytes, str]] = {}
+        self._boot = uuid.uuid4().hex[:8]
+        self._generations: Dict[str, int] = {}  # сколько раз seq книги начинался заново
+
+    def reset(self):
+        """Books are loaded anew and their seq starts over: forget every entry and change the ETags"""
+        self._entries.clear()
+        self._generations.clear()
+        self._boot = uuid.uuid4().hex[:8]
+
+    def get(self, ticker: str, limit: int) -> Tuple[bytes, str]:
+        """(body, etag) for the current state of the book"""
+        book = engine.books.get(ticker)
+        seq = book.seq if book else 0
+        entry = self._entries.get((ticker, limit))
+        if entry is not None and entry[0] == seq:
+            return entry[1], entry[2]
+
+        bids, asks = engine.depth(ticker, limit)
+        # Та же форма, что у OrderbookResponse, без промежуточных моделей
+        body = dumps({
+            "bid_levels": [{"price": float(price), "qty": qty} for price, qty in bids],
+            "ask_levels": [{"price": float(price), "qty": qty} for price, qty in asks],
+        })
+        etag = f'"{self._boot}-{self._generations.get(ticker, 0)}-{seq}-{limit}"'
+        self._entries[(ticker, limit)] = (seq, body, etag)
+        return body, etag
+
+    def invalidate(self, ticker: str):
+        """Forget a ticker, e.g. when its book is dropped and seq restarts; its ETags change"""
+        for key in [key for key in self._entries if key[0] == ticker]:
+            del self._entries[key]
+        self._generations[ticker] = self._generations.get(ticker, 0) + 1
+
+    @staticmethod
+    def not_modified(if_none_match: Optional[str], etag: str) -> bool:
+        """If-None-Match matches `etag`: `*` or a list of tags, compared weakly (W/ ignored)"""
+        if not if_none_match:
+            return False
+        if if_none_match.strip() == "*":
+            return True
+        return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+
+orderbook_cache = OrderbookCache()
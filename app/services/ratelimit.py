@@ -0,0 +1,180 @@
+"""In-process rate limiting and load shedding.
+
+RateLimitMiddleware runs before routing, dependencies and any DB work:
+
+* a token bucket per (API key, route class) with rate/burst taken from
+  RATE_LIMITS for the key's role. The role comes from the auth cache, and
+  only a key found there gets a bucket of its own (per user). Keys not
+  verified yet share the client address bucket with USER limits - a fresh
+  random key per request must not mean a fresh bucket - and requests
+  without a key are limited per client address as ANON. Over the limit
+  -> 429 with Retry-After.
+* a global cap on requests in flight (MAX_CONCURRENT_REQUESTS). Past it
+  new requests get 503 immediately instead of queueing for a DB
+  connection behind everyone else.
+"""
+import json
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from app.core.config import settings
+from app.services.auth import auth_cache
+
+ANON = "ANON"
+
+# Классы маршрутов: лимит общий на все эндпоинты класса
+ORDER = "order"
+READ = "read"
+MARKET_DATA = "market_data"
+AUTH = "auth"
+ADMIN = "admin"
+
+
+def parse_limits(spec: str) -> Dict[Tuple[str, str], Tuple[float, float]]:
+    """"USER.order=50/100,ADMIN.admin=0" -> {(role, class): (rate per sec, burst)}; 0 - без лимита"""
+    limits = {}
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        key, value = item.split("=", 1)
+        role, route_class = key.strip().split(".", 1)
+        rate, _, burst = value.strip().partition("/")
+        rate = float(rate)
+        if rate > 0:
+            limits[(role.upper(), route_class)] = (rate, float(burst) if burst else rate)
+    return limits
+
+
+def route_class(method: str, path: str) -> Optional[str]:
+    """Which limit applies to the request; None - not limited (health, metrics, docs)"""
+    prefix = settings.API_V1_STR
+    if not path.startswith(prefix):
+        return None
+    path = path[len(prefix):]
+    if path.startswith("/order"):
+        return READ if method == "GET" else ORDER
+    if path == "/balance":
+        return READ
+    if path in ("/public/register", "/auth/register"):
+        return AUTH
+    if path.startswith("/public/"):
+        return MARKET_DATA
+    if path.startswith("/admin/"):
+        return ADMIN
+    return None
+
+
+class TokenBucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, burst: float, now: float):
+        self.tokens = burst
+        self.updated = now
+
+
+class RateLimiter:
+    """Token buckets per (key, route class), LRU-bounded to `maxsize` keys"""
+
+    def __init__(self, limits: Dict[Tuple[str, str], Tuple[float, float]], maxsize: int = 100000):
+        self.limits = limits
+        self.maxsize = maxsize
+        self.rejected = 0
+        self.shed = 0  # 503 от RateLimitMiddleware
+        self._buckets: "OrderedDict[Tuple[str, str], TokenBucket]" = OrderedDict()
+
+    def acquire(self, key: str, role: str, route_class: str) -> float:
+        """Take one token; 0 if allowed, else seconds until a token is available"""
+        limit = self.limits.get((role, route_class))
+        if limit is None:
+            return 0.0
+        rate, burst = limit
+        now = time.monotonic()
+
+        bucket = self._buckets.get((key, route_class))
+        if bucket is None:
+            bucket = self._buckets[(key, route_class)] = TokenBucket(burst, now)
+            if len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end((key, route_class))
+            bucket.tokens = min(burst, bucket.tokens + (now - bucket.updated) * rate)
+            bucket.updated = now
+
+        if bucket.tokens >= 1:
+            bucket.tokens -= 1
+            return 0.0
+        self.rejected += 1
+        return (1 - bucket.tokens) / rate
+
+
+rate_limiter = RateLimiter(parse_limits(settings.RATE_LIMITS))
+
+
+def _reject(status: int, detail: str, retry_after: float):
+    body = json.dumps({"detail": detail}).encode()
+    headers = [
+        (b"content-type", b"application/json"),
+        (b"content-length", str(len(body)).encode()),
+        (b"retry-after", str(max(1, int(retry_after + 0.999))).encode()),
+    ]
+    return (
+        {"type": "http.response.start", "status": status, "headers": headers},
+        {"type": "http.response.body", "body": body},
+    )
+
+
+class RateLimitMiddleware:
+    """ASGI middleware applying rate_limiter and the in-flight cap"""
+
+    def __init__(self, app, max_in_flight: Optional[int] = None):
+        self.app = app
+        self.max_in_flight = settings.MAX_CONCURRENT_REQUESTS if max_in_flight is None else max_in_flight
+        self.in_flight = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        route = route_class(scope["method"], scope["path"])
+        if route is None:
+            await self.app(scope, receive, send)
+            return
+
+        if settings.RATE_LIMIT_ENABLED:
+            key, role = self._identify(scope)
+            retry_after = rate_limiter.acquire(key, role, route)
+            if retry_after:
+                for message in _reject(429, "Rate limit exceeded", retry_after):
+                    await send(message)
+                return
+
+        if self.max_in_flight and self.in_flight >= self.max_in_flight:
+            rate_limiter.shed += 1
+            for message in _reject(503, "Server is overloaded, retry later", 1):
+                await send(message)
+            return
+
+        self.in_flight += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.in_flight -= 1
+
+    @staticmethod
+    def _identify(scope) -> Tuple[str, str]:
+        """(bucket key, role) without touching the database"""
+        client = scope.get("client")
+        address = f"ip:{client[0] if client else ''}"
+        for name, value in scope["headers"]:
+            if name == b"authorization":
+                token = value.decode("latin-1")
+                if token.startswith("TOKEN "):
+                    token = token[6:]
+                user = auth_cache.peek(token)
+                if user is None:
+                    # Ключ ещё не проверен (или неверный) - лимит по адресу
+                    return address, "USER"
+                return f"user:{user.id}", user.role
+        return address, ANON
@@ -0,0 +1,37 @@
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+# Отсчёт от импорта приложения - ближайшее к старту процесса, что есть у нас
+_IMPORTED = time.monotonic()
+
+
+class Startup:
+    """Readiness flag and how long each startup phase took"""
+
+    def __init__(self):
+        self.ready = False
+        self.phases: Dict[str, float] = {}
+        self.ready_after: Optional[float] = None
+
+    @contextmanager
+    def phase(self, name: str):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.phases[name] = time.monotonic() - started
+
+    def mark_ready(self):
+        self.ready = True
+        self.ready_after = time.monotonic() - _IMPORTED
+
+    def report(self) -> dict:
+        return {
+            "ready": self.ready,
+            "ready_after_ms": round(self.ready_after * 1000, 1) if self.ready_after is not None else None,
+            "phases_ms": {name: round(seconds * 1000, 1) for name, seconds in self.phases.items()},
+        }
+
+
+startup = Startup()
@@ -0,0 +1,49 @@
+"""Fast JSON encoding for hot list endpoints.
+
+Endpoints that return many rows encode plain dicts built straight from ORM
+rows or engine state and return the bytes in a Response. FastAPI does not
+re-validate a returned Response, so each row is converted once instead of
+model construction + response_model validation + serialization. The
+endpoints keep their response_model, so the OpenAPI schema is unchanged.
+
+orjson is used when installed; otherwise the stdlib encoder produces the
+same output (compact separators, UTC datetimes with a "Z" suffix, as
+Pydantic writes them).
+"""
+import json
+from datetime import datetime
+from uuid import UUID
+
+from fastapi import Response
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - зависит от окружения
+    orjson = None
+
+
+def _default(value):
+    if isinstance(value, datetime):
+        text = value.isoformat()
+        return text[:-6] + "Z" if text.endswith("+00:00") else text
+    if isinstance(value, UUID):
+        return str(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+if orjson is not None:
+    def dumps(value) -> bytes:
+        """Encode to compact JSON bytes"""
+        # default: UUID-подклассы (asyncpg) orjson сам не кодирует
+        return orjson.dumps(value, default=_default, option=orjson.OPT_UTC_Z)
+else:
+    _encoder = json.JSONEncoder(separators=(",", ":"), ensure_ascii=False, default=_default)
+
+    def dumps(value) -> bytes:
+        """Encode to compact JSON bytes"""
+        return _encoder.encode(value).encode()
+
+
+def json_response(value, **kwargs) -> Response:
+    """Response with pre-encoded JSON, bypassing response_model serialization"""
+    return Response(content=dumps(value), media_type="application/json", **kwargs)
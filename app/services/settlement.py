@@ -0,0 +1,412 @@
+"""Journaled order entry with write-behind to the database.
+
+With JOURNAL_DIR set, order entry does no database writes: place_orders()
+appends the order and its trades to the journal, matches in memory and
+waits for the group commit. Once a journal batch is durable its events
+go to `settler`, which writes new orders, trades, filled/status updates,
+balance changes and cancellations in one transaction per batch together
+with the seq of the last event (journal_checkpoint), then lets the journal drop
+segments the database has caught up with.
+
+On startup books are restored from the database as of the checkpoint,
+the journal tail after it is replayed onto them and queued for
+settlement. Endpoints that read a user's orders depend on `settled`, so
+they see every acknowledged order.
+
+Matching runs before the group commit, so when a journal write fails the
+books, the ledger and the candles are ahead of the disk: they are rolled
+back to the durable state (the database once the settler has caught up)
+and the process stops taking orders.
+"""
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Sequence, Tuple
+from uuid import UUID, uuid4
+
+from tortoise.transactions import in_transaction
+
+from app.core.config import settings
+from app.models.journal import JournalCheckpoint
+from app.models.order import Order, NEW, CANCELLED
+from app.models.trade import Trade
+from app.services.balance import credit_many
+from app.services.candles import candles
+from app.services.instruments import instruments
+from app.services.journal import CancelEvent, Event, OrderEvent, TradeEvent, journal, read_journal
+from app.services.ledger import balance_rows, fill_deltas, ledger
+from app.services.matching import BUY, GTC, BookOrder, engine, order_status, restore_books
+from app.services.sharding import matcher
+
+logger = logging.getLogger(__name__)
+
+
+class Settler:
+    """Writes durable journal events to the database in batches"""
+
+    def __init__(self):
+        self.interval = 0.05
+        self.checkpoint = 0
+        self._events: List[Event] = []
+        self._pending: Optional[asyncio.Future] = None  # запись, которая заберёт _events
+        self._writing: Optional[asyncio.Future] = None  # запись, которая идёт сейчас
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self, interval: float, checkpoint: int):
+        self.interval = interval
+        self.checkpoint = checkpoint
+        # Очередь прошлого запуска, брошенная при падении, пришла бы ещё раз с хвостом журнала
+        self._events = []
+        self._pending = self._writing = None
+        self._wake = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    def submit(self, events: List[Event]):
+        """Journal listener: queue a durable batch, in seq order"""
+        self._events.extend(events)
+
+    async def sync(self):
+        """Write everything queued so far now and wait for it"""
+        if self._events:
+            if self._pending is None:
+                self._pending = asyncio.get_running_loop().create_future()
+            pending = self._pending
+            self._wake.set()
+            await asyncio.shield(pending)
+        elif self._writing is not None:
+            await asyncio.shield(self._writing)
+
+    async def stop(self):
+        if self._task is None:
+            return
+        await self.sync()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            if not self._events:
+                continue
+
+            events, self._events = self._events, []
+            done, self._pending = self._pending or loop.create_future(), None
+            self._writing = done
+            try:
+                await self.write(events)
+            except Exception:
+                logger.exception("Settlement failed, retrying", extra={"fields": {"events": len(events)}})
+                self._events[:0] = events
+                if self._pending is None:
+                    self._pending = done
+                else:
+                    self._pending.add_done_callback(lambda _, done=done: done.done() or done.set_result(None))
+                await asyncio.sleep(self.interval)
+                continue
+            finally:
+                self._writing = None
+            done.set_result(None)
+
+    async def write(self, events: List[Event]):
+        """Apply a batch of events to the database in one transaction"""
+        new_orders: Dict[str, Order] = {}
+        time_in_force: Dict[str, str] = {}
+        filled: Dict[str, Tuple[int, int]] = {}  # order_id -> (filled, qty)
+        trades = []
+        balances = []
+        cancelled = []
+
+        def touch(order_id, order_filled, qty):
+            if order_filled > filled.get(order_id, (-1, 0))[0]:
+                filled[order_id] = (order_filled, qty)
+
+        for event in events:
+            if isinstance(event, OrderEvent):
+                new_orders[event.order_id] = Order(
+                    id=UUID(event.order_id),
+                    user_id=UUID(event.user_id),
+                    status=NEW,
+                    ticker=event.ticker,
+                    direction=event.direction,
+                    qty=event.qty,
+                    price=event.price,
+                    filled=0,
+                    created_at=datetime.fromtimestamp(event.ts, timezone.utc),
+                )
+                time_in_force[event.order_id] = event.time_in_force
+            elif isinstance(event, TradeEvent):
+                touch(event.maker_order_id, event.maker_filled, event.maker_qty)
+                touch(event.taker_order_id, event.taker_filled, event.taker_qty)
+                if event.taker_direction == BUY:
+                    buy, buyer, sell, seller = event.taker_order_id, event.taker_user_id, event.maker_order_id, event.maker_user_id
+                else:
+                    buy, buyer, sell, seller = event.maker_order_id, event.maker_user_id, event.taker_order_id, event.taker_user_id
+                balances.extend(_balance_deltas(event))
+                instrument = instruments.get(event.ticker)
+                if instrument is None:
+                    continue  # инструмент удалён, пока сделка ждала записи
+                trades.append(Trade(
+                    instrument_id=instrument.id,
+                    ticker=event.ticker,
+                    price=event.price,
+                    qty=event.qty,
+                    buy_order_id=buy,
+                    sell_order_id=sell,
+                    buyer_id=buyer,
+                    seller_id=seller,
+                    executed_at=datetime.fromtimestamp(event.ts, timezone.utc),
+                ))
+            else:
+                cancelled.append(event.order_id)
+
+        for order_id, order in new_orders.items():
+            # Исполнения из этого же батча - сразу в INSERT
+            order.filled = filled.pop(order_id, (0, 0))[0]
+            order.status = order_status(order.filled, order.qty, time_in_force[order_id])
+        updates = [
+            Order(id=UUID(order_id), filled=order_filled, status=order_status(order_filled, qty))
+            for order_id, (order_filled, qty) in filled.items()
+        ]
+
+        async with in_transaction("default") as conn:
+            if new_orders:
+                await Order.bulk_create(list(new_orders.values()))
+            if trades:
+                await Trade.bulk_create(trades)
+            if updates:
+                await Order.bulk_update(updates, fields=["filled", "status"])
+            if balances:
+                await credit_many(balance_rows(balances), conn, existing_only=True)
+            if cancelled:
+                # После updates: filled отменённого остатка уже записан
+                await Order.filter(id__in=cancelled).update(status=CANCELLED)
+            await JournalCheckpoint.filter(id=1).update(seq=events[-1].seq)
+        self.checkpoint = events[-1].seq
+        journal.release(self.checkpoint)
+
+
+settler = Settler()
+
+
+async def settled():
+    """Dependency: the database reflects every acknowledged order event"""
+    if journal.active:
+        await settler.sync()
+
+
+def _balance_deltas(event: TradeEvent):
+    if event.taker_direction == BUY:
+        return fill_deltas(event.ticker, event.price, event.qty, event.taker_user_id, event.maker_user_id)
+    return fill_deltas(event.ticker, event.price, event.qty, event.maker_user_id, event.taker_user_id)
+
+
+def _trade_events(ticker: str, taker: BookOrder, fills) -> List[TradeEvent]:
+    events = []
+    taker_filled = taker.filled - sum(fill.qty for fill in fills)
+    for fill in fills:
+        taker_filled += fill.qty
+        events.append(TradeEvent(
+            ticker=ticker,
+            price=fill.price,
+            qty=fill.qty,
+            maker_order_id=fill.maker_order_id,
+            maker_user_id=fill.maker_user_id,
+            maker_qty=fill.maker_qty,
+            maker_filled=fill.maker_filled,
+            taker_order_id=fill.taker_order_id,
+            taker_user_id=fill.taker_user_id,
+            taker_direction=fill.taker_direction,
+            taker_qty=taker.qty,
+            taker_filled=taker_filled,
+            ts=fill.ts,
+        ))
+    return events
+
+
+_rollback: Optional[asyncio.Future] = None
+
+
+async def _commit():
+    """journal.commit(); if the write failed, roll the in-memory state back first"""
+    global _rollback
+    try:
+        await journal.commit()
+    except Exception:
+        # Все, кто ждал упавший батч, ждут одного отката
+        if _rollback is None:
+            _rollback = asyncio.ensure_future(_roll_back())
+        await asyncio.shield(_rollback)
+        raise
+
+
+async def _roll_back():
+    """Books, ledger and candles from the database once it has every durable event"""
+    logger.critical("Rolling order books back to the journaled state")
+    await settler.sync()
+    tickers = set(engine.books)
+    engine.clear()
+    await restore_books()
+    await ledger.load(from_books=True)
+    await candles.load()
+    # Подписчики и кэш стакана видели сделки, которых нет на диске; seq книг начался заново
+    for ticker in tickers | set(engine.books):
+        for listener in matcher.resync_listeners:
+            listener(ticker)
+
+
+def _check_writable(takers: Sequence[Optional[BookOrder]] = ()):
+    """Fail before touching the books once the journal is broken, giving back the reservations"""
+    if journal.error is None:
+        return
+    for taker in takers:
+        if taker is not None:
+            ledger.release(taker.id)
+    raise RuntimeError("Journal is not writable") from journal.error
+
+
+async def place_orders(user_id, orders: Sequence) -> List[Optional[str]]:
+    """Journal and match orders (anything with ticker/direction/qty/price/time_in_force).
+
+    Returns their ids, None for orders the user's available balance does
+    not cover. Funds for all of them are reserved first; appending and
+    matching then happen without yielding to the event loop, so the
+    journal has events in the order the engine saw them. A market order
+    with nothing to trade against is journaled without matching, so it
+    is settled as cancelled.
+    """
+    _check_writable()
+    ts = time.time()
+    takers = []
+    unmatched = set()
+    for order in orders:
+        taker = BookOrder(
+            id=str(uuid4()), user_id=str(user_id), direction=order.direction, qty=order.qty, price=order.price,
+            time_in_force=order.time_in_force
+        )
+        if order.price is None and not engine.has_liquidity(order.ticker, order.direction):
+            unmatched.add(taker.id)
+            takers.append(taker)
+            continue
+        takers.append(taker if await ledger.reserve(order.ticker, taker) else None)
+    # Журнал мог упасть, пока шло резервирование
+    _check_writable(takers)
+
+    for order, taker in zip(orders, takers):
+        if taker is None:
+            continue
+        journal.append(OrderEvent(
+            taker.id, taker.user_id, order.ticker, order.direction, order.qty, order.price, ts, order.time_in_force
+        ))
+        if taker.id in unmatched:
+            continue
+        for event in _trade_events(order.ticker, taker, engine.submit(order.ticker, taker)):
+            journal.append(event)
+        ledger.matched(taker)
+    await _commit()
+    return [taker.id if taker else None for taker in takers]
+
+
+async def cancel_order(user_id, order_id: str) -> bool:
+    """Journal a cancel and take the user's order off the book; False if it is not resting"""
+    found = engine.find(order_id)
+    if found is None or found[1].user_id != str(user_id):
+        return False
+    ticker, _ = found
+    _check_writable()
+    journal.append(CancelEvent(order_id, ticker, time.time()))
+    engine.cancel(ticker, order_id)
+    ledger.release(order_id)
+    await _commit()
+    return True
+
+
+async def cancel_user_orders(user_id, ticker: Optional[str] = None) -> int:
+    """Journal cancels of every resting order of the user (of one ticker) and take
+    them off the books, one book update per ticker; returns how many"""
+    _check_writable()
+    user_id = str(user_id)
+    books = [engine.books.get(ticker)] if ticker is not None else list(engine.books.values())
+    ts = time.time()
+    cancelled = 0
+    for book in books:
+        if book is None:
+            continue
+        order_ids = [order.id for order in book.orders.values() if order.user_id == user_id]
+        for order_id in order_ids:
+            journal.append(CancelEvent(order_id, book.ticker, ts))
+        for order in engine.cancel_many(book.ticker, order_ids):
+            ledger.release(order.id)
+        cancelled += len(order_ids)
+    if cancelled:
+        await _commit()
+    return cancelled
+
+
+def replay(event: Event):
+    """Apply a journaled event to the books (after restore_books)"""
+    if isinstance(event, OrderEvent):
+        if event.price is not None and event.time_in_force == GTC:
+            # Без матчинга: сделки ордера идут следующими событиями
+            engine.book(event.ticker).add(BookOrder(
+                id=event.order_id, user_id=event.user_id, direction=event.direction,
+                qty=event.qty, price=event.price
+            ))
+    elif isinstance(event, TradeEvent):
+        book = engine.book(event.ticker)
+        book.set_filled(event.maker_order_id, event.maker_filled)
+        book.set_filled(event.taker_order_id, event.taker_filled)
+    else:
+        engine.cancel(event.ticker, event.order_id)
+
+
+async def start_journal() -> int:
+    """Replay the journal tail onto the restored books, load the ledger and candles and start journaling; returns events replayed"""
+    global _rollback
+    if settings.MATCHING_SHARDS:
+        raise RuntimeError("JOURNAL_DIR requires in-process matching (MATCHING_SHARDS=0)")
+    _rollback = None
+    checkpoint, _ = await JournalCheckpoint.get_or_create(id=1, defaults={"seq": 0})
+
+    events = read_journal(settings.JOURNAL_DIR) if os.path.isdir(settings.JOURNAL_DIR) else []
+    tail = [event for event in events if event.seq > checkpoint.seq]
+    for event in tail:
+        replay(event)
+    # Балансы в базе - на момент checkpoint, сделки хвоста поверх них
+    await ledger.load(from_books=True)
+    for event in tail:
+        if isinstance(event, TradeEvent):
+            ledger.apply(_balance_deltas(event))
+    await candles.load(
+        (event.ticker, event.price, event.qty, event.ts) for event in tail if isinstance(event, TradeEvent)
+    )
+
+    last_seq = max(checkpoint.seq, events[-1].seq if events else 0)
+    journal.open(
+        settings.JOURNAL_DIR, last_seq + 1, settings.JOURNAL_COMMIT_WINDOW_MS / 1000,
+        settings.JOURNAL_BATCH_MAX, settings.JOURNAL_SEGMENT_MB * 1024 * 1024
+    )
+    journal.listeners.append(settler.submit)
+    settler.start(settings.JOURNAL_SETTLE_INTERVAL_MS / 1000, checkpoint.seq)
+    # В базу - в фоне; чтения ордеров дождутся через settled
+    settler.submit(tail)
+    return len(tail)
+
+
+async def stop_journal():
+    if not journal.active:
+        return
+    await journal.close()
+    await settler.stop()
+    journal.listeners.remove(settler.submit)
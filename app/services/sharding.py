@@ -0,0 +1,646 @@
+"""Order matching sharded across worker processes.
+
+With MATCHING_SHARDS = N > 0 every ticker belongs to one of N shard
+processes (crc32(ticker) % N). A shard runs its own MatchingEngine over
+the books it owns and serves commands on a Unix socket; API processes
+send submit/cancel to the owner and await the reply, so matching of
+different instruments runs on different cores.
+
+Every BookUpdate a shard produces is pushed to all connected API
+processes, which apply it to an L2 mirror kept in the local `engine.books`.
+Depth reads, the orderbook cache and market data feeds keep reading the
+local engine and never leave the process. The update is pushed before the
+reply, so the caller sees its own order in the book once submit returns.
+
+Frames are JSON (orjson), never pickle: a frame is data, not code. The
+socket directory must belong to this user with mode 0700 - it is created
+so, and an existing one owned by someone else or open to others is
+refused, so nobody else can plant a socket there.
+
+A lost shard is reconnected with backoff (a shard this process spawned is
+started again first); after it comes back its books are taken from a new
+snapshot. While a shard is away its orders fail with ConnectionError and
+/ready answers 503; past MATCHING_UNHEALTHY_AFTER_S /health does too, so
+the orchestrator can recycle the process.
+
+With MATCHING_SHARDS = 0 (the default) `matcher` calls the in-process
+engine directly. Shards can also run on their own (several uvicorn
+workers sharing them, MATCHING_SPAWN=0):
+
+    MATCHING_SHARDS=4 python -m app.services.sharding
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import stat
+import struct
+import time
+import zlib
+from bisect import bisect_left, insort
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Set, Tuple, Union
+
+import orjson
+from tortoise import Tortoise
+
+from app.core.config import settings
+from app.models.instrument import Instrument
+from app.services.matching import BUY, SELL, BookOrder, BookUpdate, Fill, engine, restore_books
+
+logger = logging.getLogger(__name__)
+
+_HEADER = struct.Struct("!I")
+
+# Переподключение к шарду: первая пауза и потолок, пауза удваивается
+RECONNECT_DELAY = 0.05
+RECONNECT_MAX_DELAY = 5.0
+
+
+def shard_of(ticker: str, count: int) -> int:
+    """Index of the shard owning `ticker`; stable across processes and restarts"""
+    return zlib.crc32(ticker.encode()) % count
+
+
+def socket_path(socket_dir: str, index: int) -> str:
+    return os.path.join(socket_dir, f"shard-{index}.sock")
+
+
+def _pack_fills(fills: List[Fill]) -> list:
+    return [tuple(getattr(fill, name) for name in Fill.__slots__) for fill in fills]
+
+
+def _unpack_fills(rows: list) -> List[Fill]:
+    return [Fill(*row) for row in rows]
+
+
+def _frame(message) -> bytes:
+    data = orjson.dumps(message)
+    return _HEADER.pack(len(data)) + data
+
+
+def _unframe(buffer: bytearray) -> list:
+    """Pop every complete frame off the front of `buffer`"""
+    messages = []
+    offset = 0
+    view = memoryview(buffer)
+    while len(buffer) - offset >= _HEADER.size:
+        (size,) = _HEADER.unpack_from(buffer, offset)
+        if len(buffer) - offset - _HEADER.size < size:
+            break
+        offset += _HEADER.size
+        messages.append(orjson.loads(view[offset:offset + size]))
+        offset += size
+    view.release()
+    del buffer[:offset]
+    return messages
+
+
+class _Connection(asyncio.Protocol):
+    """Length-prefixed JSON frames over a stream socket.
+
+    Everything sent while handling one chunk of input is written with a
+    single write, so pipelined commands cost a syscall per batch, not per
+    frame.
+    """
+
+    def __init__(self):
+        self.transport: Optional[asyncio.Transport] = None
+        self._incoming = bytearray()
+        self._outgoing: List[bytes] = []
+        self._flush_scheduled = False
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def data_received(self, data: bytes):
+        self._incoming += data
+        for message in _unframe(self._incoming):
+            self.received(message)
+        self.flush()
+
+    def received(self, message):
+        raise NotImplementedError
+
+    def send(self, frame: bytes):
+        self._outgoing.append(frame)
+
+    def send_soon(self, frame: bytes):
+        """Queue a frame and flush on the next loop iteration"""
+        self._outgoing.append(frame)
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            asyncio.get_running_loop().call_soon(self.flush)
+
+    def flush(self):
+        self._flush_scheduled = False
+        if self._outgoing and self.transport is not None and not self.transport.is_closing():
+            self.transport.write(b"".join(self._outgoing))
+        self._outgoing.clear()
+
+
+# --- shard process ---
+
+class Shard:
+    """Serves one subset of tickers: commands in, replies and book updates out.
+
+    Frames are a 4-byte length and a JSON array. Requests are
+    (request id, command, *args); replies are (request id, ok, result);
+    pushes to subscribed connections have request id 0.
+    """
+
+    def __init__(self, index: int, count: int):
+        self.index = index
+        self.count = count
+        self.subscribers: Set["_ShardConnection"] = set()
+        engine.listeners.append(self._broadcast)
+
+    def _broadcast(self, update: BookUpdate):
+        if self.subscribers:
+            self._push("update", (update.ticker, update.seq, update.bids, update.asks, _pack_fills(update.fills)))
+
+    def _push(self, kind: str, payload):
+        if self.subscribers:
+            frame = _frame((0, kind, payload))
+            for connection in self.subscribers:
+                connection.send_soon(frame)
+
+    def snapshot(self) -> list:
+        """Full L2 of every book plus the users with resting orders"""
+        books = []
+        for ticker, book in engine.books.items():
+            bids = [(price, volume) for price, volume in book.bids.volume.items()]
+            asks = [(price, volume) for price, volume in book.asks.volume.items()]
+            users = list({order.user_id for order in book.orders.values()})
+            books.append((ticker, book.seq, bids, asks, users))
+        return books
+
+    def execute(self, connection: "_ShardConnection", command: str, args: tuple):
+        if command == "submit":
+            ticker, order_id, user_id, direction, qty, price, time_in_force, sweep_limit = args
+            order = BookOrder(
+                id=order_id, user_id=user_id, direction=direction, qty=qty, price=price, time_in_force=time_in_force,
+                sweep_limit=sweep_limit
+            )
+            fills = engine.submit(ticker, order)
+            return order.filled, _pack_fills(fills)
+        if command == "cancel":
+            ticker, order_id = args
+            order = engine.cancel(ticker, order_id)
+            return order.filled if order is not None else None
+        if command == "cancel_many":
+            ticker, order_ids = args
+            return [(order.id, order.filled) for order in engine.cancel_many(ticker, order_ids)]
+        if command == "drop":
+            (ticker,) = args
+            engine.drop(ticker)
+            self._push("drop", ticker)
+            return None
+        if command == "subscribe":
+            # Снимок и подписка в одном шаге: первое обновление после
+            # снимка придёт следующим кадром
+            self.subscribers.add(connection)
+            return self.snapshot()
+        raise ValueError(f"Unknown command {command!r}")
+
+
+class _ShardConnection(_Connection):
+    def __init__(self, shard: Shard):
+        super().__init__()
+        self.shard = shard
+
+    def received(self, message):
+        request_id, command, *args = message
+        try:
+            reply = (request_id, True, self.shard.execute(self, command, tuple(args)))
+        except Exception as error:
+            logger.exception("Shard %s: %s failed", self.shard.index, command)
+            reply = (request_id, False, repr(error))
+        # Обновления книги, разосланные во время команды, уже в очереди - ответ после них
+        self.send(_frame(reply))
+
+    def connection_lost(self, exc):
+        self.shard.subscribers.discard(self)
+
+
+async def serve_shard(index: int, count: int, path: str, db_config: Optional[dict]):
+    """Restore the shard's books from the database and serve until cancelled"""
+    if db_config is not None:
+        await Tortoise.init(config=db_config)
+        try:
+            tickers = [t for t in await Instrument.all().values_list("ticker", flat=True) if shard_of(t, count) == index]
+            await restore_books(tickers)
+        finally:
+            await Tortoise.close_connections()
+
+    shard = Shard(index, count)
+    if os.path.exists(path):
+        os.unlink(path)
+    # Сокет появляется только после восстановления книг - по нему API и ждёт готовности
+    server = await asyncio.get_running_loop().create_unix_server(lambda: _ShardConnection(shard), path)
+    async with server:
+        await server.serve_forever()
+
+
+def run_shard(index: int, count: int, path: str, db_config: Optional[dict]):
+    """Process entry point"""
+    try:
+        asyncio.run(serve_shard(index, count, path, db_config))
+    except KeyboardInterrupt:
+        pass
+
+
+def shard_db_config(config: dict) -> Optional[dict]:
+    """Only the primary connection, without routers; None if the shard cannot see the data.
+
+    An in-memory SQLite database is private to its process, so shards
+    start with empty books.
+    """
+    default = config["connections"]["default"]
+    if isinstance(default, str) and default.startswith("sqlite") and ":memory:" in default:
+        return None
+    return {"connections": {"default": default}, "apps": config["apps"]}
+
+
+def spawn_shard(index: int, count: int, socket_dir: str, db_config: Optional[dict]) -> multiprocessing.Process:
+    # Сокет от прошлого запуска: не подключиться к старому шарду раньше нового
+    if os.path.exists(socket_path(socket_dir, index)):
+        os.unlink(socket_path(socket_dir, index))
+    # spawn, не fork: у родителя уже есть event loop и пулы соединений
+    process = multiprocessing.get_context("spawn").Process(
+        target=run_shard, args=(index, count, socket_path(socket_dir, index), db_config),
+        name=f"matching-shard-{index}", daemon=True,
+    )
+    process.start()
+    return process
+
+
+def secure_socket_dir(socket_dir: str):
+    """Create the socket directory private to this user; refuse an existing one
+    that belongs to another user or that others can enter"""
+    os.makedirs(socket_dir, mode=0o700, exist_ok=True)
+    info = os.lstat(socket_dir)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o077:
+        raise RuntimeError(
+            f"Matching socket directory {socket_dir} must be a directory owned by uid {os.getuid()} "
+            f"with mode 0700 (found uid {info.st_uid}, mode {stat.filemode(info.st_mode)})"
+        )
+
+
+def spawn_shards(count: int, socket_dir: str, db_config: Optional[dict]) -> List[multiprocessing.Process]:
+    secure_socket_dir(socket_dir)
+    return [spawn_shard(index, count, socket_dir, db_config) for index in range(count)]
+
+
+# --- API process ---
+
+class _MirrorSide:
+    """L2 levels of one side of a mirrored book.
+
+    Like `_Side` of the engine, prices are kept as sorted keys (price for
+    bids, -price for asks) with the best level last, so depth and sweeps
+    walk the best levels instead of sorting the whole side.
+    """
+
+    __slots__ = ("sign", "keys", "volume")
+
+    def __init__(self, direction: str, levels: Iterable[Tuple[float, int]] = ()):
+        self.sign = 1 if direction == BUY else -1
+        self.volume: Dict[float, int] = dict(levels)
+        self.keys: List[float] = sorted(self.sign * price for price in self.volume)
+
+    def set(self, price: float, qty: int):
+        """New total qty at `price`; 0 - the level is gone"""
+        if qty:
+            if price not in self.volume:
+                insort(self.keys, self.sign * price)
+            self.volume[price] = qty
+        elif self.volume.pop(price, None) is not None:
+            del self.keys[bisect_left(self.keys, self.sign * price)]
+
+    def top(self, limit: int) -> List[Tuple[float, int]]:
+        sign, volume = self.sign, self.volume
+        return [(sign * key, volume[sign * key]) for key in self.keys[:-limit - 1:-1]]
+
+    def sweep_price(self, qty: int) -> Optional[float]:
+        sign, volume = self.sign, self.volume
+        price = None
+        for key in reversed(self.keys):
+            price = sign * key
+            qty -= volume[price]
+            if qty <= 0:
+                break
+        return price
+
+
+class MirrorBook:
+    """L2 copy of a book owned by a shard, kept current by its updates.
+
+    Has the attributes readers of `engine.books` use: seq, depth() and
+    sweep_price().
+    """
+
+    __slots__ = ("ticker", "seq", "bids", "asks")
+
+    def __init__(self, ticker: str, seq: int = 0, bids: Iterable[Tuple[float, int]] = (),
+                 asks: Iterable[Tuple[float, int]] = ()):
+        self.ticker = ticker
+        self.seq = seq
+        self.bids = _MirrorSide(BUY, bids)
+        self.asks = _MirrorSide(SELL, asks)
+
+    def apply(self, update: BookUpdate):
+        for side, changes in ((self.bids, update.bids), (self.asks, update.asks)):
+            for price, qty in changes:
+                side.set(price, qty)
+        self.seq = update.seq
+
+    def depth(self, limit: int):
+        return self.bids.top(limit), self.asks.top(limit)
+
+    def sweep_price(self, direction: str, qty: int) -> Optional[float]:
+        return (self.asks if direction == BUY else self.bids).sweep_price(qty)
+
+
+class ShardClient(_Connection):
+    """One connection to a shard with any number of commands in flight.
+
+    The same object serves every reconnection; `on_lost` is called when a
+    connection ends.
+    """
+
+    def __init__(self, index: int, path: str, on_push: Callable, on_lost: Optional[Callable] = None):
+        super().__init__()
+        self.index = index
+        self.path = path
+        self.on_push = on_push
+        self.on_lost = on_lost
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._next_id = 0
+
+    @property
+    def connected(self) -> bool:
+        return self.transport is not None and not self.transport.is_closing()
+
+    def connection_made(self, transport):
+        super().connection_made(transport)
+        # Хвост кадра от прежнего соединения не относится к новому
+        self._incoming.clear()
+
+    async def open(self):
+        """One connection attempt"""
+        await asyncio.get_running_loop().create_unix_connection(lambda: self, self.path)
+
+    async def connect(self, timeout: float, process: Optional[multiprocessing.Process] = None):
+        """Wait until the shard listens; `process` - our own shard, fail at once if it died"""
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                await self.open()
+                return
+            except (FileNotFoundError, ConnectionRefusedError):
+                if process is not None and not process.is_alive():
+                    raise RuntimeError(f"Matching shard {self.index} exited with code {process.exitcode}")
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"Matching shard {self.index} is not listening on {self.path}")
+                await asyncio.sleep(0.05)
+
+    def call(self, command: str, *args) -> asyncio.Future:
+        """Queue a command; calls reach the shard in the order they were made"""
+        if not self.connected:
+            raise ConnectionError(f"Matching shard {self.index} is not connected")
+        self._next_id += 1
+        future = asyncio.get_running_loop().create_future()
+        self._pending[self._next_id] = future
+        self.send_soon(_frame((self._next_id, command, *args)))
+        return future
+
+    def received(self, message):
+        request_id, *payload = message
+        if request_id == 0:
+            self.on_push(*payload)
+            return
+        ok, result = payload
+        future = self._pending.pop(request_id)
+        if ok:
+            future.set_result(result)
+        else:
+            future.set_exception(RuntimeError(f"Matching shard {self.index}: {result}"))
+
+    def connection_lost(self, exc):
+        self.transport = None
+        self._outgoing.clear()
+        for future in self._pending.values():
+            future.set_exception(ConnectionError(f"Matching shard {self.index} disconnected"))
+        self._pending.clear()
+        if self.on_lost is not None:
+            self.on_lost(self)
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+
+
+class Matcher:
+    """Entry point for order commands: in-process engine or the owning shard"""
+
+    def __init__(self):
+        self.shards: List[ShardClient] = []
+        # Вызываются с тикером, чья копия книги заново взята из снимка (seq мог начаться заново)
+        self.resync_listeners: List[Callable[[str], None]] = []
+        self._processes: List[multiprocessing.Process] = []
+        self._resting_users: Set[str] = set()
+        self._spawn_args: Optional[tuple] = None
+        self._down: Dict[int, float] = {}  # шард -> с какого момента недоступен
+        self._reconnecting: Dict[int, asyncio.Task] = {}
+
+    async def start(self, count: int = 0, socket_dir: str = "", spawn: bool = True,
+                    db_config: Optional[dict] = None, timeout: float = 60.0):
+        """Load the books: from the database in-process, or from shards (spawned if `spawn`)"""
+        if not count:
+            await restore_books()
+            return
+        self._spawn_args = (count, socket_dir, db_config) if spawn else None
+        # И с чужими шардами: к сокету в чужом каталоге не подключаемся
+        secure_socket_dir(socket_dir)
+        if spawn:
+            self._processes = spawn_shards(count, socket_dir, db_config)
+        self.shards = [
+            ShardClient(index, socket_path(socket_dir, index), self.on_push, self._lost) for index in range(count)
+        ]
+        for shard in self.shards:
+            await shard.connect(timeout, self._processes[shard.index] if spawn else None)
+
+        engine.clear()
+        self._resting_users = set()
+        for shard in self.shards:
+            self._load_snapshot(shard.index, await shard.call("subscribe"))
+
+    async def stop(self):
+        shards, self.shards = self.shards, []
+        for task in self._reconnecting.values():
+            task.cancel()
+        self._reconnecting.clear()
+        self._down.clear()
+        for shard in shards:
+            shard.close()
+        for process in self._processes:
+            process.terminate()
+            process.join()
+        self._processes = []
+
+    def _load_snapshot(self, index: int, snapshot: list) -> Set[str]:
+        """Replace the mirrors of a shard's books; tickers whose book changed this way"""
+        count = len(self.shards)
+        stale = {ticker for ticker in engine.books if shard_of(ticker, count) == index}
+        for ticker, seq, bids, asks, users in snapshot:
+            engine.books[ticker] = MirrorBook(ticker, seq, bids, asks)
+            self._resting_users.update(users)
+            stale.add(ticker)
+        for ticker in stale - {ticker for ticker, *_ in snapshot}:
+            engine.drop(ticker)
+        return stale
+
+    def _lost(self, shard: ShardClient):
+        if shard not in self.shards:
+            return  # stop()
+        logger.error("Lost connection to matching shard %s, reconnecting", shard.index)
+        self._down.setdefault(shard.index, time.monotonic())
+        if shard.index not in self._reconnecting:
+            self._reconnecting[shard.index] = asyncio.get_running_loop().create_task(self._reconnect(shard))
+
+    async def _reconnect(self, shard: ShardClient):
+        delay = RECONNECT_DELAY
+        try:
+            while True:
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, RECONNECT_MAX_DELAY)
+                process = self._processes[shard.index] if self._spawn_args else None
+                try:
+                    if process is not None and not process.is_alive():
+                        logger.error("Matching shard %s exited with code %s, starting it again", shard.index, process.exitcode)
+                        self._processes[shard.index] = spawn_shard(shard.index, *self._spawn_args)
+                        continue
+                    await shard.open()
+                    tickers = self._load_snapshot(shard.index, await shard.call("subscribe"))
+                except (OSError, ConnectionError):
+                    continue
+                except Exception:
+                    # Любой другой сбой рукопожатия - тоже повтор, иначе шард останется недоступным до рестарта
+                    logger.exception("Resync with matching shard %s failed, retrying", shard.index)
+                    shard.close()
+                    continue
+                break
+        finally:
+            self._reconnecting.pop(shard.index, None)
+        self._down.pop(shard.index, None)
+        logger.info("Reconnected to matching shard %s", shard.index)
+        for ticker in tickers:
+            for listener in self.resync_listeners:
+                listener(ticker)
+
+    def down_for(self) -> float:
+        """Seconds the longest unreachable shard has been away; 0 if all are connected"""
+        if not self._down:
+            return 0.0
+        return time.monotonic() - min(self._down.values())
+
+    def on_push(self, kind: str, payload):
+        if kind == "update":
+            ticker, seq, bids, asks, fills = payload
+            update = BookUpdate(ticker=ticker, seq=seq, bids=bids, asks=asks, fills=_unpack_fills(fills))
+            book = engine.books.get(ticker)
+            if book is None:
+                book = engine.books[ticker] = MirrorBook(ticker)
+            book.apply(update)
+            for listener in engine.listeners:
+                listener(update)
+        elif kind == "drop":
+            engine.drop(payload)
+
+    def _shard(self, ticker: str) -> ShardClient:
+        return self.shards[shard_of(ticker, len(self.shards))]
+
+    async def submit(self, ticker: str, order: BookOrder) -> List[Fill]:
+        """Match an order; order.filled is updated as with engine.submit"""
+        if not self.shards:
+            return engine.submit(ticker, order)
+        return self._filled(order, await self._send(ticker, order))
+
+    async def submit_many(self, orders: Sequence[Tuple[str, BookOrder]]) -> List[Union[List[Fill], Exception]]:
+        """Submit in order; commands to the shards are pipelined instead of awaited one by one.
+
+        An order whose shard failed gets the exception instead of its fills,
+        so the orders other shards matched are still accounted for.
+        """
+        if not self.shards:
+            return [engine.submit(ticker, order) for ticker, order in orders]
+        replies = [self._send(ticker, order) for ticker, order in orders]
+        results = []
+        for (_, order), reply in zip(orders, replies):
+            try:
+                results.append(self._filled(order, await reply))
+            except Exception as error:
+                results.append(error)
+        return results
+
+    def _send(self, ticker: str, order: BookOrder) -> asyncio.Future:
+        try:
+            return self._shard(ticker).call(
+                "submit", ticker, order.id, order.user_id, order.direction, order.qty, order.price, order.time_in_force,
+                order.sweep_limit
+            )
+        except ConnectionError as error:
+            future = asyncio.get_running_loop().create_future()
+            future.set_exception(error)
+            return future
+
+    @staticmethod
+    def _filled(order: BookOrder, reply) -> List[Fill]:
+        order.filled, fills = reply
+        return _unpack_fills(fills)
+
+    async def cancel(self, ticker: str, order_id: str) -> Optional[int]:
+        """Take an order off the book; its filled, None if it was not resting"""
+        if not self.shards:
+            order = engine.cancel(ticker, order_id)
+            return order.filled if order is not None else None
+        return await self._shard(ticker).call("cancel", ticker, order_id)
+
+    async def cancel_many(self, ticker: str, order_ids: List[str]) -> List[Tuple[str, int]]:
+        """Take orders off one book in one step; (order_id, filled) of those that were resting"""
+        if not self.shards:
+            return [(order.id, order.filled) for order in engine.cancel_many(ticker, order_ids)]
+        return await self._shard(ticker).call("cancel_many", ticker, order_ids)
+
+    async def drop(self, ticker: str):
+        if not self.shards:
+            engine.drop(ticker)
+            return
+        await self._shard(ticker).call("drop", ticker)
+        engine.drop(ticker)
+
+    def resting_user_ids(self) -> Set[str]:
+        """Users with orders on the books, as of start() when sharded"""
+        if not self.shards:
+            return {order.user_id for book in engine.books.values() for order in book.orders.values()}
+        return self._resting_users
+
+
+matcher = Matcher()
+
+
+if __name__ == "__main__":
+    from app.core.database import TORTOISE_ORM
+
+    logging.basicConfig(level=settings.LOG_LEVEL)
+    count = settings.MATCHING_SHARDS
+    if count < 1:
+        raise SystemExit("Set MATCHING_SHARDS to the number of shard processes")
+    processes = spawn_shards(count, settings.MATCHING_SOCKET_DIR, shard_db_config(TORTOISE_ORM))
+    logger.info("Started %s matching shards in %s", count, settings.MATCHING_SOCKET_DIR)
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
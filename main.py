@@ -1,25 +1,91 @@
+import logging
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from app.api import auth, instrument, order, public, admin, balance
+from app.api import auth, instrument, order, public, admin, balance, health, metrics
 from app.core.config import settings
-from app.core.database import init_db
-from app.services.logging import log_requests
-import logging
+from app.core.database import TORTOISE_ORM, init_db, open_pools, close_db
+from app.services.logging import RequestLogMiddleware, setup_logging, shutdown_logging
+from app.services.sharding import matcher, shard_db_config
+from app.services.instruments import instruments
+from app.services.auth import warm_auth_cache
+from app.services.readiness import startup
+from app.services.settlement import start_journal, stop_journal
+from app.services.ledger import ledger
+from app.services.candles import candles
+from app.services.marketdata import hub
+from app.services.orderbook_cache import orderbook_cache
+from app.services.ratelimit import RateLimitMiddleware
+from app.services.metrics import MetricsMiddleware, instrument_db, start_loop_monitor, stop_loop_monitor
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    handlers=[
-        logging.FileHandler("app.log"),  # Логи в файл
-        logging.StreamHandler()         # Логи в консоль
-    ]
-)
+logger = logging.getLogger(__name__)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Warm every in-memory structure before the server accepts traffic"""
+    # Логи в файл и консоль через фоновый поток
+    setup_logging()
+    with startup.phase("database"):
+        await init_db(generate_schemas=settings.GENERATE_SCHEMAS)
+        instrument_db()
+        await open_pools()
+    with startup.phase("instruments"):
+        await instruments.load()
+        await instruments.require(settings.QUOTE_TICKER, create=settings.GENERATE_SCHEMAS)
+    # Инструмент, удалённый через другой процесс API: свечи и подписчики по нему
+    instruments.removed_listeners[:] = [candles.drop_ticker, hub.close, orderbook_cache.invalidate]
+    with startup.phase("order_books"):
+        # Книга, заново взятая у переподключённого шарда: кэш и подписчики - со снимка
+        matcher.resync_listeners[:] = [orderbook_cache.invalidate, hub.close]
+        orderbook_cache.reset()
+        await matcher.start(
+            settings.MATCHING_SHARDS, settings.MATCHING_SOCKET_DIR, settings.MATCHING_SPAWN,
+            shard_db_config(TORTOISE_ORM)
+        )
+    if settings.JOURNAL_DIR:
+        # Балансы и свечи загружаются здесь же, после хвоста журнала
+        with startup.phase("journal"):
+            replayed = await start_journal()
+        logger.info("Journal replayed", extra={"fields": {"events": replayed}})
+    else:
+        with startup.phase("balances"):
+            await ledger.load()
+        ledger.start(settings.LEDGER_FLUSH_INTERVAL_MS / 1000)
+        with startup.phase("candles"):
+            await candles.load()
+    candles.start(settings.CANDLES_FLUSH_INTERVAL_MS / 1000)
+    with startup.phase("auth_cache"):
+        # Ключи тех, у кого ордера в стаканах: они вернутся первыми
+        await warm_auth_cache(settings.AUTH_CACHE_WARMUP, matcher.resting_user_ids())
+    if settings.INSTRUMENTS_REFRESH_MS:
+        instruments.start(settings.INSTRUMENTS_REFRESH_MS / 1000)
+    start_loop_monitor()
+    startup.mark_ready()
+    logger.info("Startup complete", extra={"fields": startup.report()})
+
+    yield
+
+    startup.ready = False
+    await stop_loop_monitor()
+    await instruments.stop()
+    await matcher.stop()
+    # До close_db: дописать журнал и сбросить его хвост в базу
+    await stop_journal()
+    await ledger.stop()
+    await candles.stop()
+    await close_db()
+    shutdown_logging()
 
 app = FastAPI(
     title=settings.PROJECT_NAME,
-    openapi_url=f"{settings.API_V1_STR}/openapi.json"
+    openapi_url=f"{settings.API_V1_STR}/openapi.json",
+    lifespan=lifespan
 )
-app.middleware("http")(log_requests)
+app.add_middleware(RequestLogMiddleware)
+# Лимиты до роутинга и базы; отказы видны в метриках, но не в логе запросов
+app.add_middleware(RateLimitMiddleware)
+app.add_middleware(MetricsMiddleware)
 
 # Set all CORS enabled origins
 app.add_middleware(
@@ -37,7 +103,6 @@ app.include_router(order, prefix=settings.API_V1_STR)
 app.include_router(public, prefix=settings.API_V1_STR)
 app.include_router(admin, prefix=settings.API_V1_STR)
 app.include_router(balance, prefix=settings.API_V1_STR)
-
-@app.on_event("startup")
-async def startup_event():
-    await init_db()
\ No newline at end of file
+app.include_router(health, prefix=settings.API_V1_STR)
+# Prometheus ждёт /metrics в корне
+app.include_router(metrics)
\ No newline at end of file
@@ -0,0 +1,16 @@
+"""Tests run against in-memory SQLite with in-process matching.
+
+The settings are read once at import, so the environment is fixed here,
+before anything from `app` is imported.
+"""
+import os
+
+os.environ["DB_URL"] = "sqlite://:memory:"
+os.environ["DB_READ_URL"] = ""
+os.environ["GENERATE_SCHEMAS"] = "1"
+os.environ["MATCHING_SHARDS"] = "0"
+os.environ["JOURNAL_DIR"] = ""
+os.environ["LOG_FILE"] = ""
+os.environ["LOG_LEVEL"] = "WARNING"
+# Включается в тестах лимитов; остальные регистрируют пользователей без оглядки на них
+os.environ["RATE_LIMIT_ENABLED"] = "0"
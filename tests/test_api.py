@@ -0,0 +1,63 @@
+"""Rate limiting through the HTTP stack"""
+import uuid
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.core.config import settings
+from app.services import ratelimit
+from app.services.ratelimit import RateLimiter, parse_limits
+from main import app
+
+PREFIX = settings.API_V1_STR
+
+
+@pytest.fixture
+def client():
+    with TestClient(app) as client:
+        yield client
+
+
+@pytest.fixture
+def limits(monkeypatch):
+    """Burst of 5 market data requests, refilled far slower than the test runs"""
+    monkeypatch.setattr(settings, "RATE_LIMIT_ENABLED", True)
+    monkeypatch.setattr(ratelimit, "rate_limiter", RateLimiter(parse_limits(
+        "USER.market_data=0.1/5,ANON.market_data=0.1/5,USER.read=0.1/5"
+    )))
+
+
+def _register(client, name: str) -> dict:
+    response = client.post(f"{PREFIX}/public/register", json={"name": name})
+    response.raise_for_status()
+    return {"Authorization": f"TOKEN {response.json()['api_key']}"}
+
+
+def test_over_the_limit_gets_429_with_retry_after(client, limits):
+    statuses = [client.get(f"{PREFIX}/public/instrument").status_code for _ in range(6)]
+    assert statuses == [200] * 5 + [429]
+
+    response = client.get(f"{PREFIX}/public/instrument")
+    assert response.status_code == 429
+    assert response.json() == {"detail": "Rate limit exceeded"}
+    assert int(response.headers["Retry-After"]) >= 1
+
+
+def test_unverified_keys_share_the_address_bucket(client, limits):
+    # Новый ключ на каждый запрос не даёт нового ведра
+    statuses = [
+        client.get(f"{PREFIX}/public/instrument", headers={"Authorization": f"TOKEN {uuid.uuid4()}"}).status_code
+        for _ in range(6)
+    ]
+    assert statuses == [200] * 5 + [429]
+
+
+def test_verified_user_is_not_limited_by_a_neighbour(client, limits):
+    headers = _register(client, "patient")
+    assert client.get(f"{PREFIX}/balance", headers=headers).status_code == 200  # ключ проверен
+
+    for _ in range(10):
+        client.get(f"{PREFIX}/public/instrument", headers={"Authorization": f"TOKEN {uuid.uuid4()}"})
+    assert client.get(f"{PREFIX}/public/instrument").status_code == 429
+
+    assert client.get(f"{PREFIX}/public/instrument", headers=headers).status_code == 200
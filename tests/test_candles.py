@@ -0,0 +1,92 @@
+"""Candle aggregation: live trades and the rebuild from stored trades"""
+import asyncio
+import uuid
+from datetime import datetime, timezone
+
+from app.core.database import close_db, init_db
+from app.models.instrument import Instrument
+from app.models.trade import Trade
+from app.services.candles import CandleStore
+from app.services.instruments import instruments
+from app.services.matching import BUY, BookUpdate, Fill
+
+TICKER = "AAA"
+HOUR = 1_700_000_000 // 3600 * 3600  # начало часа, в прошлом
+TRADES = [(100, 2, HOUR + 1), (105, 1, HOUR + 10), (98, 3, HOUR + 20), (101, 1, HOUR + 59), (110, 4, HOUR + 61)]
+EXPECTED = {
+    "1m": [(HOUR, [100, 105, 98, 101, 7]), (HOUR + 60, [110, 110, 110, 110, 4])],
+    "5m": [(HOUR, [100, 110, 98, 110, 11])],
+    "1h": [(HOUR, [100, 110, 98, 110, 11])],
+    "1d": [(HOUR // 86400 * 86400, [100, 110, 98, 110, 11])],
+}
+
+
+async def _instrument() -> Instrument:
+    await init_db()
+    instrument = await Instrument.create(name=TICKER, ticker=TICKER)
+    await instruments.load()
+    return instrument
+
+
+async def _history(store: CandleStore, instrument: Instrument) -> dict:
+    return {period: await store.history(instrument, period, None, None, 10) for period in EXPECTED}
+
+
+def test_trades_fold_into_the_candle_of_every_period():
+    async def scenario():
+        instrument = await _instrument()
+        try:
+            store = CandleStore(memory=100)
+            for price, qty, ts in TRADES:
+                store.add(TICKER, price, qty, ts)
+            assert await _history(store, instrument) == EXPECTED
+            # [start, end) по началу свечи и последние limit
+            assert await store.history(instrument, "1m", HOUR + 60, None, 10) == EXPECTED["1m"][1:]
+            assert await store.history(instrument, "1m", None, HOUR + 60, 10) == EXPECTED["1m"][:1]
+            assert await store.history(instrument, "1m", None, None, 1) == EXPECTED["1m"][1:]
+        finally:
+            await close_db()
+
+    asyncio.run(scenario())
+
+
+def test_startup_rebuilds_candles_from_stored_trades():
+    async def scenario():
+        instrument = await _instrument()
+        try:
+            for price, qty, ts in TRADES:
+                await Trade.create(
+                    instrument_id=instrument.id, ticker=TICKER, price=price, qty=qty,
+                    buy_order_id=uuid.uuid4(), sell_order_id=uuid.uuid4(), buyer_id=uuid.uuid4(), seller_id=uuid.uuid4(),
+                    executed_at=datetime.fromtimestamp(ts, timezone.utc),
+                )
+            store = CandleStore(memory=100)
+            await store.load()
+            assert await _history(store, instrument) == EXPECTED
+
+            # Уже сброшенные свечи читаются из таблицы и после следующего рестарта
+            store = CandleStore(memory=100)
+            await store.load()
+            assert await _history(store, instrument) == EXPECTED
+        finally:
+            await close_db()
+
+    asyncio.run(scenario())
+
+
+def test_late_update_lands_in_the_candle_of_its_trades():
+    async def scenario():
+        instrument = await _instrument()
+        try:
+            store = CandleStore(memory=100)
+            # Например, обновление шарда после переподключения: сделки час назад
+            fills = [
+                Fill(price, qty, "maker", "seller", qty, qty, "taker", "buyer", BUY, ts)
+                for price, qty, ts in TRADES
+            ]
+            store.on_update(BookUpdate(ticker=TICKER, seq=1, bids=[], asks=[], fills=fills))
+            assert await _history(store, instrument) == EXPECTED
+        finally:
+            await close_db()
+
+    asyncio.run(scenario())
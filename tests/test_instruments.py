@@ -0,0 +1,39 @@
+"""Instrument registry: changes made by another API process"""
+import asyncio
+
+from app.core.database import close_db, init_db
+from app.models.instrument import Instrument
+from app.services.instruments import InstrumentRegistry
+
+
+def test_refresh_picks_up_instruments_of_other_processes():
+    async def scenario():
+        await init_db()
+        try:
+            mine, other = InstrumentRegistry(), InstrumentRegistry()
+            removed = []
+            mine.removed_listeners.append(removed.append)
+            await mine.load()
+
+            # Другой процесс создаёт инструмент
+            other.add(await Instrument.create(name="AAA", ticker="AAA"))
+            assert mine.get("AAA") is None
+            await mine.refresh()
+            assert mine.get("AAA").ticker == "AAA"
+            assert [item["ticker"] for item in mine.listing()] == ["AAA"]
+
+            # ... удаляет и создаёт заново с тем же тикером
+            await Instrument.filter(ticker="AAA").delete()
+            recreated = await Instrument.create(name="AAA", ticker="AAA")
+            await mine.refresh()
+            assert removed == ["AAA"]
+            assert mine.get("AAA").id == recreated.id
+
+            await recreated.delete()
+            await mine.refresh()
+            assert mine.get("AAA") is None and mine.listing() == []
+            assert removed == ["AAA", "AAA"]
+        finally:
+            await close_db()
+
+    asyncio.run(scenario())
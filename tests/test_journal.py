@@ -0,0 +1,162 @@
+"""Journal crash recovery: every acknowledged event survives a crash before settlement"""
+import asyncio
+import os
+import random
+import uuid
+from collections import defaultdict
+
+import pytest
+
+from app.core.config import settings
+from app.core.database import close_db, init_db
+from app.models.balance import Balance
+from app.models.instrument import Instrument
+from app.models.order import Order, OPEN_STATUSES, CANCELLED
+from app.models.user import User
+from app.schemas.order import OrderCreateRequest
+from app.services import settlement
+from app.services.balance import credit_many
+from app.services.instruments import instruments
+from app.services.journal import journal
+from app.services.ledger import ledger
+from app.services.matching import engine, restore_books
+from app.services.settlement import Settler, cancel_order, place_orders, start_journal, stop_journal
+
+TICKER = "AAA"
+BALANCES = {settings.QUOTE_TICKER: 1_000_000, TICKER: 10_000}
+
+
+async def _seed(users: int) -> list:
+    created = {ticker: await Instrument.create(name=ticker, ticker=ticker) for ticker in BALANCES}
+    users = [await User.create(name=f"trader-{i}", api_key=uuid.uuid4().hex) for i in range(users)]
+    await credit_many([(user.id, created[ticker].id, amount) for user in users for ticker, amount in BALANCES.items()])
+    return [str(user.id) for user in users]
+
+
+async def _start() -> int:
+    engine.clear()
+    await instruments.load()
+    await restore_books()
+    return await start_journal()
+
+
+async def _crash():
+    """Drop what a killed process loses: the books, the ledger and events not settled yet.
+
+    Acknowledged events are fsynced already, so closing the journal adds
+    nothing to it; the settler's queue is abandoned unwritten.
+    """
+    journal.listeners.remove(settlement.settler.submit)
+    await journal.close()
+    engine.clear()
+    # Оборванная запись в конце, как при падении посреди write
+    last = sorted(name for name in os.listdir(settings.JOURNAL_DIR) if name.endswith(".wal"))[-1]
+    with open(os.path.join(settings.JOURNAL_DIR, last), "ab") as file:
+        file.write(b"\x00\x00\x00\x60\xde\xad\xbe\xef\x01\x00")
+
+
+async def _trade(user_ids: list, orders: int) -> tuple:
+    rnd = random.Random(7)
+    acked, cancelled = {}, set()
+    for _ in range(orders):
+        user_id = rnd.choice(user_ids)
+        mine = [order_id for order_id, owner in acked.items() if owner == user_id and order_id not in cancelled]
+        if mine and rnd.random() < 0.1:
+            order_id = rnd.choice(mine)
+            if await cancel_order(user_id, order_id):
+                cancelled.add(order_id)
+            continue
+        direction = rnd.choice(("BUY", "SELL"))
+        order = OrderCreateRequest(
+            direction=direction, ticker=TICKER, qty=rnd.randint(1, 10),
+            price=100 + rnd.randint(-5, 2) * (1 if direction == "BUY" else -1)
+        )
+        order_id, = await place_orders(user_id, [order])
+        if order_id is not None:
+            acked[order_id] = user_id
+    return acked, cancelled
+
+
+def _book() -> tuple:
+    return engine.depth(TICKER, 1000)
+
+
+def test_acknowledged_events_survive_a_crash(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "JOURNAL_DIR", str(tmp_path / "journal"))
+    # База не успевает ничего получить до падения
+    monkeypatch.setattr(settings, "JOURNAL_SETTLE_INTERVAL_MS", 3_600_000)
+
+    async def scenario():
+        await init_db()
+        try:
+            user_ids = await _seed(3)
+            await _start()
+            acked, cancelled = await _trade(user_ids, 400)
+            book = _book()
+            available = {user_id: await ledger.available(user_id) for user_id in user_ids}
+            assert await Order.all().count() == 0
+
+            await _crash()
+            monkeypatch.setattr(settlement, "settler", Settler())
+            replayed = await _start()
+
+            assert replayed > len(acked)
+            assert _book() == book
+            assert {user_id: await ledger.available(user_id) for user_id in user_ids} == available
+
+            await settlement.settler.sync()
+            orders = {str(order_id): (status, qty, filled, direction, price) for order_id, status, qty, filled, direction, price in
+                      await Order.all().values_list("id", "status", "qty", "filled", "direction", "price")}
+            assert set(acked) <= set(orders)
+            assert all(orders[order_id][0] == CANCELLED for order_id in cancelled)
+
+            resting = {"BUY": defaultdict(int), "SELL": defaultdict(int)}
+            for status, qty, filled, direction, price in orders.values():
+                if status in OPEN_STATUSES:
+                    resting[direction][price] += qty - filled
+            bids, asks = book
+            assert dict(bids) == dict(resting["BUY"]) and dict(asks) == dict(resting["SELL"])
+
+            # Сделки только перекладывают средства
+            totals = defaultdict(int)
+            for ticker, amount in await Balance.all().values_list("instrument__ticker", "amount"):
+                totals[ticker] += amount
+            assert dict(totals) == {ticker: amount * len(user_ids) for ticker, amount in BALANCES.items()}
+        finally:
+            await stop_journal()
+            await close_db()
+
+    asyncio.run(scenario())
+
+
+def test_failed_journal_write_rolls_the_books_back(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "JOURNAL_DIR", str(tmp_path / "journal"))
+
+    async def scenario():
+        await init_db()
+        try:
+            user_ids = await _seed(2)
+            await _start()
+            await _trade(user_ids, 50)
+            book = _book()
+            available = {user_id: await ledger.available(user_id) for user_id in user_ids}
+
+            def broken(data, last_seq):
+                raise OSError("disk failed")
+
+            monkeypatch.setattr(journal, "_write", broken)
+            crossing = OrderCreateRequest(direction="BUY", ticker=TICKER, qty=50, price=200)
+            with pytest.raises(OSError):
+                await place_orders(user_ids[0], [crossing])
+
+            assert journal.error is not None
+            assert _book() == book
+            assert {user_id: await ledger.available(user_id) for user_id in user_ids} == available
+            with pytest.raises(RuntimeError):
+                await place_orders(user_ids[1], [crossing])
+            assert _book() == book
+        finally:
+            await stop_journal()
+            await close_db()
+
+    asyncio.run(scenario())
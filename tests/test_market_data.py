@@ -0,0 +1,115 @@
+"""Public market data through the HTTP stack"""
+import pytest
+from fastapi.testclient import TestClient
+
+from app.core.config import settings
+from app.models.user import User
+from app.services.orderbook_cache import orderbook_cache
+from main import app
+
+PREFIX = settings.API_V1_STR
+TICKER = "AAA"
+
+
+@pytest.fixture
+def client():
+    with TestClient(app) as client:
+        yield client
+
+
+def _register(client, name: str, admin: bool = False) -> dict:
+    response = client.post(f"{PREFIX}/public/register", json={"name": name})
+    response.raise_for_status()
+    user = response.json()
+    if admin:
+        client.portal.call(lambda: User.filter(id=user["id"]).update(role="ADMIN"))
+    return {"headers": {"Authorization": f"TOKEN {user['api_key']}"}, "id": user["id"]}
+
+
+@pytest.fixture
+def trader(client):
+    """Holds both sides, so it can trade with itself"""
+    admin = _register(client, "admin", admin=True)
+    client.post(f"{PREFIX}/admin/instrument", json={"name": TICKER, "ticker": TICKER}, headers=admin["headers"]).raise_for_status()
+    trader = _register(client, "trader")
+    for ticker, amount in ((TICKER, 1000), (settings.QUOTE_TICKER, 1_000_000)):
+        client.post(
+            f"{PREFIX}/admin/balance/deposit", json={"user_id": trader["id"], "ticker": ticker, "amount": amount},
+            headers=admin["headers"]
+        ).raise_for_status()
+    return trader
+
+
+def _place(client, trader: dict, direction: str, qty: int, price: int):
+    client.post(
+        f"{PREFIX}/order", json={"direction": direction, "ticker": TICKER, "qty": qty, "price": price},
+        headers=trader["headers"]
+    ).raise_for_status()
+
+
+def _orderbook(client, etag: str = None, limit: int = 10):
+    return client.get(
+        f"{PREFIX}/public/orderbook/{TICKER}", params={"limit": limit},
+        headers={"If-None-Match": etag} if etag else {}
+    )
+
+
+def test_orderbook_is_not_modified_until_the_book_changes(client, trader):
+    _place(client, trader, "SELL", 5, 100)
+    first = _orderbook(client)
+    etag = first.headers["ETag"]
+    assert first.json() == {"bid_levels": [], "ask_levels": [{"price": 100.0, "qty": 5}]}
+
+    cached = _orderbook(client, etag)
+    assert cached.status_code == 304
+    assert cached.content == b""
+    assert cached.headers["ETag"] == etag
+    # Другая глубина - другой ответ
+    assert _orderbook(client, etag, limit=5).status_code == 200
+
+    _place(client, trader, "BUY", 2, 90)
+    changed = _orderbook(client, etag)
+    assert changed.status_code == 200
+    assert changed.headers["ETag"] != etag
+    assert changed.json()["bid_levels"] == [{"price": 90.0, "qty": 2}]
+
+
+def test_if_none_match_accepts_a_list_and_a_wildcard(client, trader):
+    _place(client, trader, "SELL", 5, 100)
+    etag = _orderbook(client).headers["ETag"]
+
+    assert _orderbook(client, f'"stale", {etag}').status_code == 304
+    assert _orderbook(client, '"stale"').status_code == 200
+    assert _orderbook(client, "*").status_code == 304
+
+
+def test_if_none_match_compares_weak_etags(client, trader):
+    _place(client, trader, "SELL", 5, 100)
+    etag = _orderbook(client).headers["ETag"]
+
+    # Прокси и CDN могут ослабить ETag при пересжатии ответа
+    assert _orderbook(client, f"W/{etag}").status_code == 304
+    assert _orderbook(client, f'W/"stale", W/{etag}').status_code == 304
+    assert _orderbook(client, 'W/"stale"').status_code == 200
+
+
+def test_book_taken_anew_gets_new_etags(client, trader):
+    _place(client, trader, "SELL", 5, 100)
+    etag = _orderbook(client).headers["ETag"]
+
+    # Шард переподключён или книги откачены: seq мог начаться заново
+    orderbook_cache.invalidate(TICKER)
+    assert _orderbook(client, etag).status_code == 200
+
+
+def test_candles_aggregate_the_trades(client, trader):
+    for maker, taker, qty, price in (("SELL", "BUY", 2, 100), ("SELL", "BUY", 1, 105), ("BUY", "SELL", 3, 98)):
+        _place(client, trader, maker, qty, price)
+        _place(client, trader, taker, qty, price)
+
+    # Сутки: сделки теста не разойдутся по двум свечам
+    candles = client.get(f"{PREFIX}/public/candles/{TICKER}", params={"interval": "1d"}).json()
+    assert [{key: candle[key] for key in ("open", "high", "low", "close", "volume")} for candle in candles] == [
+        {"open": 100, "high": 105, "low": 98, "close": 98, "volume": 6}
+    ]
+    assert client.get(f"{PREFIX}/public/candles/UNKNOWN").status_code == 404
@@ -0,0 +1,66 @@
+"""Price-time priority of the in-memory order book"""
+import itertools
+
+from app.services.matching import BUY, SELL, BookOrder, OrderBook
+
+_ids = itertools.count(1)
+
+
+def _order(direction: str, qty: int, price, user: str = "u", **kwargs) -> BookOrder:
+    return BookOrder(id=str(next(_ids)), user_id=user, direction=direction, qty=qty, price=price, **kwargs)
+
+
+def _fills(fills) -> list:
+    return [(fill.maker_order_id, fill.price, fill.qty) for fill in fills]
+
+
+def test_better_price_fills_first_at_the_makers_price():
+    book = OrderBook("AAA")
+    worse, better = _order(SELL, 5, 101), _order(SELL, 5, 100)
+    book.submit(worse)
+    book.submit(better)
+
+    fills = book.submit(_order(BUY, 7, 105))
+    assert _fills(fills) == [(better.id, 100, 5), (worse.id, 101, 2)]
+    assert book.depth(10) == ([], [(101, 3)])
+
+
+def test_same_price_fills_in_arrival_order():
+    book = OrderBook("AAA")
+    first, second, third = (_order(SELL, 3, 100, user) for user in ("a", "b", "c"))
+    for order in (first, second, third):
+        book.submit(order)
+
+    assert _fills(book.submit(_order(BUY, 4, 100))) == [(first.id, 100, 3), (second.id, 100, 1)]
+    # Частично исполненный остаётся первым в очереди своего уровня
+    assert _fills(book.submit(_order(BUY, 3, 100))) == [(second.id, 100, 2), (third.id, 100, 1)]
+    assert book.depth(10) == ([], [(100, 2)])
+
+
+def test_remainder_rests_behind_earlier_orders_of_its_level():
+    book = OrderBook("AAA")
+    maker = _order(SELL, 2, 100)
+    book.submit(maker)
+
+    taker = _order(BUY, 5, 100)
+    assert _fills(book.submit(taker)) == [(maker.id, 100, 2)]
+    assert taker.filled == 2
+    assert book.depth(10) == ([(100, 3)], [])
+
+    # Не пересекается - встаёт в очередь после taker
+    later = _order(BUY, 1, 100)
+    assert book.submit(later) == []
+    assert book.submit(_order(SELL, 1, 99))[0].maker_order_id == taker.id
+    assert book.submit(_order(SELL, 1, 101)) == []
+    assert book.depth(10) == ([(100, 3)], [(101, 1)])
+
+
+def test_cancelled_order_loses_its_place():
+    book = OrderBook("AAA")
+    first, second = _order(BUY, 1, 100), _order(BUY, 1, 100)
+    book.submit(first)
+    book.submit(second)
+
+    assert book.cancel(first.id) is first
+    assert _fills(book.submit(_order(SELL, 2, 100))) == [(second.id, 100, 1)]
+    assert book.depth(10) == ([], [(100, 1)])
@@ -0,0 +1,75 @@
+"""Balance invariants under concurrent deposits and withdrawals"""
+import asyncio
+import random
+import uuid
+
+from app.core.database import close_db, init_db
+from app.models.balance import Balance
+from app.models.instrument import Instrument
+from app.models.user import User
+from app.services import balance as balance_service
+from app.services.balance import InsufficientFunds
+
+
+async def _balance():
+    await init_db()
+    user = await User.create(name="stress", api_key=uuid.uuid4().hex)
+    instrument = await Instrument.create(name="Stress", ticker="STRESS")
+    return user, instrument
+
+
+async def _withdraw(user, instrument, amount: int) -> bool:
+    try:
+        await balance_service.debit(user.id, instrument.id, amount)
+    except InsufficientFunds:
+        return False
+    return True
+
+
+def test_parallel_withdrawals_do_not_overdraw():
+    async def scenario():
+        user, instrument = await _balance()
+        try:
+            await balance_service.credit(user.id, instrument.id, 1000)
+            # Вдвое больше, чем есть на балансе
+            results = await asyncio.gather(*(_withdraw(user, instrument, 10) for _ in range(200)))
+            return results, (await Balance.get(user=user, instrument=instrument)).amount
+        finally:
+            await close_db()
+
+    results, final = asyncio.run(scenario())
+    assert results.count(True) == 100
+    assert final == 0
+
+
+def test_parallel_deposits_and_withdrawals_add_up():
+    async def scenario():
+        user, instrument = await _balance()
+        rnd = random.Random(42)
+        deposited = withdrawn = 0
+
+        async def deposit(amount: int):
+            nonlocal deposited
+            await balance_service.credit(user.id, instrument.id, amount)
+            deposited += amount
+
+        async def withdraw(amount: int):
+            nonlocal withdrawn
+            if await _withdraw(user, instrument, amount):
+                withdrawn += amount
+
+        try:
+            operations = []
+            for _ in range(2000):
+                amount = rnd.randint(1, 100)
+                operations.append(deposit(amount) if rnd.random() < 0.5 else withdraw(amount))
+            await asyncio.gather(*operations)
+            final = (await Balance.get(user=user, instrument=instrument)).amount
+            return deposited, withdrawn, final
+        finally:
+            await close_db()
+
+    deposited, withdrawn, final = asyncio.run(scenario())
+    assert withdrawn > 0
+    assert final == deposited - withdrawn
+    assert final >= 0
@@ -0,0 +1,205 @@
+"""Orders through the HTTP stack: order types, cancels, paging"""
+import pytest
+from fastapi.testclient import TestClient
+
+from app.core.config import settings
+from app.models.user import User
+from main import app
+
+PREFIX = settings.API_V1_STR
+QUOTE = settings.QUOTE_TICKER
+TICKER = "AAA"
+
+
+@pytest.fixture
+def client():
+    with TestClient(app) as client:
+        yield client
+
+
+def _register(client, name: str, admin: bool = False) -> dict:
+    response = client.post(f"{PREFIX}/public/register", json={"name": name})
+    response.raise_for_status()
+    user = response.json()
+    if admin:
+        # До первого запроса с ключом: роль кэшируется вместе с ним
+        client.portal.call(lambda: User.filter(id=user["id"]).update(role="ADMIN"))
+    return {"Authorization": f"TOKEN {user['api_key']}", "id": user["id"]}
+
+
+def _headers(user: dict) -> dict:
+    return {"Authorization": user["Authorization"]}
+
+
+@pytest.fixture
+def traders(client):
+    """A seller with 100 AAA and a buyer with 10 000 of the quote currency"""
+    admin = _register(client, "admin", admin=True)
+    client.post(f"{PREFIX}/admin/instrument", json={"name": TICKER, "ticker": TICKER}, headers=_headers(admin)).raise_for_status()
+    seller, buyer = _register(client, "seller"), _register(client, "buyer")
+    for user, ticker, amount in ((seller, TICKER, 100), (buyer, QUOTE, 10_000)):
+        client.post(
+            f"{PREFIX}/admin/balance/deposit", json={"user_id": user["id"], "ticker": ticker, "amount": amount},
+            headers=_headers(admin)
+        ).raise_for_status()
+    return seller, buyer
+
+
+def _place(client, user: dict, direction: str, qty: int, price=None, time_in_force: str = "GTC",
+           ticker: str = TICKER) -> dict:
+    response = client.post(f"{PREFIX}/order", json={
+        "direction": direction, "ticker": ticker, "qty": qty, "price": price, "time_in_force": time_in_force
+    }, headers=_headers(user))
+    response.raise_for_status()
+    order = client.get(f"{PREFIX}/order/{response.json()['order_id']}", headers=_headers(user))
+    order.raise_for_status()
+    return order.json()
+
+
+def _book(client, ticker: str = TICKER) -> tuple:
+    book = client.get(f"{PREFIX}/public/orderbook/{ticker}").json()
+    return (
+        [(level["price"], level["qty"]) for level in book["bid_levels"]],
+        [(level["price"], level["qty"]) for level in book["ask_levels"]],
+    )
+
+
+def _balance(client, user: dict) -> dict:
+    return client.get(f"{PREFIX}/balance", headers=_headers(user)).json()
+
+
+def _status(client, user: dict, order: dict) -> tuple:
+    order = client.get(f"{PREFIX}/order/{order['id']}", headers=_headers(user)).json()
+    return order["status"], order["filled"]
+
+
+def _asks(client, seller: dict):
+    _place(client, seller, "SELL", 5, 100)
+    _place(client, seller, "SELL", 5, 102)
+
+
+def test_fok_that_cannot_fill_completely_does_not_trade(client, traders):
+    seller, buyer = traders
+    _asks(client, seller)
+
+    order = _place(client, buyer, "BUY", 11, 102, "FOK")
+    assert (order["status"], order["filled"]) == ("CANCELLED", 0)
+    assert _book(client) == ([], [(100.0, 5), (102.0, 5)])
+    assert _balance(client, buyer) == {QUOTE: 10_000}
+
+
+def test_fok_fills_across_levels_when_there_is_enough(client, traders):
+    seller, buyer = traders
+    _asks(client, seller)
+
+    order = _place(client, buyer, "BUY", 8, 102, "FOK")
+    assert (order["status"], order["filled"]) == ("FILLED", 8)
+    assert _book(client) == ([], [(102.0, 2)])
+    assert _balance(client, buyer) == {QUOTE: 10_000 - 5 * 100 - 3 * 102, TICKER: 8}
+
+
+def test_ioc_remainder_is_cancelled_and_its_reservation_released(client, traders):
+    seller, buyer = traders
+    _asks(client, seller)
+
+    order = _place(client, buyer, "BUY", 8, 101, "IOC")
+    assert (order["status"], order["filled"]) == ("CANCELLED", 5)
+    assert _book(client) == ([], [(102.0, 5)])
+    assert _balance(client, buyer) == {QUOTE: 10_000 - 5 * 100, TICKER: 5}
+
+
+def test_market_order_sweeps_the_book_and_cancels_the_rest(client, traders):
+    seller, buyer = traders
+    _asks(client, seller)
+
+    order = _place(client, buyer, "BUY", 12)
+    assert (order["status"], order["filled"], order["body"]["price"]) == ("CANCELLED", 10, None)
+    assert _book(client) == ([], [])
+    assert _balance(client, buyer) == {QUOTE: 10_000 - 5 * 100 - 5 * 102, TICKER: 10}
+
+    # Встречных заявок нет: отменяется сразу, ничего не резервируя
+    order = _place(client, buyer, "BUY", 1)
+    assert (order["status"], order["filled"]) == ("CANCELLED", 0)
+    assert _balance(client, buyer) == {QUOTE: 10_000 - 5 * 100 - 5 * 102, TICKER: 10}
+
+
+def test_cancel_keeps_the_order_with_its_fills(client, traders):
+    seller, buyer = traders
+    order = _place(client, seller, "SELL", 10, 100)
+    _place(client, buyer, "BUY", 4, 100)
+
+    assert client.delete(f"{PREFIX}/order/{order['id']}", headers=_headers(seller)).json() == {"success": True}
+    assert _status(client, seller, order) == ("CANCELLED", 4)
+    assert _book(client) == ([], [])
+    assert _balance(client, seller) == {TICKER: 96, QUOTE: 400}
+    # Уже отменён
+    assert client.delete(f"{PREFIX}/order/{order['id']}", headers=_headers(seller)).status_code == 400
+
+
+def test_cancel_all_takes_only_the_users_open_orders(client, traders):
+    seller, buyer = traders
+    admin = _register(client, "admin2", admin=True)
+    client.post(f"{PREFIX}/admin/instrument", json={"name": "BBB", "ticker": "BBB"}, headers=_headers(admin)).raise_for_status()
+    client.post(
+        f"{PREFIX}/admin/balance/deposit", json={"user_id": seller["id"], "ticker": "BBB", "amount": 10},
+        headers=_headers(admin)
+    ).raise_for_status()
+
+    filled = _place(client, seller, "SELL", 2, 100)
+    _place(client, buyer, "BUY", 2, 100)
+    partial = _place(client, seller, "SELL", 5, 101)
+    _place(client, buyer, "BUY", 1, 101)
+    resting = [_place(client, seller, "SELL", 1, price) for price in (103, 104)]
+    other_ticker = _place(client, seller, "SELL", 3, 50, ticker="BBB")
+    bid = _place(client, buyer, "BUY", 1, 90)
+
+    response = client.request("DELETE", f"{PREFIX}/order", params={"ticker": TICKER}, headers=_headers(seller))
+    assert response.json() == {"success": True, "cancelled": 3}
+    assert _status(client, seller, filled) == ("FILLED", 2)
+    assert _status(client, seller, partial) == ("CANCELLED", 1)
+    assert [_status(client, seller, order) for order in resting] == [("CANCELLED", 0)] * 2
+    assert _status(client, seller, other_ticker) == ("NEW", 0)
+    assert _status(client, buyer, bid) == ("NEW", 0)
+    assert _book(client) == ([(90.0, 1)], [])
+    assert _balance(client, seller) == {TICKER: 97, QUOTE: 301, "BBB": 7}
+
+    response = client.request("DELETE", f"{PREFIX}/order", headers=_headers(seller))
+    assert response.json() == {"success": True, "cancelled": 1}
+    assert _book(client, "BBB") == ([], [])
+    assert _balance(client, seller)["BBB"] == 10
+
+
+def _pages(client, user: dict, **params) -> list:
+    pages, cursor = [], None
+    while True:
+        response = client.get(
+            f"{PREFIX}/order", params={**params, **({"cursor": cursor} if cursor else {})}, headers=_headers(user)
+        )
+        response.raise_for_status()
+        pages.append([order["id"] for order in response.json()])
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            return pages
+
+
+def test_cursor_pages_cover_the_history_newest_first(client, traders):
+    seller, _ = traders
+    placed = [_place(client, seller, "SELL", 1, 100 + i)["id"] for i in range(7)]
+    client.delete(f"{PREFIX}/order/{placed[2]}", headers=_headers(seller)).raise_for_status()
+
+    pages = _pages(client, seller, limit=3)
+    assert [len(page) for page in pages] == [3, 3, 1]
+    assert sum(pages, []) == placed[::-1]
+    # Без limit - вся история одним потоком, в том же порядке
+    streamed = client.get(f"{PREFIX}/order", headers=_headers(seller)).json()
+    assert [order["id"] for order in streamed] == placed[::-1]
+
+    assert sum(_pages(client, seller, limit=2, status="NEW"), []) == [order_id for order_id in placed[::-1] if order_id != placed[2]]
+    assert _pages(client, seller, limit=2, status="CANCELLED") == [[placed[2]]]
+    assert _pages(client, seller, limit=2, ticker="BBB") == [[]]
+
+
+def test_malformed_cursor_is_rejected(client, traders):
+    seller, _ = traders
+    response = client.get(f"{PREFIX}/order", params={"limit": 2, "cursor": "not-a-cursor"}, headers=_headers(seller))
+    assert response.status_code == 400